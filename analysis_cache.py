@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from audio_analyzer import ANALYZER_VERSION
+from audio_io import DEFAULT_RES_TYPE
+from features import DEFAULT_FEATURE_ENGINE, DEFAULT_TEMPO_BACKEND
+
+DEFAULT_CACHE_DIR = os.environ.get("MUSICVISION_CACHE_DIR", ".musicvision_cache")
+
+
+def content_hash(data):
+    """
+    Hash raw uploaded bytes.
+
+    Parameters:
+    data (bytes): File contents
+
+    Returns:
+    str: Hex SHA-256 digest
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def analysis_key(data, sample_rate, duration, engine=DEFAULT_FEATURE_ENGINE, res_type=DEFAULT_RES_TYPE,
+                 tempo_backend=DEFAULT_TEMPO_BACKEND, classifier="heuristic"):
+    """
+    Build the cache key for one analysis request.
+
+    Parameters:
+    data (bytes): Uploaded file contents
+    sample_rate (int or None): Analysis sample rate, None for the native rate
+    duration (float or None): Seconds analyzed, None for the full song
+    engine (str): Feature engine used
+    res_type (str): Resampler used by the load path
+    tempo_backend (str): Tempo estimator used
+    classifier (str): Name of the analyzer's classifier backend
+
+    Returns:
+    str: Cache key
+    """
+    return (f"{content_hash(data)}:{sample_rate}:{duration}:{engine}:{res_type}:{tempo_backend}:{classifier}"
+            f":v{ANALYZER_VERSION}")
+
+
+def timeline_key(data, sample_rate, window, hop, res_type=DEFAULT_RES_TYPE, classifier="heuristic"):
+    """
+    Build the cache key for the segment timeline of one upload.
+
+    The key leaves out the analyzed duration: every duration shares one entry,
+    which grows as longer durations are requested.
+
+    Parameters:
+    data (bytes): Uploaded file contents
+    sample_rate (int or None): Analysis sample rate, None for the native rate
+    window (float): Segment length in seconds
+    hop (float): Seconds between segment starts
+    res_type (str): Resampler used by the load path
+    classifier (str): Name of the analyzer's classifier backend
+
+    Returns:
+    str: Cache key
+    """
+    return f"timeline:{content_hash(data)}:{sample_rate}:{window}:{hop}:{res_type}:{classifier}:v{ANALYZER_VERSION}"
+
+
+class AnalysisCache:
+    """
+    Two-tier cache for analyze_audio results.
+
+    Results are held in an in-process LRU and persisted to a SQLite file that
+    is shared by every session and process using the same cache directory.
+    The disk tier evicts least recently used entries once it grows past
+    max_disk_bytes. Both tiers keep results serialized, so every get returns
+    a fresh dict that callers are free to modify.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, memory_items=128, max_disk_bytes=64 * 2**20):
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "analysis.sqlite3")
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Parameters:
+        key (str): Key from analysis_key
+
+        Returns:
+        dict or None: Cached analysis results
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return json.loads(self._memory[key])
+
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+
+            self._remember(key, row[0])
+            return json.loads(row[0])
+
+    def put(self, key, result):
+        """
+        Store a result in both tiers.
+
+        Parameters:
+        key (str): Key from analysis_key
+        result (dict): JSON serializable analysis results
+        """
+        value = json.dumps(result)
+        with self._lock:
+            self._remember(key, value)
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self._evict()
+            self._db.commit()
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached result for key, computing and storing it on a miss.
+
+        Parameters:
+        key (str): Key from analysis_key
+        compute (callable): Zero-argument function producing the result
+
+        Returns:
+        dict: Analysis results
+        """
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        rows = self._db.execute("SELECT key, size FROM results ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_disk_bytes:
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
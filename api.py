@@ -0,0 +1,376 @@
+"""
+HTTP analysis API.
+
+Usage:
+    python -m api --port 8000 --workers 4
+
+Endpoints:
+    POST /analyze          request body is one audio file; responds with the analyze_audio result
+    POST /analyze/batch    multipart/form-data with one file per part; responds with
+                           {"results": [{"filename", "result"} or {"filename", "error"}, ...]}
+    GET  /health           worker, queue and worker pool state
+    GET  /metrics          the same in the Prometheus text format
+
+Both analyze endpoints take the app's settings as query parameters: sr
+(default 22050), duration (seconds, default 30, 0 for the full song,
+"preview" for excerpts spread across the track) and
+resample (quality, fast, native or any librosa res_type). /analyze also takes
+filename, whose extension helps decode formats soundfile can't read.
+
+Analyses run on a JobQueue shared by all connections, with the same result
+and decoded-audio caches and in-flight deduplication as the Streamlit app. Once max_pending
+analyses are waiting, further requests are answered with 429 and a
+Retry-After header before their bodies are read.
+
+Unless --no-supervisor is given, each analysis runs in a supervised worker
+process (see supervisor.WorkerPool). A file that takes longer than
+--task-timeout seconds or grows its process past --max-rss-mb fails with 422
+and an error body that says why: {"error", "reason": "timeout", "memory" or
+"crashed", plus the limit that was hit}.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from analysis_cache import AnalysisCache, analysis_key, content_hash
+from classifiers import DEFAULT_CLASSIFIER, load_classifier
+from audio_io import PREVIEW, resample_settings
+from jobs import (DEFAULT_MAX_JOBS, DEFAULT_MAX_PENDING, DEFAULT_SUPERVISED, FAILED, JobQueue, QueueFull,
+                  init_worker, metrics_to_prometheus, upload_compute)
+from pcm_cache import PCMCache
+from similarity import VectorStore, split_vector, track_metadata
+from supervisor import DEFAULT_MAX_RSS_BYTES, DEFAULT_MAX_TASKS, DEFAULT_TASK_TIMEOUT, WorkerError, WorkerPool
+from warmup import enable_jit_cache, warm_up
+
+SAMPLE_RATES = [22050, 44100, 48000]
+
+# Largest request body accepted, in bytes
+MAX_UPLOAD_BYTES = int(os.environ.get("MUSICVISION_MAX_UPLOAD_MB", "200")) * 2**20
+# Seconds a request waits for its analysis before giving up with 504
+REQUEST_TIMEOUT = float(os.environ.get("MUSICVISION_REQUEST_TIMEOUT", "600"))
+
+_READ_CHUNK = 64 * 2**10
+
+
+class RequestError(Exception):
+    """A request that is answered with an error status instead of a result."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def request_settings(query):
+    """
+    Resolve query parameters to analysis settings.
+
+    Parameters:
+    query (str): URL query string
+
+    Returns:
+    tuple: (target sample rate or None, duration or None, res_type)
+    """
+    params = parse_qs(query)
+
+    def param(name, default):
+        return params.get(name, [default])[-1]
+
+    try:
+        sr = int(param("sr", "22050"))
+        duration = PREVIEW if param("duration", "30") == PREVIEW else float(param("duration", "30"))
+    except ValueError as e:
+        raise RequestError(400, f"Invalid parameter: {e}")
+    if sr <= 0:
+        raise RequestError(400, "sr must be positive")
+    if duration != PREVIEW:
+        if not math.isfinite(duration) or duration < 0:
+            raise RequestError(400, "duration must be a finite, non-negative number of seconds")
+        # Whole seconds are keyed as ints, like the app's duration options, so both share cache entries
+        duration = int(duration) if duration.is_integer() else duration
+    try:
+        target_sr, res_type = resample_settings(param("resample", "quality"), sr)
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    return target_sr, duration or None, res_type
+
+
+class AnalysisServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the analyzer and job queue shared by all requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, analyzer, jobs, store=None, access_log=False, pcm_cache=None):
+        """
+        Parameters:
+        address (tuple): (host, port) to listen on
+        analyzer (AudioAnalyzer): Analyzer used by every job
+        jobs (JobQueue): Queue the analyses run on
+        store (VectorStore): Optional catalog every analyzed track is added to
+        access_log (bool): Log every request to stderr
+        pcm_cache (PCMCache): Optional decoded-audio cache, so re-analyzing a file with other settings skips decoding
+        """
+        super().__init__(address, AnalysisHandler)
+        self.analyzer = analyzer
+        self.jobs = jobs
+        self.store = store
+        self.pcm_cache = pcm_cache
+        self.access_log = access_log
+        # Bodies are only read for requests the queue can take, so a flood of uploads is
+        # refused up front instead of being buffered in memory
+        self.admission = threading.BoundedSemaphore(jobs.max_workers + (jobs.max_pending or 0))
+
+    def submit(self, audio_bytes, filename, target_sr, duration, res_type):
+        compute = upload_compute(self.jobs, self.analyzer, audio_bytes, filename, target_sr, duration, res_type,
+                                 pcm_cache=self.pcm_cache)
+        key = analysis_key(audio_bytes, target_sr, duration, res_type=res_type,
+                           classifier=self.analyzer.classifier.name)
+        try:
+            return self.jobs.get(self.jobs.submit(key, compute))
+        except QueueFull as e:
+            raise RequestError(429, str(e), {"Retry-After": "5"})
+
+    def remember(self, audio_bytes, filename, result):
+        # Catalog the track and return the result without its internal feature vector
+        result, vector = split_vector(result)
+        if self.store is not None and vector is not None:
+            self.store.add(content_hash(audio_bytes), vector, track_metadata(filename, result))
+        return result
+
+
+class AnalysisHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path not in ("/health", "/metrics"):
+            return self._send_json(404, {"error": "Not found"})
+        jobs = self.server.jobs
+        metrics = jobs.metrics()
+        if path == "/metrics":
+            return self._send(200, metrics_to_prometheus(metrics).encode(), "text/plain; version=0.0.4")
+        self._send_json(200, {
+            "status": "ok",
+            "workers": jobs.max_workers,
+            "max_pending": jobs.max_pending,
+            "jobs": metrics["jobs"],
+            "queue_wait_seconds": metrics["queue_wait_seconds"],
+            "pool": metrics["pool"],
+        })
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        routes = {"/analyze": self._analyze, "/analyze/batch": self._analyze_batch}
+        if url.path not in routes:
+            return self._send_json(404, {"error": "Not found"})
+        if not self.server.admission.acquire(blocking=False):
+            self.close_connection = True
+            return self._send_json(429, {"error": "Too many concurrent requests"}, {"Retry-After": "5"})
+        try:
+            status, body = routes[url.path](url.query)
+            self._send_json(status, body)
+        except RequestError as e:
+            self.close_connection = True
+            self._send_json(e.status, {"error": str(e)}, e.headers)
+        finally:
+            self.server.admission.release()
+
+    def _analyze(self, query):
+        settings = request_settings(query)
+        filename = parse_qs(query).get("filename", [None])[-1]
+        data = self._read_body()
+        status, body = self._outcome(self.server.submit(data, filename, *settings))
+        if status == 200:
+            body = self.server.remember(data, filename, body)
+        return status, body
+
+    def _analyze_batch(self, query):
+        settings = request_settings(query)
+        content_type = self.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            raise RequestError(415, "Batch uploads must be multipart/form-data")
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + self._read_body())
+        files = [(part.get_filename(), part.get_payload(decode=True)) for part in message.iter_parts()]
+        for number, (filename, data) in enumerate(files, 1):
+            # get_payload gives None for a part it can't decode
+            if not data:
+                raise RequestError(400, f"Part {filename or number} is empty or can't be decoded")
+        if not files:
+            raise RequestError(400, "No files in the request")
+
+        # Jobs submitted before the queue fills keep running and land in the cache, so a retry is cheaper
+        jobs = [(filename, data, self.server.submit(data, filename, *settings)) for filename, data in files]
+        results = []
+        for filename, data, job in jobs:
+            status, body = self._outcome(job)
+            if status == 200:
+                body = self.server.remember(data, filename, body)
+            results.append({"filename": filename, **({"result": body} if status == 200 else body)})
+        return 200, {"results": results}
+
+    def _outcome(self, job):
+        if not job.wait(REQUEST_TIMEOUT):
+            raise RequestError(504, "Analysis timed out")
+        if isinstance(job.error, WorkerError):
+            # Stopped by the supervisor: say which limit the file hit
+            return 422, {"error": str(job.error), "reason": job.error.reason, **job.error.details}
+        if job.status == FAILED:
+            return 422, {"error": f"{type(job.error).__name__}: {job.error}"}
+        return 200, job.result
+
+    def _read_body(self):
+        # Uploads are read in chunks, either Content-Length delimited or chunked transfer encoded
+        chunks = []
+        size = 0
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                try:
+                    chunk_size = int(self.rfile.readline().split(b";")[0], 16)
+                except ValueError:
+                    raise RequestError(400, "Malformed chunked body")
+                if chunk_size < 0:
+                    raise RequestError(400, "Malformed chunked body")
+                if chunk_size == 0:
+                    # Skip trailers up to the terminating blank line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                size += chunk_size
+                if size > MAX_UPLOAD_BYTES:
+                    raise RequestError(413, "Upload too large")
+                chunks.append(self.rfile.read(chunk_size))
+                self.rfile.readline()
+        else:
+            try:
+                remaining = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                raise RequestError(400, "Malformed Content-Length")
+            if remaining < 0:
+                raise RequestError(400, "Malformed Content-Length")
+            if remaining > MAX_UPLOAD_BYTES:
+                raise RequestError(413, "Upload too large")
+            while remaining:
+                chunk = self.rfile.read(min(remaining, _READ_CHUNK))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+        if not chunks:
+            raise RequestError(400, "Empty upload")
+        return b"".join(chunks)
+
+    def _send_json(self, status, body, headers=None):
+        self._send(status, json.dumps(body).encode(), "application/json", headers)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Access logs are opt-in so load tests don't flood stderr
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+def make_server(host="127.0.0.1", port=8000, workers=DEFAULT_MAX_JOBS, max_pending=DEFAULT_MAX_PENDING,
+                cache=True, vectors=True, warm=True, access_log=False, classifier=DEFAULT_CLASSIFIER,
+                supervised=DEFAULT_SUPERVISED, task_timeout=DEFAULT_TASK_TIMEOUT, max_rss_bytes=DEFAULT_MAX_RSS_BYTES,
+                max_tasks=DEFAULT_MAX_TASKS):
+    """
+    Build an analysis server with a pre-warmed analyzer.
+
+    Parameters:
+    host (str): Interface to listen on
+    port (int): Port to listen on, 0 for any free port
+    workers (int): Analyses run at once
+    max_pending (int): Analyses allowed to wait for a worker before requests get 429
+    cache (bool): Serve and store results through the AnalysisCache, and decoded audio through the PCMCache
+    vectors (bool): Add every analyzed track to the VectorStore searched by the app's similar tracks panel
+    warm (bool): Run a warm-up analysis before accepting requests
+    access_log (bool): Log every request to stderr
+    classifier (str): "heuristic" or the path of a classifier model, see classifiers.load_classifier
+    supervised (bool): Run analyses in supervised worker processes instead of the server's threads
+    task_timeout (float): Seconds a supervised analysis may run, 0 for no limit
+    max_rss_bytes (int): Resident memory a worker process may reach, 0 for no limit
+    max_tasks (int): Analyses a worker process runs before it is replaced, 0 for no limit
+
+    Returns:
+    AnalysisServer: Call serve_forever() to start handling requests
+    """
+    from audio_analyzer import AudioAnalyzer
+
+    # Before any analyzer or worker exists, so all of them load compiled kernels from disk
+    enable_jit_cache()
+    pool = None
+    if supervised:
+        # The workers build and warm their own analyzers; this one only names the classifier in cache keys
+        pool = WorkerPool(workers, initializer=init_worker, initargs=(classifier, SAMPLE_RATES, cache, warm),
+                          timeout=task_timeout, max_rss_bytes=max_rss_bytes, max_tasks=max_tasks,
+                          preload=("audio_analyzer", "jobs"))
+    analyzer = AudioAnalyzer(sample_rates=() if supervised else SAMPLE_RATES, classifier=load_classifier(classifier))
+    if warm and supervised:
+        pool.wait_ready()
+    elif warm:
+        warm_up(analyzer, SAMPLE_RATES)
+    jobs = JobQueue(max_workers=workers, cache=AnalysisCache() if cache else None, max_pending=max_pending,
+                    pool=pool)
+    return AnalysisServer((host, port), analyzer, jobs, store=VectorStore() if vectors else None,
+                          access_log=access_log, pcm_cache=PCMCache() if cache else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--workers", "-j", type=int, default=DEFAULT_MAX_JOBS, help="Analyses run at once")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help="Analyses allowed to wait for a worker before requests get 429")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the analysis and decoded-audio caches")
+    parser.add_argument("--no-vectors", action="store_true", help="Don't add analyzed tracks to the similarity store")
+    parser.add_argument("--access-log", action="store_true", help="Log every request to stderr")
+    parser.add_argument("--classifier", default=DEFAULT_CLASSIFIER,
+                        help="Genre/mood classifier: heuristic or the path of an .npz model")
+    parser.add_argument("--no-supervisor", action="store_true",
+                        help="Run analyses on the server's threads instead of supervised worker processes")
+    parser.add_argument("--task-timeout", type=float, default=DEFAULT_TASK_TIMEOUT,
+                        help="Seconds an analysis may run before its worker is killed, 0 for no limit")
+    parser.add_argument("--max-rss-mb", type=int, default=DEFAULT_MAX_RSS_BYTES // 2**20,
+                        help="Memory a worker process may use before it is killed, 0 for no limit")
+    parser.add_argument("--max-tasks-per-worker", type=int, default=DEFAULT_MAX_TASKS,
+                        help="Analyses a worker process runs before it is replaced, 0 for no limit")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+                         cache=not args.no_cache, vectors=not args.no_vectors, access_log=args.access_log,
+                         classifier=args.classifier, supervised=not args.no_supervisor,
+                         task_timeout=args.task_timeout, max_rss_bytes=args.max_rss_mb * 2**20,
+                         max_tasks=args.max_tasks_per_worker)
+    print(f"Listening on http://{args.host}:{server.server_port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.jobs.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
+import functools
+import html
+import importlib.util
+import time
 import streamlit as st
-import numpy as np
-import librosa
-import librosa.display
-import matplotlib.pyplot as plt
-import io
-import os
-import json
 from audio_analyzer import AudioAnalyzer
-from utils import create_progress_bar, create_emotion_bar
+from classifiers import DEFAULT_CLASSIFIER
+from analysis_cache import AnalysisCache, analysis_key, content_hash, timeline_key
+from jobs import (DEFAULT_MAX_JOBS, DEFAULT_SUPERVISED, DONE, FAILED, QUEUED, JobQueue, init_worker,
+                  metrics_to_prometheus, pyramid_compute, timeline_compute, upload_compute)
+from pcm_cache import PCMCache
+from results_store import EXPORT_FORMATS, export_records
+from profiling import log_timings, to_prometheus
+from segments import SEGMENT_HOP, SEGMENT_SECONDS
+from similarity import SimilarityIndex, VectorStore, split_vector, track_metadata
+from supervisor import WorkerError, WorkerPool
+from audio_io import PREVIEW, RESAMPLE_MODES, resample_settings
+from utils import emotion_bar_html, metric_html, pills_html, progress_bar_html
+from visualization import DB_RANGE, PyramidStore, spectrogram_image, waveform_image
+from warmup import enable_jit_cache
 
 # Set page configuration
 st.set_page_config(
@@ -16,8 +26,177 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize the audio analyzer
-analyzer = AudioAnalyzer()
+SAMPLE_RATES = [22050, 44100, 48000]
+
+@st.cache_resource
+def get_analyzer():
+    # One analyzer per server process, holding the filter banks for every selectable rate.
+    # It is only requested once a file is uploaded, so the welcome page renders without
+    # loading librosa's signal-processing modules. With supervised workers it only names
+    # the classifier in cache keys; every worker process builds its own. Compiled librosa
+    # kernels are loaded from the on-disk JIT cache instead of being compiled again.
+    enable_jit_cache()
+    return AudioAnalyzer(sample_rates=() if DEFAULT_SUPERVISED else SAMPLE_RATES)
+
+@st.cache_resource
+def get_analysis_cache():
+    # One cache per server process, shared by all sessions
+    return AnalysisCache()
+
+@st.cache_resource
+def get_pcm_cache():
+    # Decoded uploads, so switching the sample rate or duration only resamples and slices
+    return PCMCache()
+
+@st.cache_resource
+def get_pyramid_store():
+    # Waveform and spectrogram pyramids, built once per track and read back memory-mapped
+    return PyramidStore()
+
+@st.cache_resource
+def get_similarity_index():
+    # One store and index per server process; the index picks up tracks added by any session
+    return SimilarityIndex(VectorStore())
+
+@st.cache_resource
+def get_job_queue():
+    # One queue per server process, so its worker count caps concurrent analyses on this node.
+    # Analyses run in supervised worker processes, so a pathological upload hits a time or memory
+    # limit instead of stalling or taking down the app. Workers warm up before taking jobs, so
+    # one replacing a recycled worker doesn't slow down the next upload.
+    enable_jit_cache()
+    pool = None
+    if DEFAULT_SUPERVISED:
+        pool = WorkerPool(DEFAULT_MAX_JOBS, initializer=init_worker,
+                          initargs=(DEFAULT_CLASSIFIER, SAMPLE_RATES, True, True), preload=("audio_analyzer", "jobs"))
+    return JobQueue(cache=get_analysis_cache(), pool=pool)
+
+# Progress labels for the stages reported by the running job
+STAGE_LABELS = {
+    "worker_wait": "Starting an analysis worker",
+    "decode": "Decoding audio",
+    "resample": "Resampling",
+    "heuristics": "Interpreting features",
+    "segments": "Analyzing segments",
+    "visualization": "Drawing the waveform and spectrogram",
+}
+
+# Image width of the waveform and spectrogram views; the page scales the images to fit
+WAVEFORM_WIDTH = 800
+
+@st.fragment(run_every=0.5)
+def show_job_progress(job_id):
+    # Polls the job without rerunning the whole page, then reruns it once the job is finished
+    job = get_job_queue().get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    if job.status == QUEUED:
+        st.info("Waiting for a free analysis slot...")
+    else:
+        label = STAGE_LABELS.get(job.stage, "Extracting features")
+        st.info(f"{label}... ({time.time() - job.started_at:.0f} s)")
+
+@st.fragment
+def show_waveform(pyramid):
+    # Zooming reruns only this fragment, and every view is read from the pyramid level closest to
+    # the image width, so drawing an hour-long mix costs as much as drawing a 30 second clip
+    duration = pyramid.duration
+    if duration < 1.0:
+        st.caption("The track is too short to draw.")
+        return
+    start, end = st.slider("Zoom", 0.0, duration, (0.0, duration), step=0.1, format="%.1f s")
+    st.image(waveform_image(pyramid.waveform(start, end, WAVEFORM_WIDTH), WAVEFORM_WIDTH), width="stretch")
+    st.image(spectrogram_image(pyramid.mel_spectrogram(start, end, WAVEFORM_WIDTH), WAVEFORM_WIDTH),
+             width="stretch")
+    st.caption(f"{start:.1f} to {end:.1f} s. Mel spectrogram up to {pyramid.sr // 2} Hz over {DB_RANGE:.0f} dB.")
+
+def results_html(results):
+    # All result sections as one HTML block, so a rerun sends the browser one element
+    # instead of a markdown call per pill and metric
+    genre = results["genre"]
+    energy = results["energy"]
+    vocal = results["vocal"]
+    technical = results["technical"]
+
+    genre_mood = '<div class="section-label">GENRE</div>' + pills_html([f'{genre["main_genre"]} {genre["confidence"]}%'])
+    if "genre_description" in genre:
+        genre_mood += f'<div class="note">{html.escape(genre["genre_description"])}</div>'
+    genre_mood += ('<div class="section-label spaced">MOOD</div>'
+                   + pills_html([f"{mood} {value}%" for mood, value in results["mood"].items()]))
+    instruments_use_cases = ('<div class="section-label">INSTRUMENTS</div>'
+                             + pills_html(results["instruments"], "pill pill-instrument")
+                             + '<div class="section-label spaced">SUGGESTED USE CASES</div>'
+                             + pills_html(results["use_cases"], "pill pill-usecase"))
+    energy_html = '<div class="section-label">ENERGY</div>' + progress_bar_html(energy["level"], ["Low", "Medium", "High"])
+    if "variance" in energy:
+        energy_html += f'<div class="note">Variance: {energy["variance"]}</div>'
+    emotion_html = '<div class="section-label">EMOTION</div>'
+    if "emotion" in results:
+        emotion_html += emotion_bar_html(results["emotion"]["value"])
+
+    vocal_columns = [
+        metric_html("Instrumentation", vocal["instrumentation"]) + metric_html("Autotune Presence", vocal["autotune"]),
+        metric_html("Vocal Register", vocal["register"]),
+        metric_html("Vocal Presence", vocal["presence"]),
+    ]
+    technical_columns = [
+        metric_html("Key", technical["key"]),
+        metric_html("BPM", technical["bpm"]),
+        metric_html("Beat Consistency", technical["beat_consistency"]),
+        '<div class="metric-title">Quality</div>' + pills_html([technical["quality"]], "pill pill-quality"),
+    ]
+
+    def grid(columns):
+        return (f'<div class="result-grid" style="--columns: {len(columns)};">'
+                + "".join(f"<div>{column}</div>" for column in columns) + "</div>")
+
+    return (grid([genre_mood, instruments_use_cases])
+            + grid([energy_html, emotion_html])
+            + '<div class="divider"></div><div class="section-label">VOCAL ANALYSIS</div>' + grid(vocal_columns)
+            + '<div class="divider"></div><div class="section-label">TECHNICAL SPECS</div>' + grid(technical_columns))
+
+def find_similar_tracks(analysis):
+    # The track's vector is read back from the catalog it joined when its analysis finished
+    index = get_similarity_index()
+    vector = index.store.vector(analysis["track_key"])
+    if vector is None:
+        return []
+    return index.query(vector, k=5, exclude=analysis["track_key"])
+
+@st.fragment
+def show_similar_tracks(analysis):
+    # Neighbours are looked up when the analysis finishes; refreshing picks up tracks
+    # analyzed since then and reruns only this panel
+    if st.button("Refresh", key="refresh_similar_tracks"):
+        analysis["neighbours"] = find_similar_tracks(analysis)
+    if analysis["neighbours"]:
+        st.table([
+            {
+                "Track": neighbour["name"],
+                "Genre": neighbour["genre"],
+                "Key": neighbour["key"],
+                "BPM": neighbour["bpm"],
+                "Distance": f'{neighbour["distance"]:.2f}',
+            }
+            for neighbour in analysis["neighbours"]
+        ])
+    else:
+        st.caption("No other tracks analyzed yet.")
+
+@st.fragment
+def show_downloads(track_record, session_records, name):
+    # Switching the format reruns only this panel, and the files are only built when a button is clicked
+    export_format = st.radio("Format", EXPORT_FORMATS, horizontal=True, format_func=str.upper)
+    if export_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        st.caption("Parquet export requires pyarrow (pip install pyarrow)")
+        return
+    mime_types = {"csv": "text/csv", "json": "application/json", "parquet": "application/octet-stream"}
+    d1, d2 = st.columns(2)
+    d1.download_button("This track", functools.partial(export_records, [track_record], export_format),
+                       file_name=f"{name}.{export_format}", mime=mime_types[export_format])
+    d2.download_button(f"This session ({len(session_records)} tracks)",
+                       functools.partial(export_records, session_records, export_format),
+                       file_name=f"musicvision-session.{export_format}", mime=mime_types[export_format])
 
 # Custom CSS to improve UI and hide header
 st.markdown("""
@@ -94,8 +273,8 @@ st.markdown("""
     
     /* Text elements */
     .metric-value {
-        font-size: 1rem;
-        font-weight: bold;
+        font-size: 1.15rem;
+        font-weight: 600;
         color: var(--accent-color);
     }
     .metric-label {
@@ -165,6 +344,64 @@ st.markdown("""
         font-weight: 700;
         margin-bottom: 0.1rem;
     }
+
+    /* Result sections, rendered as one HTML block */
+    .result-grid {
+        display: grid;
+        grid-template-columns: repeat(var(--columns, 2), 1fr);
+        gap: 0 1rem;
+    }
+    .result-grid .metric-title + .metric-value + .metric-title {
+        margin-top: 0.5rem;
+    }
+    .section-label.spaced {
+        margin-top: 0.7rem;
+    }
+    .note {
+        margin-top: 0.2rem;
+        color: #666;
+        font-size: 0.9rem;
+    }
+
+    /* Energy and emotion bars */
+    .bar-track {
+        width: 100%;
+        height: 0.5rem;
+        border-radius: 0.25rem;
+        background-color: var(--secondary-background-color);
+        margin: 0.4rem 0;
+    }
+    .bar-fill {
+        height: 100%;
+        border-radius: 0.25rem;
+        background-color: var(--accent-color);
+    }
+    .bar-labels {
+        display: flex;
+        justify-content: space-between;
+        font-size: 0.9rem;
+    }
+    .emotion-container {
+        width: 100%;
+        background-color: #f0f0f0;
+        height: 10px;
+        border-radius: 5px;
+        position: relative;
+        margin: 0.6rem 0;
+    }
+    .emotion-level {
+        background: linear-gradient(to right, #ff9999, #ffcc99, #ffff99, #99ff99);
+        height: 10px;
+        border-radius: 5px;
+    }
+    .emotion-marker {
+        position: absolute;
+        top: -5px;
+        width: 4px;
+        height: 20px;
+        background-color: #333;
+        transform: translateX(-50%);
+    }
 </style>
 """, unsafe_allow_html=True)
 
@@ -180,15 +417,28 @@ with st.sidebar:
     uploaded_file = st.file_uploader("Choose an audio file", type=["mp3", "wav", "flac", "ogg"])
     
     st.markdown("### Analysis Settings")
-    sample_rate = st.selectbox("Sample Rate", [22050, 44100, 48000], index=0)
-    duration = st.selectbox("Analysis Duration", ["Full song", "30 seconds", "60 seconds", "90 seconds"], index=1)
+    sample_rate = st.selectbox("Sample Rate", SAMPLE_RATES, index=0)
+    duration = st.selectbox("Analysis Duration", ["Full song", "30 seconds", "60 seconds", "90 seconds", "Preview (excerpts)"], index=1)
+    resampling_labels = {
+        "quality": "High quality",
+        "fast": "Fast",
+        "native": "Native rate (no resampling)",
+    }
+    resampling = st.selectbox("Resampling", list(RESAMPLE_MODES), index=0, format_func=resampling_labels.get)
+    target_sr, res_type = resample_settings(resampling, sample_rate)
+    show_waveform_panel = st.checkbox("Show waveform and spectrogram", value=False)
+    show_timeline = st.checkbox("Show timeline", value=False)
+    show_performance = st.checkbox("Show performance panel", value=False)
+    trace_memory = st.checkbox("Trace memory per stage", value=False, disabled=not show_performance)
 
     # Define duration mapping
     duration_mapping = {
         "Full song": None,
         "30 seconds": 30,
         "60 seconds": 60,
-        "90 seconds": 90
+        "90 seconds": 90,
+        # Three 10 second excerpts spread across the track, for near full-song results at 30 second cost
+        "Preview (excerpts)": PREVIEW,
     }
     
     st.markdown("---")
@@ -201,144 +451,213 @@ with st.sidebar:
 # Main content area
 if uploaded_file is not None:
     try:
-        # Save the uploaded file temporarily
-        with open("temp_audio.mp3", "wb") as f:
-            f.write(uploaded_file.getvalue())
+        analyzer = get_analyzer()
         
-        # Display audio player
-        st.audio("temp_audio.mp3", format="audio/mp3")
+        # Display audio player straight from the uploaded bytes
+        st.audio(uploaded_file.getvalue(), format=uploaded_file.type or "audio/mpeg")
         
-        # Load and analyze the audio
-        y, sr = librosa.load("temp_audio.mp3", sr=sample_rate, duration=duration_mapping[duration])
-        analysis_results = analyzer.analyze_audio(y, sr)
+        # The finished analysis is kept in session state, so reruns that leave the upload and the
+        # settings alone (display toggles, downloads) only render it again
+        settings = (uploaded_file.file_id, target_sr, duration_mapping[duration], res_type)
+        analysis = st.session_state.get("analysis")
+        if analysis is None or analysis["settings"] != settings:
+            # Analyses run on the shared job queue. Reruns of this session, and other sessions
+            # uploading the same file with the same settings, attach to the job already in flight.
+            jobs = get_job_queue()
+            audio_bytes = uploaded_file.getvalue()
+            # Hash each upload once per settings rather than on every rerun while its job runs
+            analysis_keys = st.session_state.setdefault("analysis_keys", {})
+            if settings not in analysis_keys:
+                analysis_keys[settings] = analysis_key(audio_bytes, target_sr, duration_mapping[duration],
+                                                       res_type=res_type, classifier=analyzer.classifier.name)
+            cache_key = analysis_keys[settings]
+            session_jobs = st.session_state.setdefault("analysis_jobs", {})
+            job = jobs.get(session_jobs.get(cache_key, ""))
+            if job is None:
+                # A full-song analysis also stores the track's waveform and spectrogram pyramid
+                compute = upload_compute(jobs, analyzer, audio_bytes, uploaded_file.name, target_sr,
+                                         duration_mapping[duration], res_type, pcm_cache=get_pcm_cache(),
+                                         pyramids=get_pyramid_store())
+                job = jobs.get(jobs.submit(cache_key, compute, trace_memory=show_performance and trace_memory))
+                session_jobs[cache_key] = job.id
+            
+            if not job.finished:
+                show_job_progress(job.id)
+                st.stop()
+            if job.status == FAILED:
+                # Forget the failed job so the next rerun submits it again, unless the file hit a
+                # worker limit, which it would only hit again
+                if not isinstance(job.error, WorkerError):
+                    del session_jobs[cache_key]
+                raise job.error
+            
+            results, vector = split_vector(job.result)
+            analysis = {
+                "settings": settings,
+                "cache_key": cache_key,
+                "track_key": content_hash(audio_bytes),
+                "results": results,
+                "timings": job.timings,
+                "served_from_cache": job.served_from_cache,
+                # Every track analyzed in this session can be downloaded together
+                "record": {
+                    "path": uploaded_file.name,
+                    "result": results,
+                    "seconds": job.timings["total_seconds"],
+                },
+            }
+            logged_jobs = st.session_state.setdefault("logged_jobs", set())
+            if job.id not in logged_jobs:
+                logged_jobs.add(job.id)
+                log_timings(job.timings, file=uploaded_file.name, sample_rate=target_sr, duration=duration,
+                            cached=job.served_from_cache)
+                # Every analyzed track joins the catalog searched by the similar tracks panel
+                if vector is not None:
+                    get_similarity_index().store.add(analysis["track_key"], vector,
+                                                     track_metadata(uploaded_file.name, results))
+            analysis["neighbours"] = find_similar_tracks(analysis)
+            st.session_state["analysis"] = analysis
+            st.session_state.setdefault("session_results", {})[cache_key] = analysis["record"]
         
-        # Remove the temp file
-        os.remove("temp_audio.mp3")
+        analysis_results = analysis["results"]
+        timings = analysis["timings"]
         
-        # --- Custom CSS for pills and layout ---
-        st.markdown("""
-        <style>
-        .pill {
-            display: inline-block;
-            background: #f3f3f3;
-            color: #222;
-            border-radius: 16px;
-            padding: 2px 12px;
-            margin: 2px 4px 2px 0;
-            font-size: 0.95rem;
-            font-weight: 500;
-            border: 1px solid #e0e0e0;
-        }
-        .pill-instrument {
-            background: #fff6e0;
-            color: #b26a00;
-            border: 1px solid #ffe0b2;
-        }
-        .pill-usecase {
-            background: #e3f0ff;
-            color: #1565c0;
-            border: 1px solid #bbdefb;
-        }
-        .pill-quality {
-            background: #43a047;
-            color: #fff;
-            border: none;
-            font-weight: 600;
-        }
-        .section-label {
-            font-size: 0.85rem;
-            font-weight: 700;
-            color: #888;
-            letter-spacing: 1px;
-            margin-bottom: 0.2rem;
-        }
-        .divider {
-            border-bottom: 1px solid #e0e0e0;
-            margin: 1.2rem 0 1rem 0;
-        }
-        .metric-title {
-            font-size: 1.05rem;
-            font-weight: 700;
-            margin-bottom: 0.1rem;
-        }
-        .metric-value {
-            font-size: 1.15rem;
-            font-weight: 600;
-        }
-        </style>
-        """, unsafe_allow_html=True)
+        if "_degenerate" in analysis_results:
+            reasons = {
+                "silent": "The audio is (nearly) silent",
+                "too_short": "The audio is shorter than a second",
+                "clipped": "The audio is mostly clipped",
+                "non_finite": "The audio contains invalid samples",
+            }
+            st.warning(f'{reasons[analysis_results["_degenerate"]["reason"]]}, so it was not analyzed in detail.')
         
-        # --- Top Section: Genre, Mood, Instruments, Use Cases ---
-        top_left, top_right = st.columns([2,2])
-        with top_left:
-            st.markdown('<div class="section-label">GENRE</div>', unsafe_allow_html=True)
-            st.markdown(f'<span class="pill">{analysis_results["genre"]["main_genre"]} {analysis_results["genre"]["confidence"]}%</span>', unsafe_allow_html=True)
-            if "genre_description" in analysis_results["genre"]:
-                st.markdown(f'<div style="margin-top:0.2rem; color:#444; font-size:0.95rem;">{analysis_results["genre"]["genre_description"]}</div>', unsafe_allow_html=True)
-            st.markdown('<div class="section-label" style="margin-top:0.7rem;">MOOD</div>', unsafe_allow_html=True)
-            for mood, value in analysis_results["mood"].items():
-                st.markdown(f'<span class="pill">{mood} {value}%</span>', unsafe_allow_html=True)
-        with top_right:
-            st.markdown('<div class="section-label">INSTRUMENTS</div>', unsafe_allow_html=True)
-            for instrument in analysis_results["instruments"]:
-                st.markdown(f'<span class="pill pill-instrument">{instrument}</span>', unsafe_allow_html=True)
-            st.markdown('<div class="section-label" style="margin-top:0.7rem;">SUGGESTED USE CASES</div>', unsafe_allow_html=True)
-            for use_case in analysis_results["use_cases"]:
-                st.markdown(f'<span class="pill pill-usecase">{use_case}</span>', unsafe_allow_html=True)
+        # --- Genre, Mood, Instruments, Use Cases, Energy, Emotion, Vocal Analysis and Technical Specs ---
+        st.markdown(results_html(analysis_results), unsafe_allow_html=True)
         
-        # --- Middle Section: Energy and Emotion ---
-        mid_left, mid_right = st.columns([2,2])
-        with mid_left:
-            st.markdown('<div class="section-label">ENERGY</div>', unsafe_allow_html=True)
-            energy_level = analysis_results["energy"]["level"]
-            create_progress_bar(energy_level, ["Low", "Medium", "High"])
-            if "variance" in analysis_results["energy"]:
-                st.markdown(f'<div style="font-size:0.9rem; color:#666;">Variance: {analysis_results["energy"]["variance"]}</div>', unsafe_allow_html=True)
-        with mid_right:
-            st.markdown('<div class="section-label">EMOTION</div>', unsafe_allow_html=True)
-            if "emotion" in analysis_results:
-                create_emotion_bar(analysis_results["emotion"]["value"])
+        # --- Optional Waveform and Spectrogram Section ---
+        if show_waveform_panel:
+            st.markdown('<div class="divider"></div><div class="section-label">WAVEFORM</div>', unsafe_allow_html=True)
+        if show_waveform_panel and "pyramid" not in analysis:
+            # Covers the whole upload whatever the analysis duration
+            pyramid = get_pyramid_store().get(analysis["track_key"])
+            pyramid_key = f'pyramid:{analysis["track_key"]}'
+            rebuilt_pyramids = st.session_state.setdefault("rebuilt_pyramids", set())
+            if pyramid is not None:
+                analysis["pyramid"] = pyramid
+                rebuilt_pyramids.discard(pyramid_key)
+            else:
+                jobs = get_job_queue()
+                session_jobs = st.session_state.setdefault("analysis_jobs", {})
+                pyramid_job = jobs.get(session_jobs.get(pyramid_key, ""))
+                if pyramid_job is not None and pyramid_job.status == DONE and pyramid_key in rebuilt_pyramids:
+                    # Built again and still missing: the store can't keep it (a failed write, or a cache
+                    # too small for it), and another build would only loop
+                    st.warning("Waveform unavailable: the pyramid could not be stored.")
+                else:
+                    # A finished job whose pyramid is gone was evicted from the store; build it again, once
+                    if pyramid_job is None or pyramid_job.status == DONE:
+                        if pyramid_job is not None:
+                            rebuilt_pyramids.add(pyramid_key)
+                        compute = pyramid_compute(jobs, uploaded_file.getvalue(), uploaded_file.name,
+                                                  get_pcm_cache(), get_pyramid_store())
+                        pyramid_job = jobs.get(jobs.submit(pyramid_key, compute, cache=False))
+                        session_jobs[pyramid_key] = pyramid_job.id
+                    if not pyramid_job.finished:
+                        show_job_progress(pyramid_job.id)
+                    elif pyramid_job.status == FAILED:
+                        if not isinstance(pyramid_job.error, WorkerError):
+                            del session_jobs[pyramid_key]
+                        st.warning(f"Waveform unavailable: {pyramid_job.error}")
+                    else:
+                        st.rerun()
+        if show_waveform_panel and "pyramid" in analysis:
+            show_waveform(analysis["pyramid"])
         
-        st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
+        # --- Optional Timeline Section ---
+        if show_timeline:
+            st.markdown('<div class="divider"></div><div class="section-label">TIMELINE</div>', unsafe_allow_html=True)
+        if show_timeline and duration_mapping[duration] == PREVIEW:
+            st.caption("The timeline needs a contiguous duration; pick one instead of the preview.")
+        elif show_timeline and "timeline" not in analysis:
+            # Segments are cached across durations, so extending the duration only analyzes the new audio
+            if "timeline_key" not in analysis:
+                analysis["timeline_key"] = (timeline_key(uploaded_file.getvalue(), target_sr, SEGMENT_SECONDS,
+                                                         SEGMENT_HOP, res_type=res_type,
+                                                         classifier=analyzer.classifier.name)
+                                            + f":{duration_mapping[duration]}")
+            jobs = get_job_queue()
+            session_jobs = st.session_state.setdefault("analysis_jobs", {})
+            timeline_job = jobs.get(session_jobs.get(analysis["timeline_key"], ""))
+            if timeline_job is None:
+                compute = timeline_compute(jobs, analyzer, uploaded_file.getvalue(), uploaded_file.name, target_sr,
+                                           duration_mapping[duration], res_type, cache=get_analysis_cache(),
+                                           pcm_cache=get_pcm_cache())
+                timeline_job = jobs.get(jobs.submit(analysis["timeline_key"], compute))
+                session_jobs[analysis["timeline_key"]] = timeline_job.id
+            if not timeline_job.finished:
+                show_job_progress(timeline_job.id)
+            elif timeline_job.status == FAILED:
+                if not isinstance(timeline_job.error, WorkerError):
+                    del session_jobs[analysis["timeline_key"]]
+                st.warning(f"Timeline unavailable: {timeline_job.error}")
+            else:
+                analysis["timeline"] = timeline_job.result["segments"]
+        if show_timeline and "timeline" in analysis:
+            segments = analysis["timeline"]
+            st.line_chart([{"Seconds": segment["start"], "Energy": segment["energy"]} for segment in segments],
+                          x="Seconds", y="Energy", height=160)
+            st.dataframe([
+                {
+                    "Start": f'{segment["start"]:.0f} s',
+                    "Energy": segment["energy_text"],
+                    "Key": segment["key"],
+                    "BPM": segment["bpm"],
+                    "Mood": segment["mood"],
+                }
+                for segment in segments
+            ], hide_index=True, width="stretch")
         
-        # --- Vocal Analysis Section ---
-        st.markdown('<div class="section-label">VOCAL ANALYSIS</div>', unsafe_allow_html=True)
-        v1, v2, v3 = st.columns(3)
-        with v1:
-            st.markdown('<div class="metric-title">Instrumentation</div>', unsafe_allow_html=True)
-            st.markdown(f'<div class="metric-value">{analysis_results["vocal"]["instrumentation"]}</div>', unsafe_allow_html=True)
-            st.markdown('<div class="metric-title" style="margin-top:0.5rem;">Autotune Presence</div>', unsafe_allow_html=True)
-            st.markdown(f'<div class="metric-value">{analysis_results["vocal"]["autotune"]}</div>', unsafe_allow_html=True)
-        with v2:
-            st.markdown('<div class="metric-title">Vocal Register</div>', unsafe_allow_html=True)
-            st.markdown(f'<div class="metric-value">{analysis_results["vocal"]["register"]}</div>', unsafe_allow_html=True)
-        with v3:
-            st.markdown('<div class="metric-title">Vocal Presence</div>', unsafe_allow_html=True)
-            st.markdown(f'<div class="metric-value">{analysis_results["vocal"]["presence"]}</div>', unsafe_allow_html=True)
+        # --- Similar Tracks Panel ---
+        with st.expander("Similar tracks", expanded=False):
+            show_similar_tracks(analysis)
         
-        st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
+        # --- Download Panel ---
+        with st.expander("Download results", expanded=False):
+            show_downloads(analysis["record"], list(st.session_state["session_results"].values()),
+                           uploaded_file.name.rsplit(".", 1)[0])
         
-        # --- Technical Specs Section ---
-        st.markdown('<div class="section-label">TECHNICAL SPECS</div>', unsafe_allow_html=True)
-        t1, t2, t3, t4 = st.columns(4)
-        with t1:
-            st.markdown('<div class="metric-title">Key</div>', unsafe_allow_html=True)
-            st.markdown(f'<div class="metric-value">{analysis_results["technical"]["key"]}</div>', unsafe_allow_html=True)
-        with t2:
-            st.markdown('<div class="metric-title">BPM</div>', unsafe_allow_html=True)
-            st.markdown(f'<div class="metric-value">{analysis_results["technical"]["bpm"]}</div>', unsafe_allow_html=True)
-        with t3:
-            st.markdown('<div class="metric-title">Beat Consistency</div>', unsafe_allow_html=True)
-            st.markdown(f'<div class="metric-value">{analysis_results["technical"]["beat_consistency"]}</div>', unsafe_allow_html=True)
-        with t4:
-            st.markdown('<div class="metric-title">Quality</div>', unsafe_allow_html=True)
-            quality = analysis_results["technical"]["quality"]
-            st.markdown(f'<span class="pill pill-quality">{quality}</span>', unsafe_allow_html=True)
+        # --- Optional Performance Panel ---
+        if show_performance:
+            with st.expander("Performance", expanded=False):
+                if analysis["served_from_cache"]:
+                    st.caption("Served from the analysis cache")
+                st.table([
+                    {
+                        "Stage": stage,
+                        "Seconds": f'{entry["seconds"]:.3f}',
+                        **({"Peak MiB": f'{entry["peak_bytes"] / 2**20:.1f}'} if "peak_bytes" in entry else {}),
+                    }
+                    for stage, entry in timings["stages"].items()
+                ])
+                st.markdown(f'**Total:** {timings["total_seconds"]:.3f} s')
+                queue_metrics = get_job_queue().metrics()
+                if queue_metrics["pool"] is not None:
+                    pool_metrics = queue_metrics["pool"]
+                    st.caption(f'Worker pool: {pool_metrics["busy"]} of {pool_metrics["workers"]} busy, '
+                               f'{pool_metrics["utilization"]:.0%} utilized, '
+                               f'{pool_metrics["peak_rss_bytes"] / 2**20:.0f} MiB peak worker memory')
+                st.code(to_prometheus(timings) + metrics_to_prometheus(queue_metrics), language="text")
         
+    except WorkerError as e:
+        # Stopped by the worker supervisor rather than by an error in the file itself
+        hints = {
+            "timeout": "Try a shorter analysis duration or the preview.",
+            "memory": "Try a shorter analysis duration or the preview.",
+            "crashed": "Try again, or convert the file to WAV or FLAC.",
+        }
+        st.error(f"Analysis stopped: {e}. {hints[e.reason]}")
     except Exception as e:
         st.error(f"Error analyzing audio: {str(e)}")
-        if os.path.exists("temp_audio.mp3"):
-            os.remove("temp_audio.mp3")
 
 else:
     # Welcome message when no file is uploaded
@@ -1,136 +1,253 @@
 import numpy as np
-import librosa
-import random
-from scipy import stats
+from features import (DEFAULT_FEATURE_ENGINE, DEFAULT_TEMPO_BACKEND, chroma_basis, combine_features, degenerate_reason, extract_features,
+                      extract_features_batch, feature_vector, mel_basis, signal_stats)
+from classifiers import GENRES, INSTRUMENTS, MOODS, USE_CASES, energy_rating, load_classifier
+from profiling import NULL_TIMER
+from streaming import DEFAULT_BLOCK_SECONDS, stream_features
+
+# Bump whenever feature extraction or the heuristics change so cached results are invalidated
+ANALYZER_VERSION = "5"
+
+def _json_number(value):
+    # NaN and inf from broken inputs aren't valid JSON
+    if isinstance(value, float):
+        return round(value, 6) if np.isfinite(value) else None
+    return value
 
 class AudioAnalyzer:
-    def __init__(self):
-        self.genres = ["Hip Hop", "Electronic", "Rock", "Pop", "Classical", "Jazz", "Country", "R&B", "Metal", "Folk"]
-        self.moods = ["Bold", "Confident", "Restless", "Energetic", "Calm", "Melancholic", "Upbeat", "Tense"]
-        self.instruments = ["Bass", "Beats", "Synth", "Guitar", "Piano", "Drums", "Strings", "Brass", "Woodwinds"]
-        self.use_cases = ["extreme sports", "party", "beats", "workout", "relaxation", "focus", "driving", "meditation"]
+    def __init__(self, sample_rates=(), classifier=None):
+        """
+        Parameters:
+        sample_rates (iterable): Sample rates whose filter banks are built up front
+        classifier: Genre, mood, instrument and use case backend (see classifiers.py),
+            None for the one selected by MUSICVISION_CLASSIFIER
+        """
+        self.classifier = classifier or load_classifier()
+        self.genres = list(GENRES)
+        self.moods = list(MOODS)
+        self.instruments = list(INSTRUMENTS)
+        self.use_cases = list(USE_CASES)
         self.vocal_types = ["female and male", "female", "male", "group", "chorus", "instrumental"]
         self.keys = ["C major", "C# minor", "D major", "D# minor", "E major", "F minor", "F# major", 
                      "G minor", "G# major", "A minor", "A# major", "B minor"]
         
-    def analyze_audio(self, y, sr):
+        self.filter_banks = {}
+        for sr in sample_rates:
+            self.precompute_filters(sr)
+        
+    def precompute_filters(self, sr):
+        """
+        Build and hold the mel and chroma filter banks for a sample rate.
+        
+        The chroma bank is built for concert tuning; tracks whose estimated tuning
+        differs get their own bank on first use, cached from then on.
+        
+        Parameters:
+        sr (int): Sample rate
+        """
+        self.filter_banks[sr] = {"mel": mel_basis(sr), "chroma": chroma_basis(sr, 0.0)}
+        
+    def analyze_audio(self, y, sr, engine=DEFAULT_FEATURE_ENGINE, timer=None, tempo_backend=DEFAULT_TEMPO_BACKEND):
         """
         Analyze the audio file and extract various features.
         
         Parameters:
         y (numpy.ndarray): Audio time series
         sr (int): Sample rate
+        engine (str): Feature engine, "shared" (one STFT reused by all features) or "legacy"
+        timer (StageTimer): Optional instrumentation; its stages are returned under "_timings"
+        tempo_backend (str): Tempo estimator, one of features.TEMPO_BACKENDS
         
         Returns:
         dict: Analysis results
         """
+        # Silent, very short and broken inputs get a placeholder result without feature extraction
+        with (timer or NULL_TIMER).stage("gate"):
+            stats = signal_stats(y, sr)
+        reason = degenerate_reason(stats)
+        if reason is not None:
+            return self._finish_degenerate(reason, stats, sr, timer)
+        
         # This is where we would use sophisticated audio analysis
         # For now, we'll create a deterministic analysis based on audio features
         
         # Extract actual features from the audio
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0].mean()
-        spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)[0].mean()
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)[0].mean()
-        zero_crossing_rate = librosa.feature.zero_crossing_rate(y)[0].mean()
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        mfcc_means = np.mean(mfccs, axis=1)
+        features = extract_features(y, sr, engine=engine, timer=timer or NULL_TIMER, tempo_backend=tempo_backend)
+        return self._finish(features, sr, timer)
+    
+    def analyze_batch(self, signals, sr, tempo_backend=DEFAULT_TEMPO_BACKEND):
+        """
+        Analyze many clips at once using batched feature extraction.
         
-        # Get chromagram for key detection
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-        chroma_means = np.mean(chroma, axis=1)
-        key_idx = np.argmax(chroma_means)
+        Parameters:
+        signals (list): Audio time series, all at the same sample rate
+        sr (int): Sample rate
+        tempo_backend (str): Tempo estimator, one of features.TEMPO_BACKENDS
         
-        # Detect onsets for beat consistency
-        onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-        beat_consistency = 1.0 - stats.variation(onset_env)
-        beat_consistency = max(0, min(1, beat_consistency))  # Normalize between 0 and 1
+        Returns:
+        list: Analysis results, one per signal, in input order
+        """
+        results = [None] * len(signals)
+        valid = []
+        for i, y in enumerate(signals):
+            stats = signal_stats(y, sr)
+            reason = degenerate_reason(stats)
+            if reason is None:
+                valid.append(i)
+            else:
+                results[i] = self.degenerate_result(reason, stats, sr)
+        batch_features = extract_features_batch([signals[i] for i in valid], sr, tempo_backend=tempo_backend)
+        for i, result in zip(valid, self.interpret_batch(batch_features, sr)):
+            results[i] = result
+        return results
+    
+    def analyze_excerpts(self, excerpts, sr, engine=DEFAULT_FEATURE_ENGINE, timer=None,
+                         tempo_backend=DEFAULT_TEMPO_BACKEND):
+        """
+        Analyze a track from a few excerpts, e.g. from audio_io.load_excerpts.
+        
+        Features are extracted per excerpt and merged with combine_features, so
+        no false onsets appear where the excerpts would be joined.
+        
+        Parameters:
+        excerpts (list): Audio time series of the excerpts, all at the same sample rate
+        sr (int): Sample rate
+        engine (str): Feature engine, "shared" or "legacy"
+        timer (StageTimer): Optional instrumentation; its stages are returned under "_timings"
+        tempo_backend (str): Tempo estimator, one of features.TEMPO_BACKENDS
+        
+        Returns:
+        dict: Analysis results with the same schema as analyze_audio
+        """
+        # Silent or broken excerpts are left out; the track is degenerate only if all of them are
+        with (timer or NULL_TIMER).stage("gate"):
+            stats = [signal_stats(y, sr) for y in excerpts]
+        usable = [y for y, excerpt_stats in zip(excerpts, stats) if degenerate_reason(excerpt_stats) is None]
+        if not usable:
+            longest = max(range(len(excerpts)), key=lambda i: len(excerpts[i]))
+            return self._finish_degenerate(degenerate_reason(stats[longest]), stats[longest], sr, timer)
+        parts = [extract_features(y, sr, engine=engine, timer=timer or NULL_TIMER, tempo_backend=tempo_backend)
+                 for y in usable]
+        features = combine_features(parts, [len(y) for y in usable])
+        return self._finish(features, sr, timer)
+    
+    def analyze_stream(self, source, sr, block_seconds=DEFAULT_BLOCK_SECONDS, res_type="soxr_hq", timer=None,
+                       tempo_backend=DEFAULT_TEMPO_BACKEND, visualizer=None):
+        """
+        Analyze an audio file block by block with bounded memory.
+        
+        Parameters:
+        source (str, file-like or tuple): Audio file path or binary file object readable by soundfile,
+            or decoded (mono samples, native sample rate)
+        sr (int or None): Sample rate, None to analyze at the file's native rate
+        block_seconds (float): Seconds of audio decoded per block
+        res_type (str): Resampler used when the file's rate differs from sr
+        timer (StageTimer): Optional instrumentation; its stages are returned under "_timings"
+        tempo_backend (str): Tempo estimator, one of features.TEMPO_BACKENDS ("beat_track" shares the tempogram)
+        visualizer (PyramidBuilder): Optional builder fed the decoded blocks and their mel spectrogram,
+            see streaming.stream_features
+        
+        Returns:
+        dict: Analysis results with the same schema as analyze_audio
+        """
+        features, sr, stats = stream_features(source, sr, block_seconds=block_seconds, res_type=res_type,
+                                              tempo_backend=tempo_backend, timer=timer or NULL_TIMER,
+                                              visualizer=visualizer)
+        # Streams are only screened once decoded, which still keeps garbage features out of the result
+        reason = degenerate_reason(stats)
+        if reason is not None:
+            return self._finish_degenerate(reason, stats, sr, timer)
+        return self._finish(features, sr, timer)
+    
+    def _finish(self, features, sr, timer):
+        if timer is None:
+            return self.interpret_features(features, sr)
+        with timer.stage("heuristics"):
+            results = self.interpret_features(features, sr)
+        results["_timings"] = timer.as_dict()
+        return results
+    
+    def _finish_degenerate(self, reason, stats, sr, timer):
+        results = self.degenerate_result(reason, stats, sr)
+        if timer is not None:
+            results["_timings"] = timer.as_dict()
+        return results
+    
+    def degenerate_result(self, reason, stats, sr):
+        """
+        Build a well-formed placeholder result for an input the pre-analysis gate rejected.
+        
+        Parameters:
+        reason (str): Classification from features.degenerate_reason
+        stats (dict): Output of features.signal_stats
+        sr (int): Sample rate
+        
+        Returns:
+        dict: Analysis results with neutral values, no "_vector" and the gate outcome under "_degenerate"
+        """
+        return {
+            "genre": {"main_genre": "Unknown", "confidence": 0, "elements": ""},
+            "mood": {},
+            "instruments": [],
+            "energy": {"level": 0.0, "text": "Low", "variance": "small"},
+            "emotion": {"value": 0.5},
+            "use_cases": [],
+            "vocal": {"instrumentation": "Instrumental", "register": "None", "presence": "None", "autotune": "None"},
+            "technical": {"key": "Unknown", "bpm": 0, "beat_consistency": "0.00", "quality": "Low"},
+            "_degenerate": {"reason": reason, **{name: _json_number(value) for name, value in stats.items()}},
+        }
+    
+    def interpret_features(self, features, sr, labels=None):
+        """
+        Turn extracted summary features into analysis results.
+        
+        Parameters:
+        features (dict): Summary features from features.extract_features
+        sr (int): Sample rate
+        labels (dict): Genre, mood, instruments and use cases already predicted for this track,
+            None to run the classifier on it alone
+        
+        Returns:
+        dict: Analysis results
+        """
+        if labels is None:
+            labels = self.classifier.predict([features])[0]
+        tempo = features["tempo"]
+        spectral_centroid = features["spectral_centroid"]
+        spectral_bandwidth = features["spectral_bandwidth"]
+        mfcc_means = features["mfcc_means"]
         
-        # Use features to determine genre (this would be a machine learning model in a real app)
-        # For now, use a simplified heuristic approach
-        genre_idx = int((spectral_centroid / 5000) * len(self.genres)) % len(self.genres)
-        genre = self.genres[genre_idx]
+        # Get chromagram for key detection
+        key_idx = np.argmax(features["chroma_means"])
         
-        # Set confidence based on spectral features
-        confidence = int(min(100, max(50, (spectral_bandwidth / 5000) * 100)))
+        # Onset strength variation for beat consistency
+        beat_consistency = 1.0 - features["onset_variation"]
+        beat_consistency = max(0, min(1, beat_consistency))  # Normalize between 0 and 1
         
         # Determine energy level (low, medium, high) based on spectral features
-        energy_value = (spectral_rolloff + zero_crossing_rate * 10000) / 10000
-        energy_level = 0.0  # Between 0 and 1
-        
-        if energy_value < 1000:
-            energy_level = 0.3  # Low
-            energy_text = "Low"
-        elif energy_value < 2000:
-            energy_level = 0.6  # Medium
-            energy_text = "Medium"
-        else:
-            energy_level = 0.9  # High
-            energy_text = "High"
+        energy_level, energy_text = energy_rating(features)
             
         # Determine energy variance
-        energy_variance = "small" if np.var(y) < 0.01 else "medium" if np.var(y) < 0.05 else "large"
-        
-        # Select moods based on audio features
-        mood_values = {}
-        
-        # Main mood is based on tempo and energy
-        primary_mood_idx = 0
-        if tempo > 120 and energy_level > 0.7:
-            primary_mood_idx = 0  # Bold
-            mood_values["Bold"] = 100
-        elif tempo > 100 and energy_level > 0.5:
-            primary_mood_idx = 1  # Confident
-            mood_values["Confident"] = 87
-        else:
-            primary_mood_idx = 2  # Restless
-            mood_values["Restless"] = 23
-            
+        signal_var = features["signal_var"]
+        energy_variance = "small" if signal_var < 0.01 else "medium" if signal_var < 0.05 else "large"
+        
         # Set emotion based on spectral features and MFCCs
         # Negative to positive scale from 0 to 1
         mfcc_sum = np.sum(mfcc_means)
         emotion_value = (mfcc_sum + 100) / 200  # Normalize approximately to 0-1
         emotion_value = max(0, min(1, emotion_value))  # Clip to 0-1 range
         
-        # Select instruments based on spectral features
-        instruments = []
-        
-        # Bass detection
-        if np.mean(y**2) > 0.005:
-            instruments.append("Bass")
-            
-        # Beats detection based on tempo
-        if tempo > 80:
-            instruments.append("Beats")
-            
-        # Synth detection based on spectral centroid
-        if spectral_centroid > 3000:
-            instruments.append("Synth")
-            
-        # Ensure we have at least one instrument
-        if not instruments:
-            instruments.append(self.instruments[0])
-        
-        # Determine use cases based on genre and energy
-        use_cases = []
-        if genre == "Hip Hop" and energy_level > 0.7:
-            use_cases.append("extreme sports")
-            use_cases.append("party")
-            use_cases.append("beats")
-        elif genre == "Electronic" and energy_level > 0.6:
-            use_cases.append("party")
-            use_cases.append("workout")
-        else:
-            # Select at least some use cases
-            use_cases = self.use_cases[:3]
-        
         # Vocal analysis
-        has_vocals = np.max(mfccs[1]) > 100  # Simplified vocal detection
+        mfcc1_max = features["mfcc1_max"]
+        has_vocals = mfcc1_max > 100  # Simplified vocal detection
+        
+        # Register is derived from the spectral centroid so repeated analyses (and cached results) agree
+        register = self.vocal_types[int(spectral_centroid) % len(self.vocal_types)]
         
         vocal_analysis = {
             "instrumentation": "Vocal" if has_vocals else "Instrumental",
-            "register": random.choice(self.vocal_types) if has_vocals else "None",
-            "presence": "High" if has_vocals and np.max(mfccs[1]) > 150 else "Medium" if has_vocals else "None",
+            "register": register if has_vocals else "None",
+            "presence": "High" if has_vocals and mfcc1_max > 150 else "Medium" if has_vocals else "None",
             "autotune": "Low" if has_vocals else "None"
         }
         
@@ -148,12 +265,12 @@ class AudioAnalyzer:
         # Combine all results - ensure all values are JSON serializable (convert numpy types to Python native types)
         results = {
             "genre": {
-                "main_genre": genre,
-                "confidence": int(confidence),
-                "elements": "Electronic" if genre != "Electronic" and spectral_centroid > 3000 else ""
+                "main_genre": labels["genre"]["main_genre"],
+                "confidence": int(labels["genre"]["confidence"]),
+                "elements": labels["genre"]["elements"]
             },
-            "mood": mood_values,
-            "instruments": instruments,
+            "mood": {mood: int(value) for mood, value in labels["mood"].items()},
+            "instruments": list(labels["instruments"]),
             "energy": {
                 "level": float(energy_level),
                 "text": energy_text,
@@ -162,14 +279,31 @@ class AudioAnalyzer:
             "emotion": {
                 "value": float(emotion_value)
             },
-            "use_cases": use_cases,
+            "use_cases": list(labels["use_cases"]),
             "vocal": vocal_analysis,
             "technical": {
                 "key": key,
                 "bpm": int(bpm),
                 "beat_consistency": f"{float(beat_consistency):.2f}",
                 "quality": quality
-            }
+            },
+            # Compact summary features for the similarity index, see similarity.py
+            "_vector": feature_vector(features).tolist(),
         }
         
         return results
+    
+    def interpret_batch(self, features_list, sr):
+        """
+        Turn the summary features of many tracks into analysis results, classifying them in one batch.
+        
+        Parameters:
+        features_list (list): Summary feature dicts from features.extract_features
+        sr (int): Sample rate
+        
+        Returns:
+        list: Analysis results, one per track, in input order
+        """
+        labels = self.classifier.predict(features_list)
+        return [self.interpret_features(features, sr, labels=track_labels)
+                for features, track_labels in zip(features_list, labels)]
@@ -0,0 +1,213 @@
+import importlib.util
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+
+import librosa
+import soundfile as sf
+
+from profiling import NULL_TIMER
+
+DEFAULT_RES_TYPE = "soxr_hq"
+
+# Named resampling strategies for the load path, mapped to librosa res_type values.
+# "native" skips resampling and analyzes at the file's own rate.
+RESAMPLE_MODES = {
+    "quality": DEFAULT_RES_TYPE,
+    "fast": "soxr_lq",
+    "native": None,
+}
+
+# librosa res_type values, with the package each one needs
+RES_TYPES = {
+    **{f"soxr_{quality}": "soxr" for quality in ("vhq", "hq", "mq", "lq", "qq")},
+    "kaiser_best": "resampy",
+    "kaiser_fast": "resampy",
+    "fft": "scipy",
+    "scipy": "scipy",
+    "polyphase": "scipy",
+    **{name: "samplerate" for name in ("linear", "zero_order_hold", "sinc_best", "sinc_medium", "sinc_fastest")},
+}
+
+# Duration value selecting preview mode: a few short excerpts spread across the track
+# are analyzed instead of one contiguous stretch
+PREVIEW = "preview"
+PREVIEW_EXCERPTS = 3
+PREVIEW_EXCERPT_SECONDS = 10.0
+
+
+def _soundfile_readable(data):
+    try:
+        sf.info(io.BytesIO(data))
+        return True
+    except RuntimeError:
+        return False
+
+
+@contextmanager
+def open_upload(data, filename=None):
+    """
+    Expose uploaded bytes to the audio decoders without shared files.
+
+    WAV, FLAC, OGG and (with libsndfile 1.1+) MP3 are decoded straight from an
+    in-memory buffer. Anything soundfile can't read goes through librosa's
+    audioread fallback, which needs a real path, so those bytes are written to
+    a private temporary file that is removed on exit.
+
+    Parameters:
+    data (bytes): Uploaded file contents
+    filename (str): Original file name, used for the temp file extension
+
+    Yields:
+    io.BytesIO or str: Buffer or temporary path accepted by librosa.load and soundfile
+    """
+    if _soundfile_readable(data):
+        yield io.BytesIO(data)
+        return
+
+    suffix = os.path.splitext(filename)[1] if filename else ""
+    fd, path = tempfile.mkstemp(prefix="musicvision-", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def resample_settings(mode, sr):
+    """
+    Resolve a resampling mode to load_audio arguments.
+
+    Parameters:
+    mode (str): Key of RESAMPLE_MODES, or a librosa res_type whose package is installed
+    sr (int): Sample rate selected by the user
+
+    Returns:
+    tuple: (target sample rate or None for native, res_type)
+
+    Raises:
+    ValueError: The mode is unknown, or its resampler isn't installed
+    """
+    res_type = RESAMPLE_MODES.get(mode, mode)
+    if res_type is not None and (res_type not in RES_TYPES or importlib.util.find_spec(RES_TYPES[res_type]) is None):
+        available = [*RESAMPLE_MODES, *(name for name, package in RES_TYPES.items()
+                                         if importlib.util.find_spec(package) is not None)]
+        raise ValueError(f"Unknown resample mode {mode!r}, expected one of {', '.join(available)}")
+    if res_type is None:
+        return None, DEFAULT_RES_TYPE
+    return sr, res_type
+
+
+def _slice(samples, sr, offset=0.0, duration=None):
+    # The samples librosa.load(offset=..., duration=...) would decode, as a view
+    start = int(offset * sr)
+    end = None if duration is None else start + int(duration * sr)
+    return samples[start:end]
+
+
+def _cached(pcm_cache, data, filename):
+    # Decoded samples from the cache; on a miss the whole upload is decoded into it in the background
+    if pcm_cache is None:
+        return None
+    decoded = pcm_cache.get(data)
+    if decoded is None:
+        pcm_cache.prefetch(data, filename)
+    return decoded
+
+
+def load_audio(data, sr, duration=None, offset=0.0, filename=None, res_type=DEFAULT_RES_TYPE, timer=NULL_TIMER,
+               pcm_cache=None):
+    """
+    Decode uploaded bytes to a mono time series.
+
+    Parameters:
+    data (bytes): Uploaded file contents
+    sr (int or None): Target sample rate, None to keep the file's native rate
+    duration (float or None): Seconds to load, None for the whole file
+    offset (float): Seconds to skip from the start
+    filename (str): Original file name
+    res_type (str): librosa resampler, e.g. "soxr_hq", "soxr_lq" or "polyphase"
+    timer (StageTimer): Optional instrumentation; records "decode" and "resample"
+    pcm_cache (PCMCache): Optional decoded-audio cache; a cached upload is sliced instead of decoded,
+        an uncached one is decoded as usual while the cache is filled in the background
+
+    Returns:
+    tuple: (audio time series, sample rate)
+    """
+    # Decode at the native rate and resample separately (what librosa.load does
+    # internally) so the two steps can be timed on their own
+    with timer.stage("decode"):
+        decoded = _cached(pcm_cache, data, filename)
+        if decoded is not None:
+            samples, native_sr = decoded
+            y = _slice(samples, native_sr, offset, duration)
+        else:
+            with open_upload(data, filename) as source:
+                y, native_sr = librosa.load(source, sr=None, duration=duration, offset=offset)
+    if sr is None or sr == native_sr:
+        return y, native_sr
+    with timer.stage("resample"):
+        y = librosa.resample(y, orig_sr=native_sr, target_sr=sr, res_type=res_type)
+    return y, sr
+
+
+def excerpt_windows(total, count=PREVIEW_EXCERPTS, seconds=PREVIEW_EXCERPT_SECONDS):
+    """
+    Place excerpts evenly across a track, away from the intro and outro.
+
+    Parameters:
+    total (float): Track length in seconds
+    count (int): Number of excerpts
+    seconds (float): Length of each excerpt
+
+    Returns:
+    list: (offset, duration) pairs; one (0, None) pair when the track is too short to excerpt
+    """
+    if total <= count * seconds:
+        return [(0.0, None)]
+    return [((i + 1) * total / (count + 1) - seconds / 2, seconds) for i in range(count)]
+
+
+def load_excerpts(data, sr, count=PREVIEW_EXCERPTS, seconds=PREVIEW_EXCERPT_SECONDS, filename=None,
+                  res_type=DEFAULT_RES_TYPE, timer=NULL_TIMER, pcm_cache=None):
+    """
+    Decode a few short excerpts spread across an upload, seeking past the rest.
+
+    Parameters:
+    data (bytes): Uploaded file contents
+    sr (int or None): Target sample rate, None to keep the file's native rate
+    count (int): Number of excerpts
+    seconds (float): Length of each excerpt
+    filename (str): Original file name
+    res_type (str): librosa resampler
+    timer (StageTimer): Optional instrumentation; records "decode" and "resample"
+    pcm_cache (PCMCache): Optional decoded-audio cache, see load_audio
+
+    Returns:
+    tuple: (list of excerpt time series, sample rate)
+    """
+    excerpts = []
+    with timer.stage("decode"):
+        decoded = _cached(pcm_cache, data, filename)
+        if decoded is not None:
+            samples, native_sr = decoded
+            windows = excerpt_windows(len(samples) / native_sr, count, seconds)
+            excerpts = [_slice(samples, native_sr, offset, duration) for offset, duration in windows]
+        else:
+            with open_upload(data, filename) as source:
+                try:
+                    total = sf.info(source).duration
+                except RuntimeError:
+                    total = librosa.get_duration(path=source)
+                for offset, duration in excerpt_windows(total, count, seconds):
+                    if hasattr(source, "seek"):
+                        source.seek(0)
+                    y, native_sr = librosa.load(source, sr=None, offset=offset, duration=duration)
+                    excerpts.append(y)
+    if sr is None or sr == native_sr:
+        return excerpts, native_sr
+    with timer.stage("resample"):
+        excerpts = [librosa.resample(y, orig_sr=native_sr, target_sr=sr, res_type=res_type) for y in excerpts]
+    return excerpts, sr
@@ -0,0 +1,270 @@
+"""
+Headless batch analysis of audio catalogs.
+
+Usage:
+    python -m batch music/ more_tracks.txt --output results.jsonl --workers 8
+
+Inputs may be audio files, directories (searched recursively) or text files
+listing one audio path per line. Results are streamed to the output as each
+track finishes; tracks already present in the output are skipped, so an
+interrupted run can simply be restarted.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from audio_io import DEFAULT_RES_TYPE, RESAMPLE_MODES, resample_settings
+from classifiers import DEFAULT_CLASSIFIER, load_classifier
+from features import DEFAULT_FEATURE_ENGINE, DEFAULT_TEMPO_BACKEND, FEATURE_ENGINES, TEMPO_BACKENDS
+from profiling import NULL_TIMER, StageTimer
+from results_store import ResultsStore
+from similarity import VectorStore, split_vector, track_metadata
+from warmup import enable_jit_cache
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg")
+
+# Times a track is retried after its worker process died before it is recorded as failed
+MAX_CRASH_RETRIES = 1
+
+_analyzer = None
+
+
+def _init_worker(classifier=DEFAULT_CLASSIFIER):
+    # Each worker process builds its analyzer, and loads the classifier, once and reuses it for every track
+    global _analyzer
+    from audio_analyzer import AudioAnalyzer
+    enable_jit_cache()
+    _analyzer = AudioAnalyzer(classifier=load_classifier(classifier))
+
+
+def analyze_file(path, sample_rate, duration, engine, res_type=DEFAULT_RES_TYPE, timings=False,
+                 tempo_backend=DEFAULT_TEMPO_BACKEND):
+    """
+    Load and analyze one file inside a worker process.
+
+    Full tracks are streamed with AudioAnalyzer.analyze_stream; the feature
+    engine only applies to fixed durations and to files soundfile can't read.
+
+    Parameters:
+    path (str): Audio file path
+    sample_rate (int or None): Analysis sample rate, None for the native rate
+    duration (float or None): Seconds to analyze, None for the full file
+    engine (str): Feature engine
+    res_type (str): librosa resampler
+    timings (bool): Include per-stage "_timings" in the result
+    tempo_backend (str): Tempo estimator
+
+    Returns:
+    dict: Output record with either a "result" or an "error" entry
+    """
+    import librosa
+
+    timer = StageTimer() if timings else None
+    start = time.perf_counter()
+    try:
+        result = None
+        if duration is None:
+            # Full tracks are analyzed block by block so memory stays bounded for long mixes
+            try:
+                result = _analyzer.analyze_stream(path, sample_rate, res_type=res_type, timer=timer,
+                                                  tempo_backend=tempo_backend)
+            except RuntimeError:
+                # soundfile can't decode this file; fall back to librosa's full decode
+                pass
+        if result is None:
+            with (timer or NULL_TIMER).stage("load"):
+                y, sr = librosa.load(path, sr=sample_rate, duration=duration, res_type=res_type)
+            result = _analyzer.analyze_audio(y, sr, engine=engine, timer=timer, tempo_backend=tempo_backend)
+        record = {"path": path, "result": result}
+    except Exception as e:
+        record = {"path": path, "error": f"{type(e).__name__}: {e}"}
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def file_hash(path):
+    """Hex SHA-256 of a file, the same key analysis_cache.content_hash gives its bytes."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def collect_inputs(inputs):
+    """
+    Expand directories and list files into audio file paths.
+
+    Parameters:
+    inputs (list): Files, directories or text files listing paths
+
+    Returns:
+    list: Audio file paths in a stable order, without duplicates
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for path in sorted(glob.glob(os.path.join(item, "**", "*"), recursive=True)):
+                if path.lower().endswith(AUDIO_EXTENSIONS):
+                    paths.append(path)
+        elif item.lower().endswith(AUDIO_EXTENSIONS):
+            paths.append(item)
+        else:
+            with open(item) as f:
+                paths.extend(line.strip() for line in f if line.strip())
+    return list(dict.fromkeys(paths))
+
+
+class JsonlWriter:
+    """Append records to a JSON Lines file, one flushed line per track."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def existing_paths(self):
+        done = set()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["path"])
+                    except (ValueError, KeyError):
+                        # Ignore a line truncated by an interrupted run
+                        continue
+        return done
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        return self
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+def run_batch(paths, writer, workers=None, sample_rate=22050, duration=30, engine=DEFAULT_FEATURE_ENGINE,
+              res_type=DEFAULT_RES_TYPE, timings=False, tempo_backend=DEFAULT_TEMPO_BACKEND, store=None,
+              classifier=DEFAULT_CLASSIFIER, log=sys.stderr):
+    """
+    Analyze paths across a process pool, streaming records to writer.
+
+    Parameters:
+    paths (list): Audio files still to analyze
+    writer: Open JsonlWriter or results_store.ResultsStore
+    workers (int or None): Worker processes, defaults to the CPU count
+    sample_rate (int or None): Analysis sample rate, None for the native rate
+    duration (float or None): Seconds per track, None for full tracks
+    engine (str): Feature engine
+    res_type (str): librosa resampler
+    timings (bool): Include per-stage "_timings" in each result
+    tempo_backend (str): Tempo estimator
+    store (VectorStore): Optional similarity catalog every analyzed track is added to
+    classifier (str): "heuristic" or the path of a classifier model, loaded once per worker
+    log (file): Stream for progress messages
+
+    Returns:
+    dict: Run summary with processed, failed, short_circuited(_fraction), seconds and tracks_per_second
+    """
+    workers = workers or os.cpu_count() or 1
+    pending = list(reversed(paths))
+    crashes = {}
+    processed = failed = short_circuited = 0
+    start = time.perf_counter()
+
+    while pending:
+        # A crashed worker breaks the whole pool, so the loop rebuilds it and resubmits unfinished tracks
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(classifier,)) as pool:
+            in_flight = {}
+            try:
+                while pending or in_flight:
+                    # Keep a bounded number of tasks queued so huge catalogs don't sit in memory as futures
+                    while pending and len(in_flight) < workers * 4:
+                        path = pending.pop()
+                        future = pool.submit(analyze_file, path, sample_rate, duration, engine, res_type, timings,
+                                             tempo_backend)
+                        in_flight[future] = path
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record = future.result()
+                        del in_flight[future]
+                        vector = None
+                        if "result" in record:
+                            record["result"], vector = split_vector(record["result"])
+                        writer.write(record)
+                        if store is not None and vector is not None:
+                            store.add(file_hash(record["path"]), vector,
+                                      track_metadata(os.path.basename(record["path"]), record["result"]))
+                        processed += 1
+                        failed += "error" in record
+                        short_circuited += "_degenerate" in record.get("result", {})
+                        if processed % 100 == 0:
+                            rate = processed / (time.perf_counter() - start)
+                            print(f"{processed}/{len(paths)} tracks, {rate:.2f} tracks/s", file=log)
+            except BrokenProcessPool:
+                for path in in_flight.values():
+                    crashes[path] = crashes.get(path, 0) + 1
+                    if crashes[path] > MAX_CRASH_RETRIES:
+                        writer.write({"path": path, "error": "Worker process crashed", "seconds": 0.0})
+                        processed += 1
+                        failed += 1
+                    else:
+                        pending.append(path)
+
+    seconds = time.perf_counter() - start
+    return {
+        "processed": processed,
+        "failed": failed,
+        # Silent, too short or broken tracks answered by the pre-analysis gate
+        "short_circuited": short_circuited,
+        "short_circuited_fraction": round(short_circuited / processed, 3) if processed else 0.0,
+        "seconds": round(seconds, 3),
+        "tracks_per_second": round(processed / seconds, 3) if seconds > 0 else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Audio files, directories or text files listing paths")
+    parser.add_argument("--output", "-o", required=True, help="JSON Lines file, or directory for Parquet output")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="Output format")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--sr", type=int, default=22050, help="Analysis sample rate")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per track, 0 for full tracks")
+    parser.add_argument("--engine", choices=FEATURE_ENGINES, default=DEFAULT_FEATURE_ENGINE, help="Feature engine")
+    parser.add_argument("--tempo", choices=TEMPO_BACKENDS, default=DEFAULT_TEMPO_BACKEND, help="Tempo estimator")
+    parser.add_argument("--classifier", default=DEFAULT_CLASSIFIER,
+                        help="Genre/mood classifier: heuristic or the path of an .npz model")
+    parser.add_argument("--resample", default="quality",
+                        help=f"Resampling mode ({', '.join(RESAMPLE_MODES)}) or an installed librosa res_type")
+    parser.add_argument("--timings", action="store_true", help="Record per-stage timings in each result")
+    parser.add_argument("--vectors", action="store_true",
+                        help="Add analyzed tracks to the similarity store searched by the app")
+    args = parser.parse_args(argv)
+
+    try:
+        sample_rate, res_type = resample_settings(args.resample, args.sr)
+    except ValueError as e:
+        parser.error(str(e))
+    writer = ResultsStore(args.output) if args.format == "parquet" else JsonlWriter(args.output)
+    paths = collect_inputs(args.inputs)
+    done = writer.existing_paths()
+    todo = [path for path in paths if path not in done]
+    print(f"{len(paths)} tracks found, {len(paths) - len(todo)} already analyzed", file=sys.stderr)
+
+    with writer:
+        summary = run_batch(todo, writer, workers=args.workers, sample_rate=sample_rate,
+                            duration=args.duration or None, engine=args.engine, res_type=res_type, timings=args.timings,
+                            tempo_backend=args.tempo, store=VectorStore() if args.vectors else None,
+                            classifier=args.classifier)
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
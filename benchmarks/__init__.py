@@ -0,0 +1 @@
+"""Standalone benchmark scripts for the audio analysis pipeline."""
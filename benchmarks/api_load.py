@@ -0,0 +1,97 @@
+"""
+Load-test the HTTP analysis API with synthetic audio.
+
+Starts the API in-process on a free port (or targets --url), then sends
+--requests POST /analyze calls from --concurrency client threads. Every
+request carries a distinct synthetic track, so neither the result cache nor
+in-flight deduplication hides the analysis cost. Reports status counts
+(429s show where backpressure kicks in), latency percentiles of successful
+requests and throughput.
+
+Usage:
+    python -m benchmarks.api_load [--requests 64] [--concurrency 8] [--workers 2] [--max-pending 4]
+    python -m benchmarks.api_load --url http://host:8000 --requests 200 --concurrency 32
+"""
+import argparse
+import io
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+from benchmarks.corpus import synthetic_track
+
+
+def wav_bytes(y, sr):
+    buffer = io.BytesIO()
+    sf.write(buffer, y, sr, format="WAV")
+    return buffer.getvalue()
+
+
+def post(url, data):
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "audio/wav"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running API; by default one is started in-process")
+    parser.add_argument("--requests", type=int, default=64, help="Requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="Client threads")
+    parser.add_argument("--duration", type=float, default=30.0, help="Length of each synthetic track in seconds")
+    parser.add_argument("--sr", type=int, default=22050, help="Sample rate of the synthetic tracks")
+    parser.add_argument("--workers", type=int, default=2, help="Analysis workers of the in-process API")
+    parser.add_argument("--max-pending", type=int, default=4, help="Queue limit of the in-process API")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        from api import make_server
+
+        server = make_server(port=0, workers=args.workers, max_pending=args.max_pending, cache=False,
+                             vectors=False)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+
+    rng = np.random.default_rng(0)
+    bodies = [
+        wav_bytes(synthetic_track(args.sr, args.duration, bpm=rng.uniform(70, 170), seed=i), args.sr)
+        for i in range(args.requests)
+    ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(lambda body: post(f"{url}/analyze?duration=0", body), bodies))
+    elapsed = time.perf_counter() - start
+
+    if server is not None:
+        server.shutdown()
+        server.jobs.shutdown()
+
+    latencies = np.array([seconds for status, seconds in outcomes if status == 200])
+    summary = {
+        "statuses": dict(Counter(status for status, _ in outcomes)),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 3),
+    }
+    if len(latencies):
+        summary.update({f"p{q}_seconds": round(float(np.percentile(latencies, q)), 3) for q in (50, 95, 99)})
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Inference latency of the classifier backends, per track and per batch.
+
+Extracts summary features from a few synthetic tracks and jitters them into
+--tracks feature sets, then times each backend's predict() on one track at
+a time and on the whole set in one batched call. The MLP has random
+weights saved to and loaded from a temporary .npz file, the same path a
+trained model takes; its cost only depends on the layer sizes.
+
+Usage:
+    python -m benchmarks.classifier [--tracks 4096] [--hidden 256,128] [--repeats 5]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.corpus import synthetic_track
+from classifiers import GENRES, HEADS, INSTRUMENTS, MOODS, USE_CASES, HeuristicClassifier, MLPClassifier
+from features import VECTOR_DIM, extract_features, feature_vector
+
+
+def jittered_features(count, sr=22050, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = [extract_features(synthetic_track(sr, 10, bpm=bpm, seed=i), sr) for i, bpm in enumerate((80, 110, 140))]
+    features_list = []
+    for i in range(count):
+        base = bases[i % len(bases)]
+        features_list.append({
+            name: value * rng.uniform(0.8, 1.2) if isinstance(value, (float, np.ndarray)) else value
+            for name, value in base.items()
+        })
+    return features_list
+
+
+def random_mlp(hidden, features_list, path, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = np.stack([feature_vector(features) for features in features_list])
+    sizes = [VECTOR_DIM] + hidden
+    layers = [(rng.standard_normal((n_in, n_out)) / np.sqrt(n_in), np.zeros(n_out))
+              for n_in, n_out in zip(sizes[:-1], sizes[1:])]
+    labels = {"genre": GENRES, "mood": MOODS, "instruments": INSTRUMENTS, "use_cases": USE_CASES}
+    heads = {head: (rng.standard_normal((sizes[-1], len(labels[head]))) / np.sqrt(sizes[-1]),
+                    np.zeros(len(labels[head])), labels[head]) for head in HEADS}
+    MLPClassifier(vectors.mean(axis=0), vectors.std(axis=0) + 1e-6, layers, heads).save(path)
+    return MLPClassifier.load(path)
+
+
+def best(call, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=4096, help="Tracks per batch")
+    parser.add_argument("--hidden", default="256,128", help="Comma-separated hidden layer sizes of the MLP")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs (best is kept)")
+    args = parser.parse_args()
+
+    features_list = jittered_features(args.tracks)
+    with tempfile.TemporaryDirectory() as path:
+        model_path = os.path.join(path, "model.npz")
+        start = time.perf_counter()
+        mlp = random_mlp([int(size) for size in args.hidden.split(",") if size], features_list, model_path)
+        load_ms = (time.perf_counter() - start) * 1000
+
+    summary = {"tracks": args.tracks, "mlp_hidden": args.hidden, "mlp_load_ms": round(load_ms, 2)}
+    for name, classifier in (("heuristic", HeuristicClassifier()), ("mlp", mlp)):
+        classifier.predict(features_list[:8])
+        single = best(lambda: [classifier.predict([features]) for features in features_list[:256]], args.repeats)
+        batch = best(lambda: classifier.predict(features_list), args.repeats)
+        summary[name] = {
+            "per_track_single_ms": round(single / 256 * 1000, 4),
+            "batch_ms": round(batch * 1000, 2),
+            "per_track_in_batch_ms": round(batch / args.tracks * 1000, 4),
+        }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the "legacy" and "shared" feature engines.
+
+Reports per-track wall time, peak traced memory and the largest relative
+deviation between the two engines' summary features.
+
+Usage:
+    python -m benchmarks.feature_engine [audio files...] [--sr 22050] [--duration 30]
+
+Without files, a synthetic 30 second test signal is used.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import librosa
+
+from benchmarks.corpus import synthetic_track
+from features import FEATURE_ENGINES, extract_features
+
+
+def measure(y, sr, engine, repeats):
+    """Return (best wall time in seconds, peak traced bytes, features)."""
+    # Warm-up run so numba compilation and filter construction are not timed
+    features = extract_features(y, sr, engine=engine)
+
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        extract_features(y, sr, engine=engine)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    extract_features(y, sr, engine=engine)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, features
+
+
+def max_relative_deviation(reference, candidate):
+    worst = 0.0
+    for name, value in reference.items():
+        ref = np.atleast_1d(np.asarray(value, dtype=np.float64))
+        new = np.atleast_1d(np.asarray(candidate[name], dtype=np.float64))
+        scale = np.maximum(np.abs(ref), 1e-9)
+        worst = max(worst, float(np.max(np.abs(ref - new) / scale)))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Audio files to benchmark")
+    parser.add_argument("--sr", type=int, default=22050, help="Analysis sample rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of audio per track")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per engine (best is reported)")
+    args = parser.parse_args()
+
+    if args.files:
+        tracks = [(path, librosa.load(path, sr=args.sr, duration=args.duration)[0]) for path in args.files]
+    else:
+        tracks = [("synthetic", synthetic_track(args.sr, args.duration))]
+
+    print(f"{'track':<30} {'engine':<8} {'time (s)':>10} {'peak (MiB)':>11}")
+    for name, y in tracks:
+        results = {}
+        for engine in FEATURE_ENGINES:
+            seconds, peak, features = measure(y, args.sr, engine, args.repeats)
+            results[engine] = features
+            print(f"{name[-30:]:<30} {engine:<8} {seconds:>10.3f} {peak / 2**20:>11.1f}")
+        deviation = max_relative_deviation(results["legacy"], results["shared"])
+        print(f"{'':<30} max relative deviation: {deviation:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Agreement of the preview and first-30-seconds modes with full-song analysis.
+
+Every track is analyzed three ways through the app's load path: the full
+song, the first 30 seconds, and the preview (excerpts spread across the
+track). For both short modes the script reports how often genre, key, mood,
+energy and instruments match the full-song result, the mean BPM error, and
+the mean time relative to the full-song analysis.
+
+Usage:
+    python -m benchmarks.preview song.mp3 more_songs/*.flac [--sr 22050]
+
+Without files, synthetic tracks whose intro differs from the body are used.
+"""
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+import soundfile as sf
+
+from audio_analyzer import AudioAnalyzer
+from audio_io import PREVIEW
+from benchmarks.corpus import silence, sine_chord, synthetic_track
+from jobs import analyze_upload
+from profiling import StageTimer
+
+MODES = {"first_30s": 30, "preview": PREVIEW}
+
+
+def synthetic_songs(sr, count=4):
+    # A quiet sustained-chord intro followed by a long rhythmic body, like many produced tracks
+    songs = []
+    for i in range(count):
+        intro = sine_chord(sr, 30, root=i * 3 % 12)
+        body = synthetic_track(sr, 150, bpm=90 + 20 * i, seed=i)
+        y = np.concatenate([silence(sr, 2), 0.3 * intro, body])
+        buffer = io.BytesIO()
+        sf.write(buffer, y, sr, format="WAV")
+        songs.append((f"synthetic-{i}", buffer.getvalue()))
+    return songs
+
+
+def agreement(result, reference):
+    """
+    Compare an analysis result with the full-song reference.
+
+    Returns:
+    dict: Per-field booleans plus the absolute BPM difference
+    """
+    return {
+        "genre": result["genre"]["main_genre"] == reference["genre"]["main_genre"],
+        "key": result["technical"]["key"] == reference["technical"]["key"],
+        "mood": list(result["mood"]) == list(reference["mood"]),
+        "energy": result["energy"]["text"] == reference["energy"]["text"],
+        "instruments": result["instruments"] == reference["instruments"],
+        "bpm_error": abs(result["technical"]["bpm"] - reference["technical"]["bpm"]),
+    }
+
+
+def timed(analyzer, data, filename, sr, duration):
+    start = time.perf_counter()
+    result = analyze_upload(StageTimer(), analyzer, data, filename, sr, duration, "soxr_hq")
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Audio files (default: synthetic songs)")
+    parser.add_argument("--sr", type=int, default=22050, help="Analysis sample rate")
+    args = parser.parse_args()
+
+    if args.files:
+        tracks = []
+        for path in args.files:
+            with open(path, "rb") as f:
+                tracks.append((path, f.read()))
+    else:
+        tracks = synthetic_songs(args.sr)
+
+    analyzer = AudioAnalyzer(sample_rates=[args.sr])
+    # Warm-up so numba compilation is not timed
+    analyzer.analyze_audio(synthetic_track(args.sr, 5), args.sr)
+
+    scores = {mode: [] for mode in MODES}
+    for filename, data in tracks:
+        reference, full_seconds = timed(analyzer, data, filename, args.sr, None)
+        for mode, duration in MODES.items():
+            result, seconds = timed(analyzer, data, filename, args.sr, duration)
+            scores[mode].append({**agreement(result, reference), "relative_time": seconds / full_seconds})
+
+    summary = {}
+    for mode, rows in scores.items():
+        summary[mode] = {
+            field: round(float(np.mean([row[field] for row in rows])), 3)
+            for field in ("genre", "key", "mood", "energy", "instruments", "bpm_error", "relative_time")
+        }
+    print(json.dumps({"tracks": len(tracks), "agreement": summary}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Measure how long app.py takes to rerun after UI-only interactions.
+
+Every Streamlit widget change reruns the page script. Once a track is
+analyzed, such reruns should only render: this benchmark uploads a track,
+waits for its analysis, then times script runs, driven by Streamlit's
+AppTest harness, after each interaction:
+
+    rerun               a rerun with no widget change
+    toggle_performance  ticking "Show performance panel" on and off
+    export_format       switching the download format
+    toggle_timeline     ticking "Show timeline" on and off (its segments are analyzed before timing)
+
+It also reports the number of markdown elements the page sends to the
+browser, each of which the front end has to render.
+
+Usage:
+    python -m benchmarks.rerun [audio file] [--runs 20]
+
+Without a file, a 3 minute synthetic track is written to a temporary WAV.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The uploader is replaced so the script sees an upload without a browser session
+_SCRIPT = """
+import io, runpy, sys
+import streamlit as st
+
+class Upload(io.BytesIO):
+    name = {audio!r}
+    type = "audio/wav"
+    file_id = "benchmark"
+
+with open({audio!r}, "rb") as f:
+    data = f.read()
+st.file_uploader = lambda *args, **kwargs: Upload(data)
+sys.path.insert(0, {root!r})
+runpy.run_path({app!r}, run_name="__main__")
+"""
+
+
+def _settle(at):
+    # While a job runs the page only shows its progress; poll like the browser would
+    at.run()
+    while any("..." in info.value for info in at.info) and not at.exception:
+        time.sleep(0.1)
+        at.run()
+    if at.exception:
+        raise SystemExit(str(at.exception[0].value))
+
+
+def _checkbox(at, label):
+    return next(checkbox for checkbox in at.checkbox if checkbox.label == label)
+
+
+def measure(audio_path, runs):
+    """
+    Time page reruns after each UI-only interaction.
+
+    Parameters:
+    audio_path (str): Audio file to upload
+    runs (int): Timed reruns per interaction
+
+    Returns:
+    dict: interaction -> list of seconds, plus "markdown_elements"
+    """
+    from streamlit.testing.v1 import AppTest
+
+    script = _SCRIPT.format(audio=audio_path, root=REPO_ROOT, app=os.path.join(REPO_ROOT, "app.py"))
+    at = AppTest.from_string(script, default_timeout=600)
+    _settle(at)
+    # Analyze the timeline once so toggling it afterwards only renders
+    _checkbox(at, "Show timeline").check()
+    _settle(at)
+    _checkbox(at, "Show timeline").uncheck()
+    _settle(at)
+
+    interactions = {
+        "rerun": lambda i: None,
+        "toggle_performance": lambda i: _checkbox(at, "Show performance panel").set_value(i % 2 == 0),
+        "export_format": lambda i: at.radio[0].set_value(("json", "csv")[i % 2]),
+        "toggle_timeline": lambda i: _checkbox(at, "Show timeline").set_value(i % 2 == 0),
+    }
+    results = {}
+    for name, interact in interactions.items():
+        results[name] = []
+        for i in range(runs):
+            interact(i)
+            start = time.perf_counter()
+            at.run()
+            results[name].append(time.perf_counter() - start)
+        if at.exception:
+            raise SystemExit(str(at.exception[0].value))
+        # Leave every toggle off for the next interaction
+        interact(1)
+        at.run()
+    results["markdown_elements"] = len(at.markdown)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", nargs="?", help="Audio file to upload")
+    parser.add_argument("--runs", type=int, default=20, help="Timed reruns per interaction")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # A fresh result cache, so the first analysis is not served from an earlier run
+        os.environ["MUSICVISION_CACHE_DIR"] = os.path.join(scratch, "cache")
+        path = args.file
+        if path is None:
+            import soundfile as sf
+            from benchmarks.corpus import synthetic_track
+
+            path = os.path.join(scratch, "synthetic.wav")
+            sf.write(path, synthetic_track(44100, 180.0), 44100)
+        results = measure(os.path.abspath(path), args.runs)
+
+    markdown_elements = results.pop("markdown_elements")
+    print(f"{'interaction':<20} {'median (ms)':>12} {'min (ms)':>9} {'max (ms)':>9}")
+    for name, seconds in results.items():
+        ms = np.array(seconds) * 1000
+        print(f"{name:<20} {np.median(ms):>12.1f} {ms.min():>9.1f} {ms.max():>9.1f}")
+    print(json.dumps({"markdown_elements": markdown_elements}))
+
+
+if __name__ == "__main__":
+    main()
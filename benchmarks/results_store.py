@@ -0,0 +1,84 @@
+"""
+Append throughput and query latency of the columnar results store.
+
+Writes --tracks synthetic records into a temporary ResultsStore through the
+same write() path batch runs use, then times a few typical queries: a
+filtered selection ("High energy above 120 BPM in A minor"), a filtered
+count and per-genre and per-key aggregates. The records vary genre, key,
+tempo, energy and mood at random; only their count and shape matter for
+the cost.
+
+Usage:
+    python -m benchmarks.results_store [--tracks 1000000] [--repeats 5]
+"""
+import argparse
+import copy
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from audio_analyzer import AudioAnalyzer
+from benchmarks.corpus import synthetic_track
+from results_store import ResultsStore
+
+QUERIES = {
+    "select_high_energy_a_minor": lambda store: store.query(
+        where=["energy == High", "bpm > 120", "key == 'A minor'"]),
+    "count_fast_tracks": lambda store: store.count(where=["bpm >= 140"]),
+    "aggregate_by_genre": lambda store: store.aggregate(["genre"]),
+    "aggregate_by_key_and_energy": lambda store: store.aggregate(["key", "energy"], where=["mood == Bold"]),
+}
+
+
+def synthetic_records(count, seed=0):
+    analyzer = AudioAnalyzer()
+    template = analyzer.analyze_audio(synthetic_track(22050, 10, bpm=120), 22050)
+    template.pop("_vector", None)
+    rng = np.random.default_rng(seed)
+    energies = [("Low", 0.3), ("Medium", 0.6), ("High", 0.9)]
+    moods = [{"Bold": 100}, {"Confident": 87}, {"Restless": 23}]
+    for i in range(count):
+        result = copy.deepcopy(template)
+        result["genre"]["main_genre"] = analyzer.genres[rng.integers(len(analyzer.genres))]
+        result["technical"]["key"] = analyzer.keys[rng.integers(len(analyzer.keys))]
+        result["technical"]["bpm"] = int(rng.integers(60, 181))
+        result["energy"]["text"], result["energy"]["level"] = energies[rng.integers(3)]
+        result["mood"] = moods[rng.integers(3)]
+        result["emotion"]["value"] = float(rng.random())
+        yield {"path": f"track-{i}.mp3", "result": result, "seconds": 1.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=1_000_000, help="Records in the store")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per query (best is kept)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        store = ResultsStore(path)
+        start = time.perf_counter()
+        with store:
+            for record in synthetic_records(args.tracks):
+                store.write(record)
+        append = time.perf_counter() - start
+        summary = {
+            "tracks": store.count(),
+            "append_seconds": round(append, 3),
+            "append_tracks_per_second": round(args.tracks / append),
+        }
+
+        for name, query in QUERIES.items():
+            times = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                result = query(store)
+                times.append(time.perf_counter() - start)
+            rows = result if isinstance(result, int) else result.num_rows
+            summary[name] = {"rows": rows, "ms": round(min(times) * 1000, 2)}
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Query latency of the similar-tracks index over a large synthetic catalog.
+
+Fills a temporary VectorStore with random feature vectors (real vectors are
+cheap to fake: only their count and dimension matter for search cost), then
+times SimilarityIndex build and query for exact search and, when hnswlib is
+installed, approximate search. Approximate results are scored by recall
+against the exact neighbours.
+
+Usage:
+    python -m benchmarks.similarity [--tracks 1000000] [--queries 200] [--k 10]
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from features import VECTOR_DIM
+from similarity import SimilarityIndex, VectorStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=1_000_000, help="Catalog size")
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours per query")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as path:
+        store = VectorStore(path)
+        start = time.perf_counter()
+        for first in range(0, args.tracks, 100_000):
+            count = min(100_000, args.tracks - first)
+            vectors = rng.standard_normal((count, VECTOR_DIM)).astype(np.float32)
+            store.add_many((f"track-{first + i}", vector, {"name": f"track-{first + i}"})
+                           for i, vector in enumerate(vectors))
+        summary = {"tracks": len(store), "fill_seconds": round(time.perf_counter() - start, 3)}
+
+        queries = rng.standard_normal((args.queries, VECTOR_DIM)).astype(np.float32)
+        exact_ids = None
+        for approximate in (False, True):
+            try:
+                index = SimilarityIndex(store, approximate=approximate)
+            except RuntimeError as e:
+                summary["approximate"] = str(e)
+                continue
+            start = time.perf_counter()
+            index.query(queries[0], k=args.k)
+            build = time.perf_counter() - start
+
+            latencies, ids = [], []
+            for q in queries:
+                start = time.perf_counter()
+                ids.append({hit["id"] for hit in index.query(q, k=args.k)})
+                latencies.append(time.perf_counter() - start)
+            entry = {
+                "build_seconds": round(build, 3),
+                "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+            }
+            if exact_ids is None:
+                exact_ids = ids
+            else:
+                entry["recall"] = round(float(np.mean([len(a & b) / args.k for a, b in zip(ids, exact_ids)])), 3)
+            summary["approximate" if approximate else "exact"] = entry
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
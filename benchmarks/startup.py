@@ -0,0 +1,136 @@
+"""
+Measure Streamlit cold-start latency of app.py.
+
+Each measurement runs in a fresh interpreter, driven by Streamlit's AppTest
+harness, and reports:
+
+    imports         time to import the analysis modules app.py depends on
+    first_render    first script run with no upload (the welcome page)
+    first_analysis  first upload until its results render, including the
+                    analyzer construction, decoding and the analysis itself
+
+Every run gets a fresh result cache, but compiled librosa kernels come from
+one JIT cache filled by `python -m warmup` beforehand, as in an image built
+with it. --cold-jit gives every run an empty JIT cache instead.
+
+Usage:
+    python -m benchmarks.startup [audio file] [--runs 3] [--cold-jit]
+
+Without a file, a 30 second synthetic track is written to a temporary WAV.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORTS = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import audio_analyzer, analysis_cache, audio_io, profiling
+print(json.dumps({{"imports": time.perf_counter() - start}}))
+"""
+
+# The uploader is replaced so the script sees an upload without a browser session
+_APP = r"""
+import json, os, runpy, sys, time
+sys.path.insert(0, {root!r})
+os.chdir({root!r})
+from streamlit.testing.v1 import AppTest
+
+script = '''
+import io, runpy, sys
+import streamlit as st
+path = {audio!r}
+
+class Upload(io.BytesIO):
+    name = path
+    type = "audio/wav"
+    file_id = "benchmark"
+
+if path:
+    with open(path, "rb") as f:
+        data = f.read()
+    st.file_uploader = lambda *args, **kwargs: Upload(data)
+sys.path.insert(0, {root!r})
+runpy.run_path({app!r}, run_name="__main__")
+'''
+at = AppTest.from_string(script, default_timeout=600)
+start = time.perf_counter()
+at.run()
+# While the analysis job runs the page only shows its progress; poll like the browser would
+while at.info and not at.exception:
+    time.sleep(0.1)
+    at.run()
+elapsed = time.perf_counter() - start
+if at.exception or at.error:
+    raise SystemExit(str((at.exception or at.error)[0].value))
+print(json.dumps({{{metric!r}: elapsed}}))
+"""
+
+
+def _run(code, env):
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure(audio_path, runs, cold_jit=False):
+    """
+    Measure every startup metric in fresh processes.
+
+    Parameters:
+    audio_path (str): WAV or other audio file to upload for first_analysis
+    runs (int): Fresh processes per metric
+    cold_jit (bool): Start every run without compiled kernels instead of with a warmed JIT cache
+
+    Returns:
+    dict: metric -> list of seconds
+    """
+    app = os.path.join(REPO_ROOT, "app.py")
+    results = {"imports": [], "first_render": [], "first_analysis": []}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        jit_cache = os.path.join(cache_dir, "numba")
+        if not cold_jit:
+            subprocess.run([sys.executable, "-m", "warmup", "--cache-dir", jit_cache], cwd=REPO_ROOT,
+                           capture_output=True, check=True)
+        for run in range(runs):
+            # A fresh result cache per run, so first_analysis always misses
+            env = dict(os.environ, MUSICVISION_CACHE_DIR=os.path.join(cache_dir, str(run)),
+                       NUMBA_CACHE_DIR=os.path.join(jit_cache, str(run)) if cold_jit else jit_cache)
+            results["imports"].append(_run(_IMPORTS.format(root=REPO_ROOT), env)["imports"])
+            for metric, audio in (("first_render", ""), ("first_analysis", audio_path)):
+                code = _APP.format(root=REPO_ROOT, app=app, audio=audio, metric=metric)
+                results[metric].append(_run(code, env)[metric])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", nargs="?", help="Audio file to upload")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per metric")
+    parser.add_argument("--cold-jit", action="store_true", help="Start every run with an empty JIT cache")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = args.file
+        if path is None:
+            import soundfile as sf
+            from benchmarks.corpus import synthetic_track
+
+            path = os.path.join(scratch, "synthetic.wav")
+            sf.write(path, synthetic_track(22050, 30.0), 22050)
+        results = measure(os.path.abspath(path), args.runs, cold_jit=args.cold_jit)
+
+    print(f"{'metric':<16} {'median (s)':>11} {'min (s)':>9} {'max (s)':>9}")
+    for metric, seconds in results.items():
+        print(f"{metric:<16} {np.median(seconds):>11.3f} {min(seconds):>9.3f} {max(seconds):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
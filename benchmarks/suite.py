@@ -0,0 +1,196 @@
+"""
+Reproducible analyze_audio benchmark suite over a synthetic corpus.
+
+Every case (click tracks at known BPMs, sine chords in known keys, noise and
+silence, at 22050/44100/48000 Hz) runs in a fresh process so its peak RSS is
+its own. The suite records latency percentiles, throughput in seconds of
+audio per second, peak RSS, a fingerprint of the analysis result, and
+accuracy checks against the known BPM or key. Results are written as JSON
+so runs can be compared across commits.
+
+Usage:
+    python -m benchmarks.suite --profile quick --output bench.json
+    python -m benchmarks.suite --baseline bench.json --fail-on-change
+
+--fail-on-change exits with status 1 when any result fingerprint differs
+from the baseline, so performance work can't silently change outputs.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmarks.corpus import PROFILES, SAMPLE_RATES, cases
+
+# Latency regressions above this fraction of the baseline p50 are reported
+REGRESSION_THRESHOLD = 0.10
+
+
+def _repeats(duration):
+    if duration <= 60:
+        return 5
+    if duration <= 300:
+        return 2
+    return 1
+
+
+def fingerprint(result):
+    """Short stable hash of an analysis result, ignoring timing data."""
+    stable = {key: value for key, value in result.items() if not key.startswith("_")}
+    return hashlib.sha256(json.dumps(stable, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def run_case(case):
+    """
+    Time analyze_audio on one synthetic case.
+
+    Parameters:
+    case (dict): Entry from benchmarks.corpus.cases
+
+    Returns:
+    dict: Case measurements
+    """
+    from audio_analyzer import AudioAnalyzer
+
+    analyzer = AudioAnalyzer()
+    sr, duration = case["sr"], case["duration"]
+    y = case["make"]()
+
+    # A one-second warm-up keeps numba compilation and filter construction out of the latencies
+    analyzer.analyze_audio(y[:sr], sr)
+
+    latencies = []
+    for _ in range(_repeats(duration)):
+        start = time.perf_counter()
+        result = analyzer.analyze_audio(y, sr)
+        latencies.append(time.perf_counter() - start)
+
+    checks = {}
+    if "bpm" in case["expected"]:
+        checks["bpm_error"] = result["technical"]["bpm"] - case["expected"]["bpm"]
+    if "key_index" in case["expected"]:
+        checks["key_correct"] = result["technical"]["key"] == analyzer.keys[case["expected"]["key_index"]]
+
+    return {
+        "name": case["name"],
+        "kind": case["kind"],
+        "sr": sr,
+        "duration": duration,
+        "repeats": len(latencies),
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p90": float(np.percentile(latencies, 90)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+        "audio_seconds_per_second": duration / float(np.median(latencies)),
+        # ru_maxrss is reported in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "fingerprint": fingerprint(result),
+        "checks": checks,
+    }
+
+
+def _run_isolated(case):
+    # Fresh interpreter per case so ru_maxrss only reflects that case
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_run_case_by_name, case["name"], case["_profile"], case["_sample_rates"]).result()
+
+
+def _run_case_by_name(name, profile, sample_rates):
+    # Case generators are lambdas, which don't pickle, so the child rebuilds its case by name
+    case = next(c for c in cases(profile, sample_rates) if c["name"] == name)
+    return run_case(case)
+
+
+def metadata(profile):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    import librosa
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "profile": profile,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "librosa": librosa.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def compare(current, baseline):
+    """
+    Compare a run with a baseline run.
+
+    Parameters:
+    current (dict): Suite output
+    baseline (dict): Earlier suite output
+
+    Returns:
+    tuple: (names whose fingerprint changed, [(name, relative p50 change)] for regressions)
+    """
+    previous = {case["name"]: case for case in baseline["cases"]}
+    changed, regressions = [], []
+    for case in current["cases"]:
+        before = previous.get(case["name"])
+        if before is None:
+            continue
+        if case["fingerprint"] != before["fingerprint"]:
+            changed.append(case["name"])
+        delta = case["latency_p50"] / before["latency_p50"] - 1.0
+        if delta > REGRESSION_THRESHOLD:
+            regressions.append((case["name"], delta))
+    return changed, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=list(PROFILES), default="quick", help="Duration set to run")
+    parser.add_argument("--sr", type=int, nargs="+", default=list(SAMPLE_RATES), help="Sample rates to run")
+    parser.add_argument("--filter", default="", help="Only run cases whose name contains this text")
+    parser.add_argument("--output", "-o", help="Write results JSON to this file")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--fail-on-change", action="store_true", help="Exit 1 if any result fingerprint changed")
+    parser.add_argument("--no-isolate", action="store_true", help="Run cases in this process (peak RSS accumulates)")
+    args = parser.parse_args()
+
+    selected = [case for case in cases(args.profile, tuple(args.sr)) if args.filter in case["name"]]
+    results = []
+    print(f"{'case':<34} {'p50 (s)':>9} {'p99 (s)':>9} {'x realtime':>11} {'RSS (MB)':>9}  checks", file=sys.stderr)
+    for case in selected:
+        if args.no_isolate:
+            measured = run_case(case)
+        else:
+            measured = _run_isolated(dict(case, _profile=args.profile, _sample_rates=tuple(args.sr)))
+        results.append(measured)
+        print(f"{measured['name']:<34} {measured['latency_p50']:>9.3f} {measured['latency_p99']:>9.3f} "
+              f"{measured['audio_seconds_per_second']:>11.1f} {measured['peak_rss_mb']:>9.0f}  "
+              f"{json.dumps(measured['checks'])}", file=sys.stderr)
+
+    output = {"meta": metadata(args.profile), "cases": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            changed, regressions = compare(output, json.load(f))
+        for name in changed:
+            print(f"CHANGED  {name}: result fingerprint differs from baseline", file=sys.stderr)
+        for name, delta in regressions:
+            print(f"SLOWER   {name}: p50 {delta:+.0%} against baseline", file=sys.stderr)
+        if changed and args.fail_on_change:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
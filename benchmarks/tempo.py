@@ -0,0 +1,68 @@
+"""
+Accuracy and speed of the tempo backends on click-track fixtures.
+
+For every BPM the script builds a plain click track and a click track over a
+chord with noise (benchmarks.corpus), computes the onset envelope once, and
+times each backend in features.TEMPO_BACKENDS on that envelope. Accuracy is
+reported as the mean absolute BPM error, the share of estimates within 2 %
+of the true tempo, and the share off by an octave (half or double time).
+
+Usage:
+    python -m benchmarks.tempo [--sr 22050] [--duration 30] [--rounds 5]
+"""
+import argparse
+import json
+import time
+
+import librosa
+import numpy as np
+
+from benchmarks.corpus import click_track, synthetic_track
+from features import TEMPO_BACKENDS, estimate_tempo
+
+BPMS = (60, 72, 85, 90, 100, 110, 120, 128, 140, 150, 160, 174, 180)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sr", type=int, default=22050, help="Sample rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="Fixture length in seconds")
+    parser.add_argument("--rounds", type=int, default=5, help="Timed calls per fixture (best is kept)")
+    args = parser.parse_args()
+
+    fixtures = []
+    for bpm in BPMS:
+        for name, y in (("click", click_track(args.sr, args.duration, bpm)),
+                        ("mix", synthetic_track(args.sr, args.duration, bpm=bpm, seed=bpm))):
+            fixtures.append((f"{name}-{bpm}", bpm, librosa.onset.onset_strength(y=y, sr=args.sr)))
+
+    # Warm-up so numba compilation is not timed
+    for backend in TEMPO_BACKENDS:
+        estimate_tempo(fixtures[0][2], args.sr, backend)
+
+    summary = {}
+    for backend in TEMPO_BACKENDS:
+        errors, seconds, estimates = [], [], {}
+        for name, bpm, onset_env in fixtures:
+            best = float("inf")
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                tempo = estimate_tempo(onset_env, args.sr, backend)
+                best = min(best, time.perf_counter() - start)
+            seconds.append(best)
+            errors.append((bpm, tempo))
+            estimates[name] = round(tempo, 2)
+        absolute = np.array([abs(tempo - bpm) for bpm, tempo in errors])
+        octave = [min(abs(tempo - 2 * bpm), abs(tempo - bpm / 2)) <= 0.02 * bpm for bpm, tempo in errors]
+        summary[backend] = {
+            "mean_abs_error_bpm": round(float(absolute.mean()), 3),
+            "within_2_percent": round(float(np.mean(absolute <= 0.02 * np.array([bpm for bpm, _ in errors]))), 3),
+            "octave_errors": round(float(np.mean(octave)), 3),
+            "mean_ms": round(float(np.mean(seconds)) * 1000, 3),
+            "estimates": estimates,
+        }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Build and view cost of the waveform and spectrogram pyramids.
+
+For synthetic tracks of each --minutes length, times building the pyramid
+block by block (what a pyramid job does after decoding) and its size on
+disk, then the time to read and draw views of the whole track, one minute
+and ten seconds. View times should not grow with the track length.
+
+Usage:
+    python -m benchmarks.visualization [--minutes 0.5 10 60] [--width 800] [--repeats 20]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.corpus import synthetic_track
+from visualization import VIEW_SR, PyramidStore, build_pyramid, spectrogram_image, waveform_image
+
+
+def _track(minutes, sr):
+    # A minute of synthetic audio repeated, so an hour doesn't take an hour of synthesis
+    minute = synthetic_track(sr, 60.0).astype(np.float32)
+    return np.tile(minute, int(np.ceil(minutes)))[: int(minutes * 60 * sr)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, nargs="+", default=[0.5, 10, 60], help="Track lengths")
+    parser.add_argument("--width", type=int, default=800, help="View width in columns")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed views per span (median is kept)")
+    args = parser.parse_args()
+
+    summary = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        store = PyramidStore(cache_dir, max_disk_bytes=2**40)
+        for minutes in args.minutes:
+            y = _track(minutes, VIEW_SR)
+            start = time.perf_counter()
+            pyramid = build_pyramid((y, VIEW_SR))
+            build_seconds = time.perf_counter() - start
+            key = f"{minutes}min"
+            store.put(key, pyramid)
+            pyramid = store.get(key)
+            disk_bytes = sum(entry.stat().st_size for entry in os.scandir(os.path.join(cache_dir, key)))
+
+            views = {}
+            for name, span in (("whole", pyramid.duration), ("1min", 60.0), ("10s", 10.0)):
+                span = min(span, pyramid.duration)
+                times = []
+                for i in range(args.repeats):
+                    offset = (pyramid.duration - span) * i / args.repeats
+                    begin = time.perf_counter()
+                    waveform_image(pyramid.waveform(offset, offset + span, args.width), args.width)
+                    spectrogram_image(pyramid.mel_spectrogram(offset, offset + span, args.width), args.width)
+                    times.append(time.perf_counter() - begin)
+                views[f"view_{name}_ms"] = round(float(np.median(times)) * 1000, 2)
+            summary.append({"minutes": minutes, "build_seconds": round(build_seconds, 3),
+                            "disk_mb": round(disk_bytes / 2**20, 2), **views})
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Classifier backends for genre, mood, instruments and use cases.
+
+A classifier turns summary features (see features.extract_features) into
+labels, a batch of tracks per call:
+
+    predict(features_list) -> [{"genre": {...}, "mood": {...}, "instruments": [...], "use_cases": [...]}, ...]
+
+with the same shapes AudioAnalyzer puts into its results. Two backends exist:
+
+- HeuristicClassifier, the default: the original threshold rules on
+  spectral centroid, bandwidth, tempo and energy.
+- MLPClassifier: a NumPy multi-layer perceptron (or, without hidden layers,
+  a linear model) over features.feature_vector, loaded once per process
+  from an .npz file. The output heads are stacked into one weight matrix,
+  so a batch costs one matrix product per layer however many tracks it has.
+
+MUSICVISION_CLASSIFIER selects the backend of every analyzer: "heuristic",
+or the path of an .npz model.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from features import VECTOR_DIM, feature_vector
+
+DEFAULT_CLASSIFIER = os.environ.get("MUSICVISION_CLASSIFIER", "heuristic")
+
+GENRES = ["Hip Hop", "Electronic", "Rock", "Pop", "Classical", "Jazz", "Country", "R&B", "Metal", "Folk"]
+MOODS = ["Bold", "Confident", "Restless", "Energetic", "Calm", "Melancholic", "Upbeat", "Tense"]
+INSTRUMENTS = ["Bass", "Beats", "Synth", "Guitar", "Piano", "Drums", "Strings", "Brass", "Woodwinds"]
+USE_CASES = ["extreme sports", "party", "beats", "workout", "relaxation", "focus", "driving", "meditation"]
+
+# Output heads of a model file, in the order their columns are stacked
+HEADS = ("genre", "mood", "instruments", "use_cases")
+
+
+def energy_rating(features):
+    """
+    Rate the energy of a track from its spectral rolloff and zero-crossing rate.
+
+    Parameters:
+    features (dict): Summary features from features.extract_features
+
+    Returns:
+    tuple: (level between 0 and 1, "Low", "Medium" or "High")
+    """
+    energy_value = (features["spectral_rolloff"] + features["zero_crossing_rate"] * 10000) / 10000
+    if energy_value < 1000:
+        return 0.3, "Low"
+    if energy_value < 2000:
+        return 0.6, "Medium"
+    return 0.9, "High"
+
+
+class HeuristicClassifier:
+    """The original hand-written rules; a placeholder for a trained model."""
+
+    name = "heuristic"
+
+    def predict(self, features_list):
+        """
+        Label a batch of tracks.
+
+        Parameters:
+        features_list (list): Summary feature dicts from features.extract_features
+
+        Returns:
+        list: One {"genre", "mood", "instruments", "use_cases"} dict per track
+        """
+        return [self._predict_one(features) for features in features_list]
+
+    def _predict_one(self, features):
+        tempo = features["tempo"]
+        spectral_centroid = features["spectral_centroid"]
+        energy_level, _ = energy_rating(features)
+
+        genre = GENRES[int((spectral_centroid / 5000) * len(GENRES)) % len(GENRES)]
+        confidence = int(min(100, max(50, (features["spectral_bandwidth"] / 5000) * 100)))
+
+        # Main mood is based on tempo and energy
+        if tempo > 120 and energy_level > 0.7:
+            mood = {"Bold": 100}
+        elif tempo > 100 and energy_level > 0.5:
+            mood = {"Confident": 87}
+        else:
+            mood = {"Restless": 23}
+
+        instruments = []
+        # Bass detection
+        if features["signal_power"] > 0.005:
+            instruments.append("Bass")
+        # Beats detection based on tempo
+        if tempo > 80:
+            instruments.append("Beats")
+        # Synth detection based on spectral centroid
+        if spectral_centroid > 3000:
+            instruments.append("Synth")
+        # Ensure we have at least one instrument
+        if not instruments:
+            instruments.append(INSTRUMENTS[0])
+
+        # Use cases follow genre and energy
+        if genre == "Hip Hop" and energy_level > 0.7:
+            use_cases = ["extreme sports", "party", "beats"]
+        elif genre == "Electronic" and energy_level > 0.6:
+            use_cases = ["party", "workout"]
+        else:
+            use_cases = USE_CASES[:3]
+
+        return {
+            "genre": {
+                "main_genre": genre,
+                "confidence": confidence,
+                "elements": "Electronic" if genre != "Electronic" and spectral_centroid > 3000 else "",
+            },
+            "mood": mood,
+            "instruments": instruments,
+            "use_cases": use_cases,
+        }
+
+
+class MLPClassifier:
+    """
+    NumPy MLP over feature vectors with genre, mood, instruments and use case heads.
+
+    Model files are .npz archives holding:
+
+    - mean, scale: per-dimension standardization of the VECTOR_DIM inputs
+    - W0, b0, W1, b1, ...: hidden layers, each followed by a ReLU (none for a linear model)
+    - <head>_W, <head>_b and <head>_labels for each of HEADS: output layer and label names
+
+    Genre and mood are single-label (softmax), instruments and use cases
+    multi-label (sigmoid). Weights exported from another framework, e.g.
+    scikit-learn's coefs_ and intercepts_, can be saved in this layout with
+    save().
+    """
+
+    def __init__(self, mean, scale, layers, heads, name="mlp"):
+        """
+        Parameters:
+        mean (numpy.ndarray): Input means, length VECTOR_DIM
+        scale (numpy.ndarray): Input standard deviations, length VECTOR_DIM
+        layers (list): (weights, bias) of each hidden layer
+        heads (dict): Head name -> (weights, bias, labels) for every name in HEADS
+        name (str): Identity of the model, part of the analysis cache key
+        """
+        self.name = name
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        if self.mean.shape != (VECTOR_DIM,) or self.scale.shape != (VECTOR_DIM,):
+            raise ValueError(f"Model inputs must have length {VECTOR_DIM}")
+        self.layers = [(np.asarray(w, dtype=np.float32), np.asarray(b, dtype=np.float32)) for w, b in layers]
+        self.labels = {head: [str(label) for label in heads[head][2]] for head in HEADS}
+
+        # Stack the heads so the output layer is one product; _splits marks where each head's columns end
+        self._head_weights = np.concatenate([np.asarray(heads[head][0], dtype=np.float32) for head in HEADS], axis=1)
+        self._head_bias = np.concatenate([np.asarray(heads[head][1], dtype=np.float32) for head in HEADS])
+        self._splits = np.cumsum([len(self.labels[head]) for head in HEADS])[:-1]
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a model file.
+
+        Parameters:
+        path (str): .npz file in the layout described on the class
+
+        Returns:
+        MLPClassifier: The model, named after a hash of the file so cached results follow model changes
+        """
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        with np.load(path) as archive:
+            layers = []
+            while f"W{len(layers)}" in archive:
+                layers.append((archive[f"W{len(layers)}"], archive[f"b{len(layers)}"]))
+            heads = {head: (archive[f"{head}_W"], archive[f"{head}_b"], archive[f"{head}_labels"]) for head in HEADS}
+            return cls(archive["mean"], archive["scale"], layers, heads, name=f"mlp:{digest}")
+
+    def save(self, path):
+        """
+        Write the model in the layout load() reads.
+
+        Parameters:
+        path (str): Destination .npz file
+        """
+        arrays = {"mean": self.mean, "scale": self.scale}
+        for i, (weights, bias) in enumerate(self.layers):
+            arrays[f"W{i}"], arrays[f"b{i}"] = weights, bias
+        columns = np.split(np.arange(len(self._head_bias)), self._splits)
+        for head, index in zip(HEADS, columns):
+            arrays[f"{head}_W"] = self._head_weights[:, index]
+            arrays[f"{head}_b"] = self._head_bias[index]
+            arrays[f"{head}_labels"] = np.array(self.labels[head])
+        np.savez(path, **arrays)
+
+    def predict_proba(self, vectors):
+        """
+        Score a batch of feature vectors.
+
+        Parameters:
+        vectors (numpy.ndarray): (tracks, VECTOR_DIM) feature vectors
+
+        Returns:
+        dict: Head name -> (tracks, labels) probabilities
+        """
+        hidden = (np.asarray(vectors, dtype=np.float32) - self.mean) / self.scale
+        for weights, bias in self.layers:
+            hidden = np.maximum(hidden @ weights + bias, 0)
+        logits = dict(zip(HEADS, np.split(hidden @ self._head_weights + self._head_bias, self._splits, axis=1)))
+
+        probabilities = {}
+        for head in ("genre", "mood"):
+            shifted = np.exp(logits[head] - logits[head].max(axis=1, keepdims=True))
+            probabilities[head] = shifted / shifted.sum(axis=1, keepdims=True)
+        for head in ("instruments", "use_cases"):
+            # Sigmoid written with tanh, which cannot overflow on large logits
+            probabilities[head] = 0.5 * (1 + np.tanh(0.5 * logits[head]))
+        return probabilities
+
+    def predict(self, features_list):
+        """
+        Label a batch of tracks.
+
+        Parameters:
+        features_list (list): Summary feature dicts from features.extract_features
+
+        Returns:
+        list: One {"genre", "mood", "instruments", "use_cases"} dict per track
+        """
+        if not features_list:
+            return []
+        probabilities = self.predict_proba(np.stack([feature_vector(features) for features in features_list]))
+        return [self._labels(probabilities, i) for i in range(len(features_list))]
+
+    def _labels(self, probabilities, i):
+        genre = probabilities["genre"][i]
+        ranked = np.argsort(genre)[::-1]
+        mood = probabilities["mood"][i]
+        # The most likely mood always, others once they are reasonably likely
+        moods = [j for j in np.argsort(mood)[::-1] if j == np.argmax(mood) or mood[j] >= 0.25]
+        return {
+            "genre": {
+                "main_genre": self.labels["genre"][ranked[0]],
+                "confidence": int(round(100 * genre[ranked[0]])),
+                # A runner-up genre close behind is reported as an element of the track
+                "elements": self.labels["genre"][ranked[1]] if len(ranked) > 1 and genre[ranked[1]] >= 0.25 else "",
+            },
+            "mood": {self.labels["mood"][j]: int(round(100 * mood[j])) for j in moods},
+            "instruments": self._multi_label("instruments", probabilities, i, minimum=1),
+            "use_cases": self._multi_label("use_cases", probabilities, i, minimum=3),
+        }
+
+    def _multi_label(self, head, probabilities, i, minimum):
+        # Every label above 0.5, topped up with the next most likely ones to at least `minimum`
+        scores = probabilities[head][i]
+        ranked = np.argsort(scores)[::-1]
+        chosen = [j for j in ranked if scores[j] >= 0.5]
+        chosen += [j for j in ranked if j not in chosen][:max(0, minimum - len(chosen))]
+        return [self.labels[head][j] for j in chosen]
+
+
+def load_classifier(spec=DEFAULT_CLASSIFIER):
+    """
+    Build the classifier named by a MUSICVISION_CLASSIFIER value.
+
+    Parameters:
+    spec (str): "heuristic", or the path of an MLPClassifier .npz model
+
+    Returns:
+    HeuristicClassifier or MLPClassifier: Classifier with a name and a batched predict()
+    """
+    if spec == "heuristic":
+        return HeuristicClassifier()
+    return MLPClassifier.load(spec)
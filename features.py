@@ -0,0 +1,440 @@
+from functools import lru_cache
+
+import numpy as np
+import librosa
+
+from profiling import NULL_TIMER
+
+# Frame settings shared by every feature (librosa defaults)
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MFCC = 13
+
+# Available feature engines:
+#   "shared" - one magnitude STFT and one mel spectrogram reused by every feature
+#   "legacy" - every librosa feature computes its own transform from the raw signal
+#
+# Both engines use the same frame settings, so the shared engine reproduces the
+# legacy numbers up to floating point rounding: spectral means, MFCC and chroma
+# means agree to a relative tolerance of 1e-5, and tempo / key are identical.
+FEATURE_ENGINES = ("shared", "legacy")
+DEFAULT_FEATURE_ENGINE = "shared"
+
+# Pre-analysis gate: inputs failing these checks skip feature extraction entirely
+MIN_DURATION_SECONDS = 1.0
+SILENCE_RMS = 1e-4  # -80 dBFS
+CLIP_LEVEL = 0.999
+MAX_CLIPPED_FRACTION = 0.5
+
+# Available tempo backends, all working on the onset envelope the features already compute:
+#   "autocorrelation" - one global autocorrelation of the envelope, weighted by librosa's tempo prior
+#                       and refined to sub-frame lags; about 200x cheaper than the tempogram and
+#                       closer to the true tempo on the click-track fixtures (benchmarks/tempo.py)
+#   "tempogram"       - librosa.feature.tempo on the envelope; the tempo beat_track reports, minus its
+#                       dynamic-programming beat tracking
+#   "beat_track"      - librosa.beat.beat_track, the original path, kept for comparison
+TEMPO_BACKENDS = ("autocorrelation", "tempogram", "beat_track")
+DEFAULT_TEMPO_BACKEND = "autocorrelation"
+
+# Tempo search range (BPM) and the log-normal prior (centre BPM, width in octaves) used by librosa
+MIN_BPM = 30.0
+MAX_BPM = 320.0
+PRIOR_BPM = 120.0
+PRIOR_OCTAVES = 1.0
+
+# analyze_batch packs clips whose lengths are within this fraction of each other
+BATCH_LENGTH_TOLERANCE = 0.1
+BATCH_MAX_GROUP_SIZE = 4
+
+
+@lru_cache(maxsize=None)
+def mel_basis(sr):
+    """Mel filter bank for the shared STFT, built once per sample rate."""
+    return librosa.filters.mel(sr=sr, n_fft=N_FFT)
+
+
+@lru_cache(maxsize=256)
+def chroma_basis(sr, tuning):
+    """Chroma filter bank for the shared STFT, built once per sample rate and tuning."""
+    return librosa.filters.chroma(sr=sr, n_fft=N_FFT, tuning=tuning)
+
+
+def _chroma(power, sr):
+    # Same as librosa.feature.chroma_stft(S=power), but with the filter bank cached
+    tuning = float(librosa.estimate_tuning(S=power, sr=sr, bins_per_octave=12))
+    return librosa.util.normalize(chroma_basis(sr, tuning) @ power, norm=np.inf, axis=-2)
+
+
+def _spectral_shape(S, sr):
+    # Spectral centroid, bandwidth and 85% rolloff of every frame, matching the librosa
+    # features but computed as two matrix-vector products plus one cumulative sum
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=N_FFT).astype(S.dtype)
+    total = S.sum(axis=-2)
+    safe_total = np.where(total > 0, total, 1)
+    centroid = (freqs @ S) / safe_total
+    second_moment = ((freqs ** 2) @ S).astype(np.float64) / safe_total
+    bandwidth = np.sqrt(np.maximum(second_moment - centroid.astype(np.float64) ** 2, 0))
+
+    cumulative = np.cumsum(S, axis=-2)
+    reached = cumulative >= 0.85 * cumulative[..., -1:, :]
+    rolloff = freqs[np.argmax(reached, axis=-2)]
+    return centroid, bandwidth, rolloff
+
+
+def _zero_crossing_rate(y):
+    # librosa.feature.zero_crossing_rate from one sign-change pass and a cumulative sum,
+    # instead of framing the signal into overlapping copies
+    pad = [(0, 0)] * (y.ndim - 1) + [(N_FFT // 2, N_FFT // 2)]
+    y = np.pad(y, pad, mode="edge")
+    signs = np.signbit(np.where(np.abs(y) <= 1e-10, 0, y))
+    changes = np.cumsum(signs[..., 1:] != signs[..., :-1], axis=-1)
+    changes = np.concatenate([np.zeros(y.shape[:-1] + (1,)), changes], axis=-1)
+    starts = np.arange(0, y.shape[-1] - N_FFT + 1, HOP_LENGTH)
+    return (changes[..., starts + N_FFT - 1] - changes[..., starts]) / N_FFT
+
+
+def signal_stats(y, sr):
+    """
+    Cheap whole-signal statistics for the pre-analysis gate.
+
+    Parameters:
+    y (numpy.ndarray): Audio time series
+    sr (int): Sample rate
+
+    Returns:
+    dict: duration (s), rms, peak, clipped_fraction and finite (False if any sample is NaN or inf)
+    """
+    if len(y) == 0:
+        return {"duration": 0.0, "rms": 0.0, "peak": 0.0, "clipped_fraction": 0.0, "finite": True}
+    magnitude = np.abs(y)
+    sum_squares = float(np.dot(y, y))
+    return {
+        "duration": len(y) / sr,
+        "rms": float(np.sqrt(sum_squares / len(y))),
+        "peak": float(magnitude.max()),
+        "clipped_fraction": float(np.count_nonzero(magnitude >= CLIP_LEVEL) / len(y)),
+        # Any NaN or inf sample makes the sum of squares non-finite
+        "finite": bool(np.isfinite(sum_squares)),
+    }
+
+
+def degenerate_reason(stats):
+    """
+    Classify an input the full pipeline would only produce garbage for.
+
+    Parameters:
+    stats (dict): Output of signal_stats
+
+    Returns:
+    str or None: "non_finite", "too_short", "silent" or "clipped", None for normal audio
+    """
+    if not stats["finite"]:
+        return "non_finite"
+    if stats["duration"] < MIN_DURATION_SECONDS:
+        return "too_short"
+    if stats["rms"] < SILENCE_RMS:
+        return "silent"
+    if stats["clipped_fraction"] > MAX_CLIPPED_FRACTION:
+        return "clipped"
+    return None
+
+
+def spectral_representations(y, sr, timer=NULL_TIMER):
+    """
+    Compute the spectrograms shared by all downstream features.
+
+    Parameters:
+    y (numpy.ndarray): Audio time series
+    sr (int): Sample rate
+    timer (StageTimer): Optional per-stage instrumentation
+
+    Returns:
+    tuple: (magnitude STFT, power spectrogram, log-power mel spectrogram)
+    """
+    with timer.stage("stft"):
+        S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+        power = S ** 2
+    with timer.stage("mel"):
+        mel_db = librosa.power_to_db(mel_basis(sr) @ power)
+    return S, power, mel_db
+
+
+def _variation(x):
+    # Coefficient of variation (scipy.stats.variation) without importing scipy.stats at startup
+    x = np.asarray(x, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return float(np.std(x) / np.mean(x))
+
+
+def autocorrelation_lags(sr):
+    """Largest envelope lag (in frames) the autocorrelation backend looks at, i.e. MIN_BPM."""
+    return int(np.ceil(60.0 * sr / (HOP_LENGTH * MIN_BPM)))
+
+
+def tempo_from_autocorrelation(ac, sr):
+    """
+    Pick the tempo from an onset envelope autocorrelation.
+
+    Parameters:
+    ac (numpy.ndarray): Autocorrelation of the mean-removed envelope at lags 0, 1, ...,
+        at least autocorrelation_lags(sr) + 2 long for the full tempo range
+    sr (int): Sample rate
+
+    Returns:
+    float: Tempo in BPM, 0 if there is no usable periodicity
+    """
+    min_lag = max(1, int(np.floor(60.0 * sr / (HOP_LENGTH * MAX_BPM))))
+    lags = np.arange(min_lag, len(ac) - 1)
+    if len(lags) == 0 or ac[0] <= 0:
+        return 0.0
+    bpms = 60.0 * sr / (HOP_LENGTH * lags)
+    prior = np.exp(-0.5 * (np.log2(bpms / PRIOR_BPM) / PRIOR_OCTAVES) ** 2)
+    best = lags[np.argmax(ac[lags] * prior)]
+
+    # Parabolic interpolation around the peak recovers tempi between whole-frame lags
+    left, centre, right = ac[best - 1], ac[best], ac[best + 1]
+    curvature = left - 2 * centre + right
+    shift = 0.5 * (left - right) / curvature if curvature < 0 else 0.0
+    return float(60.0 * sr / (HOP_LENGTH * (best + np.clip(shift, -0.5, 0.5))))
+
+
+def estimate_tempo(onset_env, sr, backend=DEFAULT_TEMPO_BACKEND):
+    """
+    Estimate the global tempo from an onset strength envelope.
+
+    Parameters:
+    onset_env (numpy.ndarray): Onset strength envelope at HOP_LENGTH
+    sr (int): Sample rate
+    backend (str): One of TEMPO_BACKENDS
+
+    Returns:
+    float: Tempo in BPM, 0 for an envelope without onsets
+    """
+    if backend not in TEMPO_BACKENDS:
+        raise ValueError(f"Unknown tempo backend: {backend}")
+    if not np.any(onset_env):
+        # What beat_track reports for an envelope without onsets
+        return 0.0
+    if backend == "tempogram":
+        return float(librosa.feature.tempo(onset_envelope=onset_env, sr=sr, hop_length=HOP_LENGTH,
+                                           start_bpm=PRIOR_BPM)[0])
+    if backend == "autocorrelation":
+        centered = onset_env - onset_env.mean()
+        ac = librosa.autocorrelate(centered, max_size=min(autocorrelation_lags(sr) + 2, len(centered)))
+        return tempo_from_autocorrelation(ac, sr)
+    tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=HOP_LENGTH)
+    return float(np.atleast_1d(tempo)[0])
+
+
+def _summarize(y, tempo, spectral_centroid, spectral_bandwidth, spectral_rolloff, zcr, mfccs, chroma, onset_env):
+    return {
+        "tempo": float(np.atleast_1d(tempo)[0]),
+        "spectral_centroid": float(spectral_centroid.mean()),
+        "spectral_bandwidth": float(spectral_bandwidth.mean()),
+        "spectral_rolloff": float(spectral_rolloff.mean()),
+        "zero_crossing_rate": float(zcr.mean()),
+        "mfcc_means": np.mean(mfccs, axis=1),
+        "mfcc1_max": float(np.max(mfccs[1])),
+        "chroma_means": np.mean(chroma, axis=1),
+        "onset_variation": _variation(onset_env),
+        "signal_var": float(np.var(y)),
+        "signal_power": float(np.mean(y ** 2)),
+    }
+
+
+def _shared_features(y, sr, timer, tempo_backend):
+    S, power, mel_db = spectral_representations(y, sr, timer=timer)
+
+    # The onset envelope is computed once, for the tempo and for beat consistency
+    with timer.stage("onset"):
+        onset_env = librosa.onset.onset_strength(S=mel_db, sr=sr)
+    with timer.stage("tempo"):
+        tempo = estimate_tempo(onset_env, sr, tempo_backend)
+    with timer.stage("spectral"):
+        centroid, bandwidth, rolloff = _spectral_shape(S, sr)
+        zcr = _zero_crossing_rate(y)
+    with timer.stage("mfcc"):
+        mfccs = librosa.feature.mfcc(S=mel_db, sr=sr, n_mfcc=N_MFCC)
+    with timer.stage("chroma"):
+        chroma = _chroma(power, sr)
+    return _summarize(y, tempo, centroid, bandwidth, rolloff, zcr, mfccs, chroma, onset_env)
+
+
+def _legacy_features(y, sr, timer, tempo_backend):
+    with timer.stage("tempo"):
+        if tempo_backend == "beat_track":
+            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+        else:
+            tempo = estimate_tempo(librosa.onset.onset_strength(y=y, sr=sr), sr, tempo_backend)
+    with timer.stage("spectral"):
+        centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
+        bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)[0]
+        rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)[0]
+        zcr = librosa.feature.zero_crossing_rate(y)[0]
+    with timer.stage("mfcc"):
+        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=N_MFCC)
+    with timer.stage("chroma"):
+        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
+    with timer.stage("onset"):
+        onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    return _summarize(y, tempo, centroid, bandwidth, rolloff, zcr, mfccs, chroma, onset_env)
+
+
+def extract_features(y, sr, engine=DEFAULT_FEATURE_ENGINE, timer=NULL_TIMER, tempo_backend=DEFAULT_TEMPO_BACKEND):
+    """
+    Extract the summary features used by the analysis heuristics.
+
+    Parameters:
+    y (numpy.ndarray): Audio time series
+    sr (int): Sample rate
+    engine (str): Feature engine, one of FEATURE_ENGINES
+    timer (StageTimer): Optional per-stage instrumentation
+    tempo_backend (str): Tempo estimator, one of TEMPO_BACKENDS
+
+    Returns:
+    dict: Summary features (scalars and small per-coefficient arrays)
+    """
+    if engine == "shared":
+        return _shared_features(y, sr, timer, tempo_backend)
+    if engine == "legacy":
+        return _legacy_features(y, sr, timer, tempo_backend)
+    raise ValueError(f"Unknown feature engine: {engine}")
+
+
+# Layout of feature_vector: 13 MFCC means, 12 chroma means, then the scalar features below
+VECTOR_SCALARS = ("spectral_centroid", "spectral_bandwidth", "spectral_rolloff", "zero_crossing_rate", "tempo")
+VECTOR_DIM = N_MFCC + 12 + len(VECTOR_SCALARS)
+
+
+def feature_vector(features):
+    """
+    Pack summary features into a compact vector for similarity search.
+
+    Parameters:
+    features (dict): Summary features from extract_features
+
+    Returns:
+    numpy.ndarray: float32 vector of length VECTOR_DIM
+    """
+    return np.concatenate([
+        features["mfcc_means"],
+        features["chroma_means"],
+        [features[name] for name in VECTOR_SCALARS],
+    ]).astype(np.float32)
+
+
+def combine_features(parts, weights):
+    """
+    Merge summary features of separate excerpts of one track.
+
+    Means are weighted by excerpt length, maxima are taken over all excerpts
+    and the tempo is the median of the excerpt tempos, so one excerpt with a
+    half- or double-time estimate doesn't drag the result.
+
+    Parameters:
+    parts (list): Summary feature dicts from extract_features
+    weights (list): Relative size of each excerpt, e.g. its sample count
+
+    Returns:
+    dict: Summary features for the excerpts taken together
+    """
+    weights = np.asarray(weights, dtype=np.float64) / np.sum(weights)
+
+    def mean(name):
+        return sum(weight * np.asarray(part[name]) for weight, part in zip(weights, parts))
+
+    combined = {
+        name: float(mean(name))
+        for name in ("spectral_centroid", "spectral_bandwidth", "spectral_rolloff", "zero_crossing_rate",
+                     "onset_variation", "signal_var", "signal_power")
+    }
+    combined.update({
+        "tempo": float(np.median([part["tempo"] for part in parts])),
+        "mfcc_means": mean("mfcc_means"),
+        "mfcc1_max": max(part["mfcc1_max"] for part in parts),
+        "chroma_means": mean("chroma_means"),
+    })
+    return combined
+
+
+def _length_groups(lengths, tolerance, max_group_size):
+    # Sort clips by length and cut a new group whenever lengths spread past the tolerance
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    groups = []
+    for i in order:
+        group = groups[-1] if groups else None
+        if group and len(group) < max_group_size and lengths[i] <= lengths[group[0]] * (1 + tolerance):
+            group.append(i)
+        else:
+            groups.append([i])
+    return groups
+
+
+def _pack(signals):
+    # Lay clips end to end with hop-aligned silent gaps so that an uncentered STFT of the
+    # packed signal contains exactly the frames of each clip's own centered STFT
+    half = N_FFT // 2
+    starts = []
+    cursor = half
+    for y in signals:
+        starts.append(cursor)
+        cursor = -(-(cursor + len(y) + half) // HOP_LENGTH) * HOP_LENGTH
+    packed = np.zeros(cursor + half, dtype=np.float32)
+    for start, y in zip(starts, signals):
+        packed[start:start + len(y)] = y
+    # Frame index of each clip's first frame
+    offsets = [(start - half) // HOP_LENGTH for start in starts]
+    return packed, offsets
+
+
+def extract_features_batch(signals, sr, tolerance=BATCH_LENGTH_TOLERANCE, max_group_size=BATCH_MAX_GROUP_SIZE,
+                           tempo_backend=DEFAULT_TEMPO_BACKEND):
+    """
+    Extract summary features for many clips with batched spectral transforms.
+
+    Clips of similar length are packed into one signal so the STFT, mel
+    projection and spectral shape features run as single large array
+    operations per group, then each clip's frames are sliced back out. MFCC,
+    onset, chroma tuning and tempo are computed per clip on those slices.
+
+    Results match extract_features(engine="shared") up to float32 rounding.
+
+    Parameters:
+    signals (list): Mono audio time series
+    sr (int): Sample rate shared by all clips
+    tolerance (float): Allowed relative length difference within a group
+    max_group_size (int): Maximum clips packed into one group
+    tempo_backend (str): Tempo estimator, one of TEMPO_BACKENDS
+
+    Returns:
+    list: Summary feature dicts, in the order of signals
+    """
+    lengths = [len(y) for y in signals]
+    features = [None] * len(signals)
+
+    for group in _length_groups(lengths, tolerance, max_group_size):
+        packed, offsets = _pack([signals[i] for i in group])
+        S = np.abs(librosa.stft(packed, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False))
+        power = S ** 2
+        mel_db = librosa.power_to_db(mel_basis(sr) @ power, top_db=None)
+        centroid, bandwidth, rolloff = _spectral_shape(S, sr)
+
+        for offset, i in zip(offsets, group):
+            y = signals[i]
+            frames = slice(offset, offset + 1 + lengths[i] // HOP_LENGTH)
+            clip_mel_db = mel_db[:, frames]
+            clip_mel_db = np.maximum(clip_mel_db, clip_mel_db.max() - 80.0)
+            onset_env = librosa.onset.onset_strength(S=clip_mel_db, sr=sr)
+            tempo = estimate_tempo(onset_env, sr, tempo_backend)
+            features[i] = _summarize(
+                y,
+                tempo,
+                centroid[frames],
+                bandwidth[frames],
+                rolloff[frames],
+                _zero_crossing_rate(y),
+                librosa.feature.mfcc(S=clip_mel_db, sr=sr, n_mfcc=N_MFCC),
+                _chroma(power[:, frames], sr),
+                onset_env,
+            )
+    return features
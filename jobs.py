@@ -0,0 +1,462 @@
+"""
+Background analysis jobs.
+
+A JobQueue runs analyses on a small thread pool so the caller (a Streamlit
+script run, an HTTP handler) only submits work and polls for its state.
+Submissions are keyed by analysis_key: a key that is already queued or
+running returns the existing job instead of starting a second analysis, and
+a key already in the AnalysisCache finishes immediately. The pool size caps
+how many analyses run at once on this node; further jobs wait in the queue,
+up to max_pending of them, after which submit raises QueueFull.
+
+Given a supervisor.WorkerPool, the queue's threads only supervise: each
+analysis runs in a worker process with a time and memory limit, and a file
+that exceeds them fails its job with a supervisor.WorkerError instead of
+taking the server down. Jobs then have to be picklable; upload_compute,
+timeline_compute and pyramid_compute build the right compute function for
+either kind of queue.
+"""
+import functools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from analysis_cache import content_hash
+from audio_io import PREVIEW, load_audio, load_excerpts, open_upload
+from classifiers import DEFAULT_CLASSIFIER, load_classifier
+from profiling import Histogram, StageTimer, histogram_to_prometheus
+from supervisor import to_prometheus as pool_to_prometheus
+from warmup import enable_jit_cache, warm_up
+
+# Analyses allowed to run at once in one server process
+DEFAULT_MAX_JOBS = int(os.environ.get("MUSICVISION_MAX_JOBS", "2"))
+# Jobs allowed to wait for a worker before new submissions are refused
+DEFAULT_MAX_PENDING = int(os.environ.get("MUSICVISION_MAX_PENDING", "16"))
+# Run analyses in supervised worker processes rather than on the server's threads
+DEFAULT_SUPERVISED = os.environ.get("MUSICVISION_SUPERVISED", "1") != "0"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(RuntimeError):
+    """Raised by JobQueue.submit when max_pending jobs are already waiting."""
+
+
+def analyze_upload(timer, analyzer, audio_bytes, filename, target_sr, duration, res_type, pcm_cache=None,
+                   pyramids=None):
+    """
+    Decode and analyze uploaded bytes; the compute function behind upload jobs.
+
+    Parameters:
+    timer (StageTimer): Instrumentation supplied by the job queue
+    analyzer (AudioAnalyzer): Analyzer to run
+    audio_bytes (bytes): Uploaded file contents
+    filename (str): Original file name
+    target_sr (int or None): Analysis sample rate, None for the native rate
+    duration (float, None or PREVIEW): Seconds to analyze, None for the full song, PREVIEW for excerpts
+    res_type (str): librosa resampler
+    pcm_cache (PCMCache): Optional decoded-audio cache, so changing the settings doesn't decode the upload again
+    pyramids (PyramidStore): Optional; a full-song analysis stores the track's visualization pyramid here,
+        built from the analysis STFT, unless it is already stored
+
+    Returns:
+    dict: Analysis results
+    """
+    if duration == PREVIEW:
+        excerpts, sr = load_excerpts(audio_bytes, target_sr, filename=filename, res_type=res_type, timer=timer,
+                                     pcm_cache=pcm_cache)
+        return analyzer.analyze_excerpts(excerpts, sr, timer=timer)
+    if duration is None and pcm_cache is not None:
+        # The cached decode is memory-mapped, so streaming it keeps memory bounded as well
+        with timer.stage("decode"):
+            decoded = pcm_cache.load(audio_bytes, filename)
+        visualizer = None
+        if pyramids is not None:
+            from visualization import PyramidBuilder
+
+            key = content_hash(audio_bytes)
+            if pyramids.get(key) is None:
+                visualizer = PyramidBuilder(target_sr or decoded[1])
+        results = analyzer.analyze_stream(decoded, target_sr, res_type=res_type, timer=timer, visualizer=visualizer)
+        if visualizer is not None:
+            with timer.stage("visualization"):
+                pyramids.put(key, visualizer.finish())
+        return results
+    if duration is None:
+        # Full songs are analyzed block by block so memory stays bounded for long mixes
+        try:
+            with open_upload(audio_bytes, filename) as source:
+                return analyzer.analyze_stream(source, target_sr, res_type=res_type, timer=timer)
+        except RuntimeError:
+            # soundfile can't decode this file; fall back to librosa's full decode
+            pass
+    y, sr = load_audio(audio_bytes, target_sr, duration=duration, filename=filename,
+                       res_type=res_type, timer=timer, pcm_cache=pcm_cache)
+    return analyzer.analyze_audio(y, sr, timer=timer)
+
+
+# Analyzer and caches of a worker process, built by init_worker
+_worker = {}
+
+
+def init_worker(classifier=DEFAULT_CLASSIFIER, sample_rates=(), caches=True, warm=False):
+    """
+    Build the analyzer and caches of a WorkerPool process, once for all its tasks.
+
+    Parameters:
+    classifier (str): "heuristic" or the path of a classifier model
+    sample_rates (iterable): Rates whose filter banks are built up front
+    caches (bool): Read and write the analysis, decoded-audio and visualization caches
+    warm (bool): Run a warm-up analysis per sample rate before taking tasks
+    """
+    from analysis_cache import AnalysisCache
+    from audio_analyzer import AudioAnalyzer
+    from pcm_cache import PCMCache
+    from visualization import PyramidStore
+
+    enable_jit_cache()
+    analyzer = AudioAnalyzer(sample_rates=sample_rates, classifier=load_classifier(classifier))
+    if warm:
+        warm_up(analyzer, sample_rates)
+    _worker.update(analyzer=analyzer, cache=AnalysisCache() if caches else None,
+                   pcm_cache=PCMCache() if caches else None, pyramids=PyramidStore() if caches else None)
+
+
+def analyze_upload_task(timer, visualize=False, **settings):
+    # analyze_upload inside a worker process, with the analyzer and caches of init_worker
+    return analyze_upload(timer, _worker["analyzer"], pcm_cache=_worker["pcm_cache"],
+                          pyramids=_worker["pyramids"] if visualize else None, **settings)
+
+
+def analyze_timeline_task(timer, **settings):
+    # analyze_timeline inside a worker process, with the analyzer and caches of init_worker
+    from segments import analyze_timeline
+
+    return analyze_timeline(_worker["analyzer"], cache=_worker["cache"], pcm_cache=_worker["pcm_cache"],
+                            timer=timer, **settings)
+
+
+def store_pyramid(timer, audio_bytes, filename, pcm_cache, pyramids):
+    """
+    Build and store the visualization pyramid of an upload; the compute function behind pyramid jobs.
+
+    Parameters:
+    timer (StageTimer): Instrumentation supplied by the job queue
+    audio_bytes (bytes): Uploaded file contents
+    filename (str): Original file name
+    pcm_cache (PCMCache): Decoded-audio cache the track is read from
+    pyramids (PyramidStore): Store the pyramid is written to, under the upload's content hash
+
+    Returns:
+    dict: duration of the track in seconds; the pyramid itself is read back from the store
+    """
+    from visualization import build_pyramid
+
+    key = content_hash(audio_bytes)
+    pyramid = pyramids.get(key)
+    if pyramid is None:
+        with timer.stage("decode"):
+            decoded = pcm_cache.load(audio_bytes, filename)
+        pyramid = build_pyramid(decoded, timer=timer)
+        pyramids.put(key, pyramid)
+    return {"duration": pyramid.duration}
+
+
+def store_pyramid_task(timer, **settings):
+    # store_pyramid inside a worker process, with the caches of init_worker
+    return store_pyramid(timer, pcm_cache=_worker["pcm_cache"], pyramids=_worker["pyramids"], **settings)
+
+
+def upload_compute(jobs, analyzer, audio_bytes, filename, target_sr, duration, res_type, pcm_cache=None,
+                   pyramids=None):
+    """
+    Build the compute function of an upload job for a queue.
+
+    Parameters:
+    jobs (JobQueue): Queue the job is submitted to
+    analyzer (AudioAnalyzer): Analyzer used when the queue runs jobs on its own threads
+    audio_bytes (bytes): Uploaded file contents
+    filename (str): Original file name
+    target_sr (int or None): Analysis sample rate, None for the native rate
+    duration (float, None or PREVIEW): Seconds to analyze, None for the full song, PREVIEW for excerpts
+    res_type (str): librosa resampler
+    pcm_cache (PCMCache): Decoded-audio cache used when the queue runs jobs on its own threads
+    pyramids (PyramidStore): Visualization store a full-song analysis adds the track's pyramid to;
+        worker processes use their own store in the same directory
+
+    Returns:
+    callable: Compute function for JobQueue.submit
+    """
+    settings = dict(audio_bytes=audio_bytes, filename=filename, target_sr=target_sr, duration=duration,
+                    res_type=res_type)
+    if jobs.pool is not None:
+        return functools.partial(analyze_upload_task, visualize=pyramids is not None, **settings)
+    return functools.partial(analyze_upload, analyzer=analyzer, pcm_cache=pcm_cache, pyramids=pyramids, **settings)
+
+
+def timeline_compute(jobs, analyzer, audio_bytes, filename, target_sr, duration, res_type, cache=None,
+                     pcm_cache=None):
+    """
+    Build the compute function of a segment timeline job for a queue.
+
+    Parameters:
+    jobs (JobQueue): Queue the job is submitted to
+    analyzer (AudioAnalyzer): Analyzer used when the queue runs jobs on its own threads
+    audio_bytes (bytes): Uploaded file contents
+    filename (str): Original file name
+    target_sr (int or None): Analysis sample rate, None for the native rate
+    duration (float or None): Seconds covered, None for the full song
+    res_type (str): librosa resampler
+    cache (AnalysisCache): Segment cache used when the queue runs jobs on its own threads
+    pcm_cache (PCMCache): Decoded-audio cache used when the queue runs jobs on its own threads
+
+    Returns:
+    callable: Compute function for JobQueue.submit
+    """
+    settings = dict(data=audio_bytes, sr=target_sr, duration=duration, filename=filename, res_type=res_type)
+    if jobs.pool is not None:
+        return functools.partial(analyze_timeline_task, **settings)
+
+    def compute(timer):
+        from segments import analyze_timeline
+
+        return analyze_timeline(analyzer, cache=cache, pcm_cache=pcm_cache, timer=timer, **settings)
+    return compute
+
+
+def pyramid_compute(jobs, audio_bytes, filename, pcm_cache, pyramids):
+    """
+    Build the compute function of a visualization pyramid job for a queue.
+
+    Parameters:
+    jobs (JobQueue): Queue the job is submitted to
+    audio_bytes (bytes): Uploaded file contents
+    filename (str): Original file name
+    pcm_cache (PCMCache): Decoded-audio cache used when the queue runs jobs on its own threads
+    pyramids (PyramidStore): Store used when the queue runs jobs on its own threads
+
+    Returns:
+    callable: Compute function for JobQueue.submit, to submit with cache=False
+    """
+    settings = dict(audio_bytes=audio_bytes, filename=filename)
+    if jobs.pool is not None:
+        return functools.partial(store_pyramid_task, **settings)
+    return functools.partial(store_pyramid, pcm_cache=pcm_cache, pyramids=pyramids, **settings)
+
+
+class Job:
+    """State of one submitted analysis, updated by the worker thread."""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        # Name of the StageTimer stage currently running, e.g. "decode" or "heuristics"
+        self.stage = None
+        self.result = None
+        self.timings = None
+        self.error = None
+        self.served_from_cache = False
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def wait(self, timeout=None):
+        """
+        Block until the job has finished.
+
+        Parameters:
+        timeout (float or None): Seconds to wait, None to wait indefinitely
+
+        Returns:
+        bool: Whether the job finished within the timeout
+        """
+        return self._done.wait(timeout)
+
+
+class JobQueue:
+    """
+    Deduplicating, concurrency-capped runner for analysis jobs.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_JOBS, cache=None, keep_finished=256, max_pending=None, pool=None):
+        """
+        Parameters:
+        max_workers (int): Analyses allowed to run at once
+        cache (AnalysisCache): Optional result cache checked on submit and filled on completion
+        keep_finished (int): Finished jobs kept for polling before the oldest are dropped
+        max_pending (int or None): Queued jobs allowed before submit raises QueueFull, None for no limit
+        pool (WorkerPool): Optional supervised processes the jobs run in, with max_workers of them
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.cache = cache
+        self.keep_finished = keep_finished
+        self.pool = pool
+        self._queue_wait = Histogram()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active = {}
+
+    def submit(self, key, compute, trace_memory=False, cache=True):
+        """
+        Submit an analysis, or join an identical one already in flight.
+
+        Parameters:
+        key (str): Key from analysis_key identifying the request
+        compute (callable): Called with a StageTimer in a worker thread, or a worker process if the
+            queue has a pool (see upload_compute); returns the result dict
+        trace_memory (bool): Record the tracemalloc peak of each stage
+        cache (bool): Look the result up in and add it to the queue's AnalysisCache; False for jobs
+            whose output lives elsewhere, like pyramid_compute's
+
+        Returns:
+        str: Job id to pass to get
+
+        Raises:
+        QueueFull: max_pending jobs are already waiting for a worker
+        """
+        timer = StageTimer(trace_memory=trace_memory)
+        with self._lock:
+            job_id = self._active.get(key)
+            if job_id is not None:
+                return job_id
+
+            job = Job(key)
+            if cache and self.cache is not None:
+                with timer.stage("cache_lookup"):
+                    cached = self.cache.get(key)
+                if cached is not None:
+                    job.result = cached
+                    job.timings = timer.as_dict()
+                    job.served_from_cache = True
+                    job.status = DONE
+                    job.started_at = job.finished_at = time.time()
+                    job._done.set()
+                    self._remember(job)
+                    return job.id
+
+            if self.max_pending is not None:
+                queued = sum(self._jobs[job_id].status == QUEUED for job_id in self._active.values())
+                if queued >= self.max_pending:
+                    raise QueueFull(f"{queued} analyses are already waiting")
+
+            self._active[key] = job.id
+            self._remember(job)
+
+        timer.on_stage = lambda name: setattr(job, "stage", name)
+        self._pool.submit(self._run, job, compute, timer, cache)
+        return job.id
+
+    def get(self, job_id):
+        """
+        Look up a job.
+
+        Parameters:
+        job_id (str): Id returned by submit
+
+        Returns:
+        Job or None: The job, or None if it is unknown or has been dropped
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def counts(self):
+        """
+        Count the jobs known to the queue by status.
+
+        Returns:
+        dict: status -> number of jobs
+        """
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def metrics(self):
+        """
+        Report queue state and wait times, plus the worker pool's metrics if the queue has one.
+
+        Returns:
+        dict: workers, jobs (count per status), queue_wait_seconds (Histogram.as_dict of the time
+        jobs waited before they started) and pool (WorkerPool.metrics or None)
+        """
+        return {
+            "workers": self.max_workers,
+            "jobs": self.counts(),
+            "queue_wait_seconds": self._queue_wait.as_dict(),
+            "pool": self.pool.metrics() if self.pool is not None else None,
+        }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def _run(self, job, compute, timer, cache):
+        job.started_at = time.time()
+        job.status = RUNNING
+        self._queue_wait.observe(job.started_at - job.submitted_at)
+        status = FAILED
+        try:
+            result = self.pool.run(compute, timer=timer) if self.pool is not None else compute(timer)
+            # Timings describe this run only, so they are kept out of the cached result
+            result.pop("_timings", None)
+            if cache and self.cache is not None:
+                self.cache.put(job.key, result)
+            job.result = result
+            status = DONE
+        except Exception as e:
+            job.error = e
+        finally:
+            job.timings = timer.as_dict()
+            job.finished_at = time.time()
+            # Status changes last, so a poller that sees a finished job also sees its result
+            with self._lock:
+                job.status = status
+                self._active.pop(job.key, None)
+            job._done.set()
+
+    def _remember(self, job):
+        # Drop the oldest finished jobs; queued and running jobs are never dropped
+        self._jobs[job.id] = job
+        excess = len(self._jobs) - self.keep_finished
+        for job_id in [job_id for job_id, old in self._jobs.items() if old.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+
+def metrics_to_prometheus(metrics, prefix="musicvision"):
+    """
+    Render JobQueue.metrics() in the Prometheus text exposition format.
+
+    Parameters:
+    metrics (dict): Output of JobQueue.metrics
+    prefix (str): Metric name prefix
+
+    Returns:
+    str: Prometheus text format
+    """
+    lines = [
+        f"# HELP {prefix}_jobs Jobs known to the queue, by status",
+        f"# TYPE {prefix}_jobs gauge",
+    ]
+    lines += [f'{prefix}_jobs{{status="{status}"}} {count}' for status, count in metrics["jobs"].items()]
+    lines += histogram_to_prometheus(f"{prefix}_queue_wait_seconds", "Time jobs waited in the queue before starting",
+                                     metrics["queue_wait_seconds"])
+    text = "\n".join(lines) + "\n"
+    if metrics["pool"] is not None:
+        text += pool_to_prometheus(metrics["pool"], prefix=f"{prefix}_worker_pool")
+    return text
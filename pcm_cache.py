@@ -0,0 +1,216 @@
+"""
+Decoded-audio cache.
+
+Decoding compressed uploads dominates the load time of long files, and it
+used to be repeated whenever the sample rate, duration or resampler changed.
+PCMCache decodes each upload once, at its native rate and mixed to mono,
+into a flat float32 file keyed by the content hash of the upload. Later
+loads memory-map that file and slice the requested stretch without copying,
+so only resampling is left to do. The samples are exactly what
+librosa.load(sr=None) returns, so analyses are unchanged.
+
+Partial loads (the first 30 seconds, preview excerpts) of an upload that is
+not cached yet still decode only what they need; the whole upload is decoded
+into the cache on a background thread meanwhile, so the first analysis of a
+long file is not slowed down.
+
+An SQLite side table records the sample rate, length and last access of every
+file, and the least recently used files are deleted once the cache grows past
+max_disk_bytes.
+"""
+import glob
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import librosa
+import soundfile as sf
+
+from analysis_cache import DEFAULT_CACHE_DIR, content_hash
+from audio_io import open_upload
+
+DEFAULT_PCM_CACHE_BYTES = int(os.environ.get("MUSICVISION_PCM_CACHE_MB", "2048")) * 2**20
+
+# Seconds of audio decoded per block when filling the cache
+_DECODE_BLOCK_SECONDS = 10.0
+
+# Uploads allowed to wait for a background fill; further prefetches are dropped
+_MAX_PREFETCH = 8
+
+# Temporary files untouched for this many seconds belong to a decode that was killed
+_STALE_TEMP_SECONDS = 600
+
+
+def _decode_to_file(data, filename, path):
+    # Decode block by block so filling the cache never holds a long track in memory
+    with open_upload(data, filename) as source, open(path, "wb") as out:
+        try:
+            with sf.SoundFile(source) as f:
+                native_sr = f.samplerate
+                for block in f.blocks(blocksize=int(_DECODE_BLOCK_SECONDS * native_sr), dtype="float32",
+                                      always_2d=True):
+                    out.write(block.mean(axis=1).tobytes())
+        except RuntimeError:
+            # Formats soundfile can't read go through librosa's audioread fallback in one piece
+            out.seek(0)
+            out.truncate()
+            y, native_sr = librosa.load(source, sr=None)
+            out.write(y.tobytes())
+    return native_sr
+
+
+class PCMCache:
+    """
+    Disk cache of decoded uploads, read back memory-mapped.
+
+    Several threads and processes can share one cache directory: files are
+    written under a temporary name and renamed into place, and a file evicted
+    while another reader has it mapped stays readable until that mapping is
+    dropped.
+    """
+
+    def __init__(self, cache_dir=os.path.join(DEFAULT_CACHE_DIR, "pcm"), max_disk_bytes=DEFAULT_PCM_CACHE_BYTES):
+        """
+        Parameters:
+        cache_dir (str): Directory holding the decoded files and pcm.sqlite3
+        max_disk_bytes (int): Size above which the least recently used files are deleted
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._filler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pcm-cache")
+        self._filling = set()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "pcm.sqlite3"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pcm ("
+            "key TEXT PRIMARY KEY, sample_rate INTEGER NOT NULL, frames INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._remove_stale_temp_files()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.f32")
+
+    def get(self, data):
+        """
+        Look up the decoded samples of an upload.
+
+        Parameters:
+        data (bytes): Uploaded file contents
+
+        Returns:
+        tuple or None: (read-only memory-mapped mono samples, native sample rate), or None on a miss
+        """
+        key = content_hash(data)
+        with self._lock:
+            row = self._db.execute("SELECT sample_rate, frames FROM pcm WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            sample_rate, frames = row
+            try:
+                samples = (np.memmap(self._path(key), dtype=np.float32, mode="r", shape=(frames,))
+                           if frames else np.zeros(0, dtype=np.float32))
+            except (FileNotFoundError, ValueError):
+                # Evicted or truncated by another process since the row was read
+                self._db.execute("DELETE FROM pcm WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE pcm SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return samples, sample_rate
+
+    def load(self, data, filename=None):
+        """
+        Return the decoded samples of an upload, decoding and storing them on a miss.
+
+        Parameters:
+        data (bytes): Uploaded file contents
+        filename (str): Original file name, used for formats soundfile can't read
+
+        Returns:
+        tuple: (read-only memory-mapped mono samples, native sample rate)
+        """
+        cached = self.get(data)
+        if cached is not None:
+            return cached
+
+        key = content_hash(data)
+        path = self._path(key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            sample_rate = _decode_to_file(data, filename, temp_path)
+            frames = os.path.getsize(temp_path) // 4
+            # Mapped before the file is published, so a concurrent eviction can't pull it away
+            samples = (np.memmap(temp_path, dtype=np.float32, mode="r", shape=(frames,))
+                       if frames else np.zeros(0, dtype=np.float32))
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pcm (key, sample_rate, frames, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, sample_rate, frames, frames * 4, time.time()),
+            )
+            self._evict(keep=key)
+            self._db.commit()
+        return samples, sample_rate
+
+    def prefetch(self, data, filename=None):
+        """
+        Decode an upload into the cache on a background thread, unless it is cached or already being decoded.
+
+        Parameters:
+        data (bytes): Uploaded file contents
+        filename (str): Original file name, used for formats soundfile can't read
+        """
+        key = content_hash(data)
+        with self._lock:
+            if key in self._filling or len(self._filling) >= _MAX_PREFETCH:
+                return
+            self._filling.add(key)
+
+        def fill():
+            try:
+                self.load(data, filename)
+            except Exception:
+                # The foreground decode of the same bytes reports the error
+                pass
+            finally:
+                with self._lock:
+                    self._filling.discard(key)
+
+        self._filler.submit(fill)
+
+    def _remove_stale_temp_files(self):
+        # A worker process killed for its time or memory limit leaves its partial decode behind
+        cutoff = time.time() - _STALE_TEMP_SECONDS
+        for path in glob.glob(os.path.join(self.cache_dir, "*.tmp")):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self, keep):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pcm").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        rows = self._db.execute("SELECT key, size FROM pcm WHERE key != ? ORDER BY last_access", (keep,)).fetchall()
+        for key, size in rows:
+            if total <= self.max_disk_bytes:
+                break
+            self._db.execute("DELETE FROM pcm WHERE key = ?", (key,))
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
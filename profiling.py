@@ -0,0 +1,194 @@
+import itertools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger("musicvision.timings")
+
+
+class StageTimer:
+    """
+    Record wall time, and optionally peak traced memory, per named stage.
+
+    Wrap each stage in `with timer.stage("name"):`. Stages entered more than
+    once accumulate their time and keep their largest memory peak. Stages
+    must not be nested when trace_memory is on, because every stage resets
+    the tracemalloc peak.
+    """
+
+    def __init__(self, trace_memory=False, on_stage=None):
+        """
+        Parameters:
+        trace_memory (bool): Record the tracemalloc peak of each stage
+        on_stage (callable): Called with the stage name whenever a stage starts
+        """
+        self.trace_memory = trace_memory
+        self.on_stage = on_stage
+        self.stages = {}
+        self._created = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        if self.on_stage is not None:
+            self.on_stage(name)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            entry = self.stages.setdefault(name, {"seconds": 0.0})
+            entry["seconds"] += elapsed
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                entry["peak_bytes"] = max(entry.get("peak_bytes", 0), peak)
+            if started_tracing:
+                tracemalloc.stop()
+
+    def merge(self, timings):
+        """
+        Add stages recorded elsewhere, e.g. by a timer in a worker process.
+
+        Parameters:
+        timings (dict): Output of StageTimer.as_dict
+        """
+        for name, recorded in timings["stages"].items():
+            entry = self.stages.setdefault(name, {"seconds": 0.0})
+            entry["seconds"] += recorded["seconds"]
+            if "peak_bytes" in recorded:
+                entry["peak_bytes"] = max(entry.get("peak_bytes", 0), recorded["peak_bytes"])
+
+    def as_dict(self):
+        """
+        Return the recorded stages in the "_timings" result format.
+
+        Returns:
+        dict: {"stages": {name: {"seconds", ["peak_bytes"]}}, "total_seconds": float}
+        """
+        stages = {
+            name: {key: round(value, 6) if key == "seconds" else value for key, value in entry.items()}
+            for name, entry in self.stages.items()
+        }
+        return {
+            "stages": stages,
+            "total_seconds": round(sum(entry["seconds"] for entry in self.stages.values()), 6),
+        }
+
+
+class NullTimer:
+    """Stand-in for StageTimer when no instrumentation is requested."""
+
+    def stage(self, name):
+        return nullcontext()
+
+    def merge(self, timings):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Histogram:
+    """
+    Thread-safe cumulative histogram of durations, in the Prometheus histogram layout.
+    """
+
+    def __init__(self, buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300)):
+        """
+        Parameters:
+        buckets (tuple): Increasing upper bounds, in seconds; an unbounded bucket is added
+        """
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[next(i for i, bound in enumerate(self.buckets) if seconds <= bound)] += 1
+            self._sum += seconds
+
+    def as_dict(self):
+        """
+        Return the observations so far.
+
+        Returns:
+        dict: {"buckets": [(upper bound, observations up to it)], "sum": seconds, "count": observations};
+            the unbounded bucket's bound is the string "+Inf", so the dict stays valid JSON
+        """
+        with self._lock:
+            cumulative = list(itertools.accumulate(self._counts))
+            bounds = self.buckets[:-1] + ("+Inf",)
+            return {"buckets": list(zip(bounds, cumulative)), "sum": round(self._sum, 6), "count": cumulative[-1]}
+
+
+def histogram_to_prometheus(name, description, histogram):
+    """
+    Render a Histogram.as_dict() block in the Prometheus text exposition format.
+
+    Parameters:
+    name (str): Metric name
+    description (str): HELP text
+    histogram (dict): Output of Histogram.as_dict
+
+    Returns:
+    list: Lines of Prometheus text
+    """
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+    for bound, count in histogram["buckets"]:
+        lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+    lines.append(f"{name}_sum {histogram['sum']}")
+    lines.append(f"{name}_count {histogram['count']}")
+    return lines
+
+
+def to_prometheus(timings, prefix="musicvision", labels=None):
+    """
+    Render a "_timings" block in the Prometheus text exposition format.
+
+    Parameters:
+    timings (dict): Output of StageTimer.as_dict
+    prefix (str): Metric name prefix
+    labels (dict): Extra labels added to every sample
+
+    Returns:
+    str: Prometheus text format
+    """
+    def label_text(stage):
+        pairs = dict(labels or {}, stage=stage)
+        return ",".join(f'{key}="{value}"' for key, value in pairs.items())
+
+    lines = [
+        f"# HELP {prefix}_stage_seconds Wall time spent in each analysis stage",
+        f"# TYPE {prefix}_stage_seconds gauge",
+    ]
+    for stage, entry in timings["stages"].items():
+        lines.append(f"{prefix}_stage_seconds{{{label_text(stage)}}} {entry['seconds']}")
+
+    peaks = {stage: entry["peak_bytes"] for stage, entry in timings["stages"].items() if "peak_bytes" in entry}
+    if peaks:
+        lines.append(f"# HELP {prefix}_stage_peak_bytes Peak traced memory allocated in each analysis stage")
+        lines.append(f"# TYPE {prefix}_stage_peak_bytes gauge")
+        for stage, peak in peaks.items():
+            lines.append(f"{prefix}_stage_peak_bytes{{{label_text(stage)}}} {peak}")
+    return "\n".join(lines) + "\n"
+
+
+def log_timings(timings, **context):
+    """
+    Emit a "_timings" block as one structured JSON log record.
+
+    Parameters:
+    timings (dict): Output of StageTimer.as_dict
+    **context: Extra fields for the record, e.g. file name or sample rate
+    """
+    logger.info(json.dumps({"event": "analysis_timings", **context, **timings}))
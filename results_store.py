@@ -0,0 +1,465 @@
+"""
+Columnar store and queries for analysis results.
+
+Usage:
+    python -m results_store results/ --where "energy == High" --where "bpm > 120" --where "key == 'A minor'"
+    python -m results_store results/ --group-by genre --group-by key
+    python -m results_store results/ --where "genre == Jazz" --output jazz.csv
+
+Analysis results are nested dicts. flatten_result turns one into a row of
+typed scalar columns (RESULT_COLUMNS), and ResultsStore appends such rows in
+batches to Parquet part files in a directory, the layout written by
+`python -m batch --format parquet`. Queries run through pyarrow.dataset, so
+filters are vectorized and row groups whose statistics rule them out are
+skipped without being read.
+
+Conditions are "column op value" strings, with op one of ==, !=, >, >=, <,
+<= or ~ (substring match, e.g. "instruments ~ Synth"). Values may be quoted.
+"""
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+# Flat columns of one result: (name, Arrow type, value taken from an analyze_audio result)
+RESULT_COLUMNS = [
+    ("genre", "string", lambda r: r["genre"]["main_genre"]),
+    ("genre_confidence", "int16", lambda r: r["genre"]["confidence"]),
+    ("genre_elements", "string", lambda r: r["genre"]["elements"]),
+    ("mood", "string", lambda r: next(iter(r["mood"]), None)),
+    ("mood_score", "int16", lambda r: next(iter(r["mood"].values()), None)),
+    ("energy", "string", lambda r: r["energy"]["text"]),
+    ("energy_level", "float32", lambda r: r["energy"]["level"]),
+    ("energy_variance", "string", lambda r: r["energy"]["variance"]),
+    ("emotion", "float32", lambda r: r["emotion"]["value"]),
+    ("instruments", "string", lambda r: ", ".join(r["instruments"])),
+    ("use_cases", "string", lambda r: ", ".join(r["use_cases"])),
+    ("vocal_instrumentation", "string", lambda r: r["vocal"]["instrumentation"]),
+    ("vocal_register", "string", lambda r: r["vocal"]["register"]),
+    ("vocal_presence", "string", lambda r: r["vocal"]["presence"]),
+    ("vocal_autotune", "string", lambda r: r["vocal"]["autotune"]),
+    ("key", "string", lambda r: r["technical"]["key"]),
+    ("bpm", "int16", lambda r: r["technical"]["bpm"]),
+    ("beat_consistency", "float32", lambda r: float(r["technical"]["beat_consistency"])),
+    ("quality", "string", lambda r: r["technical"]["quality"]),
+    # Gate outcome of silent, clipped or broken inputs, null for analyzed tracks
+    ("degenerate", "string", lambda r: r.get("_degenerate", {}).get("reason")),
+]
+
+# Columns of a stored record: the track, the batch outcome, the flat result and the full result as JSON
+RECORD_COLUMNS = (
+    [("path", "string"), ("error", "string"), ("seconds", "float64")]
+    + [(name, arrow_type) for name, arrow_type, _ in RESULT_COLUMNS]
+    + [("result", "string")]
+)
+
+EXPORT_FORMATS = ("csv", "json", "parquet")
+
+_CONDITION = re.compile(r"^\s*(\w+)\s*(==|!=|>=|<=|>|<|~)\s*(.*?)\s*$")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Columnar results require pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def flatten_result(result):
+    """
+    Flatten a nested analysis result into typed scalar columns.
+
+    Parameters:
+    result (dict): Analysis results from AudioAnalyzer
+
+    Returns:
+    dict: Column name -> value, in RESULT_COLUMNS order
+    """
+    return {name: value(result) for name, _, value in RESULT_COLUMNS}
+
+
+def flatten_record(record):
+    """
+    Flatten an output record ({"path", "result" or "error", "seconds"}) into a stored row.
+
+    Returns:
+    dict: Row with every RECORD_COLUMNS column; result columns are null for failed tracks
+    """
+    result = record.get("result")
+    row = {"path": record["path"], "error": record.get("error"), "seconds": record.get("seconds")}
+    row.update(flatten_result(result) if result is not None else {name: None for name, _, _ in RESULT_COLUMNS})
+    row["result"] = json.dumps(result) if result is not None else None
+    return row
+
+
+def record_schema():
+    """Arrow schema of stored rows."""
+    pa = _pyarrow()
+    return pa.schema([(name, pa.type_for_alias(arrow_type)) for name, arrow_type in RECORD_COLUMNS])
+
+
+def parse_condition(text):
+    """
+    Turn a "column op value" condition into a pyarrow.compute expression.
+
+    Parameters:
+    text (str): Condition such as "bpm > 120", "key == 'A minor'" or "instruments ~ Synth"
+
+    Returns:
+    pyarrow.compute.Expression: Filter expression
+    """
+    pc = _pyarrow().compute
+    match = _CONDITION.match(text)
+    if match is None:
+        raise ValueError(f"Can't parse condition {text!r}, expected 'column op value'")
+    column, op, raw = match.groups()
+    if column not in dict(RECORD_COLUMNS):
+        raise ValueError(f"Unknown column {column!r} in condition {text!r}")
+
+    if len(raw) >= 2 and raw[0] == raw[-1] and raw[0] in "'\"":
+        value = raw[1:-1]
+    else:
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = raw
+
+    field = pc.field(column)
+    if op == "~":
+        return pc.match_substring(field, str(value))
+    return {
+        "==": field == value,
+        "!=": field != value,
+        ">": field > value,
+        ">=": field >= value,
+        "<": field < value,
+        "<=": field <= value,
+    }[op]
+
+
+def _where(conditions):
+    expression = None
+    for condition in conditions or ():
+        condition = parse_condition(condition) if isinstance(condition, str) else condition
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def to_table(records):
+    """
+    Build an Arrow table of stored rows from output records.
+
+    Parameters:
+    records (iterable): {"path", "result" or "error", "seconds"} dicts
+
+    Returns:
+    pyarrow.Table: One row per record with the RECORD_COLUMNS schema
+    """
+    pa = _pyarrow()
+    return pa.Table.from_pylist([flatten_record(record) for record in records], schema=record_schema())
+
+
+def export_records(records, fmt):
+    """
+    Serialize output records for download.
+
+    CSV and Parquet hold the flat columns; JSON keeps the nested results.
+
+    Parameters:
+    records (list): {"path", "result" or "error", "seconds"} dicts
+    fmt (str): One of EXPORT_FORMATS
+
+    Returns:
+    bytes: File contents
+    """
+    if fmt == "json":
+        return json.dumps(records, indent=2).encode()
+    if fmt == "csv":
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=[name for name, _ in RECORD_COLUMNS if name != "result"],
+                                extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(flatten_record(record) for record in records)
+        return text.getvalue().encode()
+    if fmt == "parquet":
+        buffer = io.BytesIO()
+        _pyarrow().parquet.write_table(to_table(records), buffer)
+        return buffer.getvalue()
+    raise ValueError(f"Unknown export format {fmt!r}, expected one of {EXPORT_FORMATS}")
+
+
+class ResultsStore:
+    """
+    Directory of Parquet part files holding flattened analysis results.
+
+    Used as a context manager, the store is a writer. Rows are buffered and
+    written out as a new part file every part_rows rows or part_seconds
+    seconds, whichever comes first. A part is written under a temporary name
+    and only then linked into place, so every part-*.parquet file is
+    complete: a killed run loses at most the rows of its unfinished part, and
+    existing_paths lets a restart skip everything written before.
+
+    When the writer closes, the parts of its session are merged into one
+    with row groups of row_group_size tracks, since large row groups and few
+    files keep scans fast. The merged part lists the parts it replaces in its
+    metadata, and queries ignore those, so a crash while merging never counts
+    a row twice. Queries read every part written so far.
+    """
+
+    # Seconds after which a temporary part left by a killed writer is removed
+    _STALE_TEMP_SECONDS = 3600
+
+    # Parquet metadata key listing the part files a merged part replaces
+    _REPLACES_KEY = b"musicvision.replaces"
+
+    def __init__(self, path, part_rows=5000, part_seconds=60.0, row_group_size=65536):
+        """
+        Parameters:
+        path (str): Directory of part-*.parquet files
+        part_rows (int): Rows after which the current part is written out
+        part_seconds (float): Seconds after which the current part is written out
+        row_group_size (int): Tracks per row group of the part merged at close
+        """
+        self._pa = _pyarrow()
+        self.path = path
+        self.part_rows = part_rows
+        self.part_seconds = part_seconds
+        self.row_group_size = row_group_size
+        self._schema = record_schema()
+
+    def _scan_parts(self):
+        # (readable parts, parts replaced by a merged part but not removed yet)
+        parts = {}
+        replaced = set()
+        for part in sorted(glob.glob(os.path.join(self.path, "part-*.parquet"))):
+            try:
+                metadata = self._pa.parquet.read_metadata(part).metadata or {}
+            except (OSError, self._pa.ArrowInvalid):
+                # Removed meanwhile, or left without a footer by a writer from before parts were linked into place
+                continue
+            parts[os.path.basename(part)] = part
+            if self._REPLACES_KEY in metadata:
+                replaced.update(json.loads(metadata[self._REPLACES_KEY]))
+        return ([part for name, part in parts.items() if name not in replaced],
+                [part for name, part in parts.items() if name in replaced])
+
+    def _parts(self):
+        return self._scan_parts()[0]
+
+    def dataset(self):
+        """
+        Open every part file as one dataset.
+
+        Returns:
+        pyarrow.dataset.Dataset: Rows with the RECORD_COLUMNS schema; columns missing from
+            older part files read as null
+        """
+        return self._pa.dataset.dataset(self._parts(), schema=self._schema, format="parquet")
+
+    def existing_paths(self):
+        if not self._parts():
+            return set()
+        return set(self.dataset().to_table(columns=["path"]).column("path").to_pylist())
+
+    def _remove_stale_temp_parts(self):
+        cutoff = time.time() - self._STALE_TEMP_SECONDS
+        for temp_path in glob.glob(os.path.join(self.path, ".part-*.tmp")):
+            try:
+                if os.path.getmtime(temp_path) < cutoff:
+                    os.remove(temp_path)
+            except OSError:
+                # Finished or removed by its writer meanwhile
+                continue
+
+    def _remove_replaced_parts(self):
+        # Left behind by a writer killed after linking its merged part
+        for part in self._scan_parts()[1]:
+            try:
+                os.remove(part)
+            except FileNotFoundError:
+                continue
+
+    def _link_part(self, temp_path):
+        # Give a finished part the next free number. os.link fails rather than replace an existing file, so
+        # neither a gap left by a deleted part nor a second writer in the same directory loses a part
+        while True:
+            numbers = [int(match.group(1)) for match in
+                       (re.fullmatch(r"part-(\d+)\.parquet", os.path.basename(part))
+                        for part in glob.glob(os.path.join(self.path, "part-*.parquet")))
+                       if match]
+            try:
+                path = os.path.join(self.path, f"part-{max(numbers, default=-1) + 1:05d}.parquet")
+                os.link(temp_path, path)
+                return path
+            except FileExistsError:
+                continue
+
+    def __enter__(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._remove_stale_temp_parts()
+        self._remove_replaced_parts()
+        self._rows = []
+        self._written = []
+        self._part_started = time.monotonic()
+        return self
+
+    def write(self, record):
+        """
+        Append one output record ({"path", "result" or "error", "seconds"}).
+        """
+        self._rows.append(flatten_record(record))
+        if len(self._rows) >= self.part_rows or time.monotonic() - self._part_started >= self.part_seconds:
+            self._flush()
+
+    def _flush(self):
+        self._part_started = time.monotonic()
+        if not self._rows:
+            return
+        with self._temp_part() as temp_path:
+            self._pa.parquet.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema), temp_path)
+            self._written.append(self._link_part(temp_path))
+        self._rows = []
+
+    @contextmanager
+    def _temp_part(self):
+        temp_path = os.path.join(self.path, f".part-{uuid.uuid4().hex}.tmp")
+        try:
+            yield temp_path
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _merge(self):
+        # Rewrite this session's parts as one, reading one row group's worth of them at a time
+        names = [os.path.basename(part) for part in self._written]
+        schema = self._schema.with_metadata({self._REPLACES_KEY: json.dumps(names).encode()})
+        with self._temp_part() as temp_path:
+            with self._pa.parquet.ParquetWriter(temp_path, schema) as writer:
+                pending = []
+                for i, part in enumerate(self._written):
+                    pending.append(self._pa.parquet.read_table(part, schema=self._schema))
+                    if sum(table.num_rows for table in pending) >= self.row_group_size or i == len(self._written) - 1:
+                        writer.write_table(self._pa.concat_tables(pending).cast(schema),
+                                           row_group_size=self.row_group_size)
+                        pending = []
+            self._link_part(temp_path)
+        for part in self._written:
+            os.remove(part)
+
+    def __exit__(self, *exc):
+        self._flush()
+        if len(self._written) > 1:
+            self._merge()
+
+    def query(self, where=(), columns=None, limit=None):
+        """
+        Select the rows matching every condition.
+
+        Parameters:
+        where (iterable): Condition strings (see parse_condition) or pyarrow.compute expressions
+        columns (list or None): Columns to return, None for every column but the JSON result
+        limit (int or None): Maximum number of rows
+
+        Returns:
+        pyarrow.Table: Matching rows
+        """
+        if not self._parts():
+            return self._schema.empty_table()
+        columns = columns or [name for name, _ in RECORD_COLUMNS if name != "result"]
+        dataset = self.dataset()
+        if limit is not None:
+            return dataset.head(limit, columns=columns, filter=_where(where))
+        return dataset.to_table(columns=columns, filter=_where(where))
+
+    def count(self, where=()):
+        """Number of rows matching every condition."""
+        if not self._parts():
+            return 0
+        return self.dataset().count_rows(filter=_where(where))
+
+    def aggregate(self, by, where=()):
+        """
+        Summarize the matching analyzed tracks per group.
+
+        Parameters:
+        by (list): Columns to group by, e.g. ["genre"] or ["key", "energy"]
+        where (iterable): Conditions as taken by query
+
+        Returns:
+        pyarrow.Table: One row per group of analyzed tracks with tracks, mean and min/max bpm,
+            mean energy_level and mean emotion, largest groups first
+        """
+        # Failed tracks and gate placeholders would drag the means towards zero
+        pc = self._pa.compute
+        analyzed = pc.field("error").is_null() & pc.field("degenerate").is_null()
+        table = self.query(where=[_where(where) & analyzed if where else analyzed],
+                           columns=list(by) + ["bpm", "energy_level", "emotion"])
+        summary = table.group_by(list(by)).aggregate([
+            ("bpm", "count"),
+            ("bpm", "mean"),
+            ("bpm", "min"),
+            ("bpm", "max"),
+            ("energy_level", "mean"),
+            ("emotion", "mean"),
+        ])
+        summary = summary.rename_columns([
+            "tracks" if name == "bpm_count" else name for name in summary.column_names
+        ])
+        return summary.sort_by([("tracks", "descending")])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("store", help="Directory of Parquet results, e.g. written by python -m batch --format parquet")
+    parser.add_argument("--where", action="append", default=[], help="Condition such as \"bpm > 120\" (repeatable)")
+    parser.add_argument("--group-by", action="append", default=[], help="Summarize per value of a column (repeatable)")
+    parser.add_argument("--columns", help="Comma-separated columns to show or export")
+    parser.add_argument("--limit", type=int, default=20, help="Rows printed when not exporting")
+    parser.add_argument("--output", "-o", help="Export the matching rows to a .csv, .json or .parquet file")
+    args = parser.parse_args(argv)
+
+    for condition in args.where:
+        try:
+            parse_condition(condition)
+        except ValueError as e:
+            parser.error(str(e))
+
+    store = ResultsStore(args.store)
+    if args.group_by:
+        print(store.aggregate(args.group_by, where=args.where).to_pandas().to_string(index=False))
+        return
+
+    columns = args.columns.split(",") if args.columns else None
+    if args.output:
+        table = store.query(where=args.where, columns=columns)
+        fmt = os.path.splitext(args.output)[1].lstrip(".").lower()
+        if fmt == "parquet":
+            store._pa.parquet.write_table(table, args.output)
+        elif fmt == "csv":
+            store._pa.csv.write_csv(table, args.output)
+        elif fmt == "json":
+            with open(args.output, "w") as f:
+                json.dump(table.to_pylist(), f, indent=2)
+        else:
+            parser.error(f"Unknown export format {fmt!r}, expected one of {EXPORT_FORMATS}")
+        print(f"{table.num_rows} rows written to {args.output}", file=sys.stderr)
+        return
+
+    print(f"{store.count(args.where)} matching tracks", file=sys.stderr)
+    print(store.query(where=args.where, columns=columns, limit=args.limit).to_pandas().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Segment-level analysis timelines.
+
+A timeline cuts a track into fixed windows (SEGMENT_SECONDS long, one
+starting every SEGMENT_HOP seconds) and runs the usual feature extraction
+and heuristics on each, giving energy, key, tempo and mood over time.
+
+Segments are cached per upload and settings rather than per duration, so
+extending the analyzed duration from 30 to 60 to 90 seconds or the full song
+only decodes and analyzes the audio after the last cached segment.
+"""
+from analysis_cache import timeline_key
+from audio_io import DEFAULT_RES_TYPE, load_audio
+from features import degenerate_reason, extract_features, signal_stats
+from profiling import NULL_TIMER
+
+SEGMENT_SECONDS = 5.0
+SEGMENT_HOP = 5.0
+
+# A trailing partial segment shorter than this is dropped
+MIN_SEGMENT_SECONDS = 1.0
+
+
+def summarize_segments(analyzer, pieces, sr):
+    """
+    Analyze segments and keep the values that are meaningful over time.
+
+    The segments are classified together, one batch per call.
+
+    Parameters:
+    analyzer (AudioAnalyzer): Analyzer whose heuristics are applied
+    pieces (list): (samples, start in seconds from the beginning of the track) of each segment
+    sr (int): Sample rate
+
+    Returns:
+    list: start, end, energy, energy_text, key, bpm and mood (None for silent segments) of each segment
+    """
+    results = [None] * len(pieces)
+    valid, batch_features = [], []
+    for i, (y, _) in enumerate(pieces):
+        # Silent stretches (intros, breaks) get neutral entries instead of garbage features
+        stats = signal_stats(y, sr)
+        reason = degenerate_reason(stats)
+        if reason is not None:
+            results[i] = analyzer.degenerate_result(reason, stats, sr)
+        else:
+            valid.append(i)
+            batch_features.append(extract_features(y, sr))
+    for i, result in zip(valid, analyzer.interpret_batch(batch_features, sr)):
+        results[i] = result
+
+    return [
+        {
+            "start": round(start, 3),
+            "end": round(start + len(y) / sr, 3),
+            "energy": result["energy"]["level"],
+            "energy_text": result["energy"]["text"],
+            "key": result["technical"]["key"],
+            "bpm": result["technical"]["bpm"],
+            "mood": next(iter(result["mood"]), None),
+        }
+        for (y, start), result in zip(pieces, results)
+    ]
+
+
+def analyze_timeline(analyzer, data, sr, duration=None, filename=None, res_type=DEFAULT_RES_TYPE,
+                     window=SEGMENT_SECONDS, hop=SEGMENT_HOP, cache=None, timer=NULL_TIMER, pcm_cache=None):
+    """
+    Build the segment timeline of an upload, reusing cached segments.
+
+    Parameters:
+    analyzer (AudioAnalyzer): Analyzer whose heuristics are applied
+    data (bytes): Uploaded file contents
+    sr (int or None): Analysis sample rate, None for the native rate
+    duration (float or None): Seconds covered by the timeline, None for the full song
+    filename (str): Original file name
+    res_type (str): librosa resampler
+    window (float): Segment length in seconds
+    hop (float): Seconds between segment starts
+    cache (AnalysisCache): Optional store for the segments analyzed so far
+    timer (StageTimer): Optional instrumentation; records "decode", "resample" and "segments"
+    pcm_cache (PCMCache): Optional decoded-audio cache the new audio is sliced from
+
+    Returns:
+    dict: {"window_seconds", "hop_seconds", "segments": [...]} covering the requested duration
+    """
+    key = timeline_key(data, sr, window, hop, res_type=res_type, classifier=analyzer.classifier.name)
+    state = cache.get(key) if cache is not None else None
+    segments = list(state["segments"]) if state else []
+    # Whether the segments already reach the end of the track
+    complete = bool(state and state["complete"])
+
+    offset = len(segments) * hop
+    if not complete and (duration is None or offset + window <= duration):
+        # Decode only the audio the cached segments don't cover yet
+        load_duration = None if duration is None else duration - offset
+        y, sr_used = load_audio(data, sr, duration=load_duration, offset=offset, filename=filename,
+                                res_type=res_type, timer=timer, pcm_cache=pcm_cache)
+        window_samples = int(round(window * sr_used))
+        hop_samples = int(round(hop * sr_used))
+        with timer.stage("segments"):
+            pieces = []
+            position = 0
+            while position + window_samples <= len(y):
+                pieces.append((y[position:position + window_samples], offset + position / sr_used))
+                position += hop_samples
+
+            # Less audio than asked for means the track ended inside this load
+            complete = duration is None or len(y) < (load_duration - 0.01) * sr_used
+            if complete and len(y) - position >= MIN_SEGMENT_SECONDS * sr_used:
+                pieces.append((y[position:], offset + position / sr_used))
+            segments.extend(summarize_segments(analyzer, pieces, sr_used))
+
+        if cache is not None:
+            cache.put(key, {"segments": segments, "complete": complete})
+
+    if duration is not None:
+        segments = [segment for segment in segments if segment["end"] <= duration + 1e-3]
+    return {"window_seconds": window, "hop_seconds": hop, "segments": segments}
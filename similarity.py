@@ -0,0 +1,314 @@
+"""
+Feature-vector store and "similar tracks" search.
+
+Every analysis result carries a compact float32 summary vector under
+"_vector" (see features.feature_vector). It is internal: split_vector takes it
+off results before they are returned or exported. VectorStore appends those vectors to
+a flat float32 file that is read back memory-mapped, with an SQLite side
+table mapping row ids to track keys and display metadata.
+
+SimilarityIndex answers nearest-neighbour queries over the store. Vectors are
+standardized per dimension, because the raw features live on very different
+scales (Hz for the spectral features, BPM for tempo, unit range for chroma).
+Exact search is one matrix-vector product over the in-memory copy, a few
+milliseconds per million tracks; with hnswlib installed an approximate HNSW
+index can be used instead.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from analysis_cache import DEFAULT_CACHE_DIR
+from features import VECTOR_DIM
+
+
+def track_metadata(name, result):
+    """
+    Pick the fields shown next to a similar track.
+
+    Parameters:
+    name (str): Display name, e.g. the uploaded file name
+    result (dict): Analysis results
+
+    Returns:
+    dict: name, genre, key, bpm and mood
+    """
+    return {
+        "name": name,
+        "genre": result["genre"]["main_genre"],
+        "key": result["technical"]["key"],
+        "bpm": result["technical"]["bpm"],
+        "mood": next(iter(result["mood"]), None),
+    }
+
+
+def split_vector(result):
+    """
+    Separate the internal feature vector from an analysis result.
+
+    Parameters:
+    result (dict): Analysis results, possibly carrying "_vector"
+
+    Returns:
+    tuple: (copy of the results without "_vector", vector or None)
+    """
+    result = dict(result)
+    return result, result.pop("_vector", None)
+
+
+class VectorStore:
+    """
+    Append-only store of feature vectors with per-track metadata.
+
+    Row i of the vector file belongs to track id i of the side table. Writers
+    take SQLite's write lock before placing a vector, so several processes
+    (the app, the API, a batch run) can add to one store. A vector is written
+    before its row is committed; one left behind by a crash is overwritten by
+    the next add.
+    """
+
+    def __init__(self, path=os.path.join(DEFAULT_CACHE_DIR, "vectors")):
+        """
+        Parameters:
+        path (str): Directory holding vectors.f32 and tracks.sqlite3
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        open(self._vectors_path, "ab").close()
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(path, "tracks.sqlite3"), check_same_thread=False, timeout=30,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, metadata TEXT NOT NULL, added REAL NOT NULL)"
+        )
+
+    def __len__(self):
+        # Ids are assigned consecutively, so the largest id gives the count without a table scan
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM tracks").fetchone()[0]
+
+    def add(self, key, vector, metadata):
+        """
+        Store a track's vector unless the key is already present.
+
+        Parameters:
+        key (str): Track identity, e.g. analysis_cache.content_hash of the file
+        vector (list or numpy.ndarray): Feature vector of length VECTOR_DIM
+        metadata (dict): JSON serializable display fields, see track_metadata
+
+        Returns:
+        int: Row id of the track
+        """
+        return self.add_many([(key, vector, metadata)])[0]
+
+    def add_many(self, entries):
+        """
+        Store many tracks in one transaction, skipping keys already present.
+
+        Parameters:
+        entries (iterable): (key, vector, metadata) tuples as taken by add
+
+        Returns:
+        list: Row id of every entry, in order
+        """
+        entries = list(entries)
+        vectors = np.asarray([vector for _, vector, _ in entries], dtype=np.float32).reshape(len(entries), -1)
+        if vectors.shape[1] != VECTOR_DIM:
+            raise ValueError(f"Expected vectors of length {VECTOR_DIM}, got shape {vectors.shape}")
+        with self._lock:
+            # The write lock serializes id assignment across processes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                next_id = len(self)
+                ids, rows, new, added = [], [], [], {}
+                for (key, _, metadata), vector in zip(entries, vectors):
+                    track_id = added.get(key, self.find(key))
+                    if track_id is None:
+                        track_id = added[key] = next_id
+                        next_id += 1
+                        rows.append((track_id, key, json.dumps(metadata), time.time()))
+                        new.append(vector)
+                    ids.append(track_id)
+                if new:
+                    with open(self._vectors_path, "r+b") as f:
+                        f.seek(rows[0][0] * VECTOR_DIM * 4)
+                        f.write(np.asarray(new).tobytes())
+                    self._db.executemany("INSERT INTO tracks (id, key, metadata, added) VALUES (?, ?, ?, ?)", rows)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return ids
+
+    def find(self, key):
+        """
+        Look up the row id of a track key.
+
+        Returns:
+        int or None: Row id, or None if the key isn't stored
+        """
+        with self._lock:
+            row = self._db.execute("SELECT id FROM tracks WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def vector(self, key):
+        """
+        Read back the stored vector of a track key.
+
+        Returns:
+        numpy.ndarray or None: Vector of length VECTOR_DIM, or None if the key isn't stored
+        """
+        track_id = self.find(key)
+        if track_id is None:
+            return None
+        return np.array(self.vectors(track_id)[0])
+
+    def metadata(self, ids):
+        """
+        Fetch the metadata of several rows.
+
+        Parameters:
+        ids (iterable): Row ids
+
+        Returns:
+        dict: Row id -> metadata
+        """
+        ids = [int(track_id) for track_id in ids]
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._db.execute(f"SELECT id, metadata FROM tracks WHERE id IN ({placeholders})", ids).fetchall()
+        return {track_id: json.loads(metadata) for track_id, metadata in rows}
+
+    def vectors(self, start=0):
+        """
+        Map the stored vectors from row start onwards, without reading them into memory.
+
+        Returns:
+        numpy.ndarray: Read-only (rows, VECTOR_DIM) float32 array
+        """
+        count = len(self)
+        if start >= count:
+            return np.empty((0, VECTOR_DIM), dtype=np.float32)
+        return np.memmap(self._vectors_path, dtype=np.float32, mode="r", offset=start * VECTOR_DIM * 4,
+                         shape=(count - start, VECTOR_DIM))
+
+
+class SimilarityIndex:
+    """
+    Nearest-neighbour search over a VectorStore.
+
+    The index keeps standardized copies of the stored vectors and picks up
+    rows appended to the store on the next query. The standardization is
+    refitted, and the index rebuilt, whenever the store has doubled since the
+    last fit.
+    """
+
+    def __init__(self, store, approximate=False):
+        """
+        Parameters:
+        store (VectorStore): Vectors to search
+        approximate (bool): Use an hnswlib HNSW index instead of exact search
+        """
+        if approximate:
+            try:
+                import hnswlib
+            except ImportError:
+                raise RuntimeError("Approximate search requires hnswlib (pip install hnswlib)")
+            self._hnswlib = hnswlib
+        self.store = store
+        self.approximate = approximate
+        self._lock = threading.Lock()
+        self._fitted_count = 0
+        self._count = 0
+
+    def query(self, vector, k=5, exclude=None):
+        """
+        Find the tracks closest to a feature vector.
+
+        Parameters:
+        vector (list or numpy.ndarray): Feature vector of length VECTOR_DIM
+        k (int): Number of neighbours
+        exclude (str): Track key left out of the results, e.g. the query track itself
+
+        Returns:
+        list: Dicts of metadata plus "id" and "distance", nearest first
+        """
+        with self._lock:
+            self._refresh()
+            if self._count == 0:
+                return []
+            skip = self.store.find(exclude) if exclude is not None else None
+            q = (np.asarray(vector, dtype=np.float32) - self._mean) / self._scale
+            wanted = min(k + (skip is not None), self._count)
+            ids, distances = self._search(q, wanted)
+
+        metadata = self.store.metadata(ids)
+        return [
+            {"id": int(track_id), "distance": round(float(distance), 4), **metadata[int(track_id)]}
+            for track_id, distance in zip(ids, distances)
+            if track_id != skip
+        ][:k]
+
+    def _refresh(self):
+        count = len(self.store)
+        if count == self._count:
+            return
+        if count >= 2 * self._fitted_count:
+            self._fit(count)
+        else:
+            self._append(self._standardize(self.store.vectors(self._count)[:count - self._count]))
+        self._count = count
+
+    def _fit(self, count):
+        raw = np.asarray(self.store.vectors()[:count])
+        self._mean = raw.mean(axis=0, dtype=np.float64).astype(np.float32)
+        std = raw.std(axis=0, dtype=np.float64)
+        self._scale = np.where(std > 0, std, 1).astype(np.float32)
+        self._fitted_count = count
+        self._count = 0
+        if self.approximate:
+            self._ann = self._hnswlib.Index(space="l2", dim=VECTOR_DIM)
+            self._ann.init_index(max_elements=max(2 * count, 1024), ef_construction=200, M=16)
+            self._ann.set_ef(64)
+        else:
+            self._matrix = np.empty((max(2 * count, 1024), VECTOR_DIM), dtype=np.float32)
+            self._sq_norms = np.empty(len(self._matrix), dtype=np.float32)
+        # Standardize in chunks to bound the temporary memory for large catalogs
+        for start in range(0, count, 2**18):
+            self._append(self._standardize(raw[start:start + 2**18]))
+
+    def _standardize(self, raw):
+        return (np.asarray(raw, dtype=np.float32) - self._mean) / self._scale
+
+    def _append(self, rows):
+        start = self._count
+        end = start + len(rows)
+        if self.approximate:
+            if end > self._ann.get_max_elements():
+                self._ann.resize_index(2 * end)
+            self._ann.add_items(rows, np.arange(start, end))
+        else:
+            if end > len(self._matrix):
+                # Grow geometrically so appending one track at a time stays cheap
+                self._matrix = np.concatenate([self._matrix[:start], np.empty((end, VECTOR_DIM), np.float32)])
+                self._sq_norms = np.concatenate([self._sq_norms[:start], np.empty(end, np.float32)])
+            self._matrix[start:end] = rows
+            self._sq_norms[start:end] = np.einsum("ij,ij->i", rows, rows)
+        self._count = end
+
+    def _search(self, q, k):
+        if self.approximate:
+            labels, distances = self._ann.knn_query(q, k=k)
+            return labels[0], np.sqrt(distances[0])
+        # |x - q|^2 = |x|^2 - 2 x.q + |q|^2, one matrix-vector product over the whole catalog
+        distances = self._sq_norms[:self._count] - 2 * (self._matrix[:self._count] @ q) + q @ q
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return nearest, np.sqrt(np.maximum(distances[nearest], 0))
@@ -0,0 +1,357 @@
+"""
+Bounded-memory analysis for long recordings.
+
+Audio is decoded and resampled block by block, and every block only updates
+running statistics, so peak memory depends on the block size rather than on
+the track length. The frames seen by the accumulator are exactly the frames
+of a centered librosa STFT over the whole signal, so the summary features
+match extract_features closely. Known differences:
+
+- log-mel values are floored 80 dB below the loudest frame seen *so far*
+  instead of the loudest frame of the whole track, which only matters for
+  tracks that open with long near-silent passages;
+- chroma tuning is estimated once, from the first block with signal;
+- zero-crossing rate pads the two edge frames with zeros instead of
+  repeating the edge sample;
+- with the "tempogram" backend, the tempogram pads the ends of the onset
+  envelope with zeros instead of a linear ramp.
+
+The onset envelope never has to be held in full. The default
+"autocorrelation" tempo backend keeps running lagged products of the
+envelope (plus its first and last few seconds, to remove the mean at the
+end), which give exactly the global autocorrelation of the whole envelope.
+The "tempogram" and "beat_track" backends share the time-averaged
+tempogram, which is what beat_track uses internally, summed block by block.
+"""
+from contextlib import contextmanager
+
+import numpy as np
+import librosa
+import soundfile as sf
+
+from features import (CLIP_LEVEL, DEFAULT_TEMPO_BACKEND, HOP_LENGTH, N_FFT, N_MFCC, TEMPO_BACKENDS,
+                      autocorrelation_lags, tempo_from_autocorrelation)
+from profiling import NULL_TIMER
+
+DEFAULT_BLOCK_SECONDS = 10.0
+
+# Pad added by librosa's onset_strength to centre the envelope on the frames (lag + n_fft // (2 * hop))
+_ONSET_PAD = 1 + N_FFT // (2 * HOP_LENGTH)
+
+
+def _soxr_quality(res_type):
+    # soxr_vhq / soxr_hq / ... map onto soxr's own quality names; other resamplers can't stream
+    if res_type and res_type.startswith("soxr_"):
+        return res_type[len("soxr_"):].upper()
+    return "HQ"
+
+
+@contextmanager
+def _native_blocks(source, block_seconds):
+    # (native rate, iterator of mono native-rate blocks) for a file or already decoded samples
+    if isinstance(source, tuple):
+        samples, native_sr = source
+        samples = np.asarray(samples, dtype=np.float32)
+        blocksize = max(N_FFT, int(block_seconds * native_sr))
+        yield native_sr, (samples[start:start + blocksize] for start in range(0, len(samples), blocksize))
+        return
+    with sf.SoundFile(source) as f:
+        blocksize = max(N_FFT, int(block_seconds * f.samplerate))
+        yield f.samplerate, (block.mean(axis=1)
+                             for block in f.blocks(blocksize=blocksize, dtype="float32", always_2d=True))
+
+
+def iter_blocks(source, sr, block_seconds=DEFAULT_BLOCK_SECONDS, res_type="soxr_hq"):
+    """
+    Decode an audio file block by block as mono float32 at the target rate.
+
+    Parameters:
+    source (str, file-like or tuple): Audio file path, binary file object, or already decoded
+        (mono samples, native sample rate), e.g. from pcm_cache.PCMCache
+    sr (int or None): Target sample rate, None to keep the native rate
+    block_seconds (float): Approximate length of each decoded block
+    res_type (str): librosa-style resampler name; soxr qualities are honoured, others use soxr_hq
+
+    Yields:
+    numpy.ndarray: Consecutive mono blocks at the target rate
+    """
+    import soxr
+
+    with _native_blocks(source, block_seconds) as (native_sr, blocks):
+        resampler = None
+        if sr is not None and sr != native_sr:
+            resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32", quality=_soxr_quality(res_type))
+
+        for mono in blocks:
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono)
+            if len(mono):
+                yield mono
+
+        if resampler is not None:
+            tail = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+            if len(tail):
+                yield tail
+
+
+class StreamingFeatureAccumulator:
+    """
+    Running summary features over a signal fed in consecutive blocks.
+
+    Feed blocks with update() and call finalize() once to obtain a dict with
+    the same keys as features.extract_features.
+    """
+
+    def __init__(self, sr, tempo_backend=DEFAULT_TEMPO_BACKEND, on_mel=None):
+        """
+        Parameters:
+        sr (int): Sample rate of the blocks
+        tempo_backend (str): Tempo estimator, one of features.TEMPO_BACKENDS
+        on_mel (callable): Optional; called with the mel power spectrogram of every stretch of frames,
+            e.g. visualization.PyramidBuilder.add_mel, so other consumers reuse this STFT
+        """
+        if tempo_backend not in TEMPO_BACKENDS:
+            raise ValueError(f"Unknown tempo backend {tempo_backend!r}, expected one of {TEMPO_BACKENDS}")
+        self.sr = sr
+        self.tempo_backend = tempo_backend
+        self.on_mel = on_mel
+        # Leading zeros reproduce the centered STFT's constant padding
+        self._carry = np.zeros(N_FFT // 2, dtype=np.float32)
+        self._tuning = None
+        self._db_max = -np.inf
+        self._prev_mel_db = None
+
+        # The centered onset envelope runs _ONSET_PAD - 1 values past the last frame; those
+        # trailing values are held back until more frames arrive and dropped in finalize()
+        self._onset_held = np.zeros(_ONSET_PAD, dtype=np.float32)
+        self._onset_count = 0
+        self._onset_sum = 0.0
+        self._onset_sumsq = 0.0
+        self._tg_win = librosa.time_to_frames(8.0, sr=sr, hop_length=HOP_LENGTH).item()
+        self._tg_tail = np.zeros(self._tg_win // 2, dtype=np.float32)
+        self._tg_sum = np.zeros(self._tg_win)
+        self._tg_frames = 0
+        # Raw lagged products sum(x[t] * x[t + lag]) of the envelope, with its first and last values
+        self._ac_lags = autocorrelation_lags(sr) + 2
+        self._ac_sum = np.zeros(self._ac_lags)
+        self._ac_head = np.zeros(0)
+        self._ac_tail = np.zeros(self._ac_lags)
+
+        self._n_frames = 0
+        self._sums = {
+            "spectral_centroid": 0.0,
+            "spectral_bandwidth": 0.0,
+            "spectral_rolloff": 0.0,
+            "zero_crossing_rate": 0.0,
+        }
+        self._mfcc_sum = np.zeros(N_MFCC)
+        self._mfcc1_max = -np.inf
+        self._chroma_sum = np.zeros(12)
+
+        self._n_samples = 0
+        self._signal_sum = 0.0
+        self._signal_sumsq = 0.0
+        self._peak = 0.0
+        self._clipped = 0
+
+    def update(self, block):
+        """
+        Add the next block of samples.
+
+        Parameters:
+        block (numpy.ndarray): Mono samples following the previous block
+        """
+        block = np.asarray(block, dtype=np.float32)
+        self._n_samples += len(block)
+        self._signal_sum += float(np.sum(block, dtype=np.float64))
+        self._signal_sumsq += float(np.dot(block.astype(np.float64), block))
+        if len(block):
+            magnitude = np.abs(block)
+            self._peak = max(self._peak, float(magnitude.max()))
+            self._clipped += int(np.count_nonzero(magnitude >= CLIP_LEVEL))
+
+        buffer = np.concatenate([self._carry, block])
+        if len(buffer) < N_FFT:
+            self._carry = buffer
+            return
+        n_frames = 1 + (len(buffer) - N_FFT) // HOP_LENGTH
+        self._process(buffer[: (n_frames - 1) * HOP_LENGTH + N_FFT])
+        self._carry = buffer[n_frames * HOP_LENGTH:]
+
+    def _process(self, buffer):
+        sr = self.sr
+        S = np.abs(librosa.stft(buffer, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False))
+        power = S ** 2
+        self._n_frames += S.shape[-1]
+
+        self._sums["spectral_centroid"] += librosa.feature.spectral_centroid(S=S, sr=sr)[0].sum()
+        self._sums["spectral_bandwidth"] += librosa.feature.spectral_bandwidth(S=S, sr=sr)[0].sum()
+        self._sums["spectral_rolloff"] += librosa.feature.spectral_rolloff(S=S, sr=sr)[0].sum()
+        frames = librosa.util.frame(buffer, frame_length=N_FFT, hop_length=HOP_LENGTH)
+        self._sums["zero_crossing_rate"] += librosa.zero_crossings(frames, pad=False, axis=-2).mean(axis=-2).sum()
+
+        mel_power = librosa.feature.melspectrogram(S=power, sr=sr)
+        if self.on_mel is not None:
+            self.on_mel(mel_power)
+        mel_db = librosa.power_to_db(mel_power, top_db=None)
+        self._db_max = max(self._db_max, float(mel_db.max()))
+        mel_db = np.maximum(mel_db, self._db_max - 80.0)
+
+        mfccs = librosa.feature.mfcc(S=mel_db, sr=sr, n_mfcc=N_MFCC)
+        self._mfcc_sum += mfccs.sum(axis=1)
+        self._mfcc1_max = max(self._mfcc1_max, float(mfccs[1].max()))
+
+        if self._tuning is None and np.any(power > 0):
+            self._tuning = librosa.estimate_tuning(S=power, sr=sr, n_fft=N_FFT)
+        chroma = librosa.feature.chroma_stft(S=power, sr=sr, tuning=self._tuning or 0.0)
+        self._chroma_sum += chroma.sum(axis=1)
+
+        # Difference each frame against its predecessor, carrying the last frame across blocks
+        if self._prev_mel_db is not None:
+            mel_db_lagged = np.concatenate([self._prev_mel_db, mel_db], axis=1)
+        else:
+            mel_db_lagged = mel_db
+        if mel_db_lagged.shape[1] > 1:
+            onset = np.concatenate([self._onset_held, librosa.onset.onset_strength(S=mel_db_lagged, sr=sr, center=False)])
+            self._onset_held = onset[-(_ONSET_PAD - 1):]
+            self._add_onsets(onset[:-(_ONSET_PAD - 1)])
+        self._prev_mel_db = mel_db[:, -1:]
+
+    def _add_onsets(self, onset):
+        self._onset_count += len(onset)
+        self._onset_sum += float(np.sum(onset, dtype=np.float64))
+        self._onset_sumsq += float(np.dot(onset.astype(np.float64), onset))
+        if self.tempo_backend == "autocorrelation":
+            self._add_autocorrelation(onset)
+        else:
+            self._add_tempogram(onset)
+
+    def _add_autocorrelation(self, onset):
+        onset = onset.astype(np.float64)
+        if len(self._ac_head) < self._ac_lags:
+            self._ac_head = np.concatenate([self._ac_head, onset[:self._ac_lags - len(self._ac_head)]])
+        # Products of every new value with itself and the _ac_lags - 1 values before it; the tail
+        # starts out as zeros, which contribute nothing
+        buffer = np.concatenate([self._ac_tail, onset])
+        products = np.correlate(buffer, onset, mode="valid")
+        self._ac_sum += products[::-1][:self._ac_lags]
+        self._ac_tail = buffer[-self._ac_lags:]
+
+    def _autocorrelation_tempo(self):
+        # sum((x[t] - m) * (x[t + lag] - m)) from the raw products, the values the lag skips at either end
+        # and the envelope mean
+        n = self._onset_count
+        lags = np.arange(min(self._ac_lags, n))
+        mean = self._onset_sum / n
+        head = np.concatenate([[0.0], np.cumsum(self._ac_head)])[lags]
+        tail = np.concatenate([[0.0], np.cumsum(self._ac_tail[::-1])])[lags]
+        total = self._onset_sum
+        ac = self._ac_sum[lags] - mean * ((total - tail) + (total - head)) + (n - lags) * mean ** 2
+        return tempo_from_autocorrelation(ac, self.sr)
+
+    def _add_tempogram(self, onset):
+        buffer = np.concatenate([self._tg_tail, onset])
+        if len(buffer) < self._tg_win:
+            self._tg_tail = buffer
+            return
+        tg = librosa.feature.tempogram(onset_envelope=buffer, sr=self.sr, hop_length=HOP_LENGTH,
+                                       win_length=self._tg_win, center=False)
+        self._tg_sum += tg.sum(axis=1)
+        self._tg_frames += tg.shape[1]
+        self._tg_tail = buffer[tg.shape[1]:]
+
+    def signal_stats(self):
+        """
+        Whole-signal statistics of the blocks seen so far, as features.signal_stats returns them.
+
+        Returns:
+        dict: duration, rms, peak, clipped_fraction and finite
+        """
+        n = max(self._n_samples, 1)
+        return {
+            "duration": self._n_samples / self.sr,
+            "rms": float(np.sqrt(self._signal_sumsq / n)),
+            "peak": self._peak,
+            "clipped_fraction": self._clipped / n,
+            "finite": bool(np.isfinite(self._signal_sumsq)),
+        }
+
+    def finalize(self):
+        """
+        Flush the trailing frames and return the summary features.
+
+        Returns:
+        dict: Summary features matching features.extract_features
+        """
+        self._process(np.concatenate([self._carry, np.zeros(N_FFT // 2, dtype=np.float32)]))
+        self._carry = np.zeros(0, dtype=np.float32)
+
+        if self._onset_sum <= 0:
+            # Same as every backend on an envelope without onsets
+            tempo = 0.0
+        elif self.tempo_backend == "autocorrelation":
+            tempo = self._autocorrelation_tempo()
+        else:
+            self._add_tempogram(np.zeros(self._tg_win // 2, dtype=np.float32))
+            tg_mean = (self._tg_sum / max(self._tg_frames, 1))[:, np.newaxis]
+            tempo = librosa.feature.tempo(tg=tg_mean, sr=self.sr, hop_length=HOP_LENGTH)
+
+        onset_mean = self._onset_sum / max(self._onset_count, 1)
+        onset_var = max(0.0, self._onset_sumsq / max(self._onset_count, 1) - onset_mean ** 2)
+        onset_variation = np.sqrt(onset_var) / onset_mean if onset_mean > 0 else float("nan")
+
+        n = max(self._n_frames, 1)
+        mean = self._signal_sum / max(self._n_samples, 1)
+        power = self._signal_sumsq / max(self._n_samples, 1)
+        features = {name: float(total / n) for name, total in self._sums.items()}
+        features.update({
+            "tempo": float(np.atleast_1d(tempo)[0]),
+            "mfcc_means": self._mfcc_sum / n,
+            "mfcc1_max": self._mfcc1_max,
+            "chroma_means": self._chroma_sum / n,
+            "onset_variation": float(onset_variation),
+            "signal_var": max(0.0, power - mean ** 2),
+            "signal_power": power,
+        })
+        return features
+
+
+def stream_features(source, sr, block_seconds=DEFAULT_BLOCK_SECONDS, res_type="soxr_hq",
+                    tempo_backend=DEFAULT_TEMPO_BACKEND, timer=NULL_TIMER, visualizer=None):
+    """
+    Extract summary features from an audio file without loading it whole.
+
+    Parameters:
+    source (str, file-like or tuple): Audio file path, binary file object or decoded samples, see iter_blocks
+    sr (int or None): Analysis sample rate, None for the native rate
+    block_seconds (float): Seconds of audio decoded per block
+    res_type (str): Resampler, see iter_blocks
+    tempo_backend (str): Tempo estimator, one of features.TEMPO_BACKENDS
+    timer (StageTimer): Optional instrumentation; records "decode" and "features" across all blocks
+    visualizer (PyramidBuilder): Optional; fed every block and its mel spectrogram, so the track's
+        visualization.TrackPyramid is built from the analysis STFT
+
+    Returns:
+    tuple: (summary features, sample rate used, whole-signal stats as features.signal_stats returns them)
+    """
+    if sr is None and isinstance(source, tuple):
+        sr = source[1]
+    elif sr is None:
+        sr = sf.info(source).samplerate
+        if hasattr(source, "seek"):
+            source.seek(0)
+    accumulator = StreamingFeatureAccumulator(sr, tempo_backend=tempo_backend,
+                                              on_mel=visualizer.add_mel if visualizer is not None else None)
+    blocks = iter_blocks(source, sr, block_seconds=block_seconds, res_type=res_type)
+    while True:
+        with timer.stage("decode"):
+            block = next(blocks, None)
+        if block is None:
+            break
+        with timer.stage("features"):
+            if visualizer is not None:
+                visualizer.add_samples(block)
+            accumulator.update(block)
+    with timer.stage("features"):
+        features = accumulator.finalize()
+    return features, sr, accumulator.signal_stats()
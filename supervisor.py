@@ -0,0 +1,439 @@
+"""
+Supervised worker processes for analyses.
+
+A pathological upload (hours of audio, a codec that sends the decoder into a
+loop) used to run on a thread of the server process, where it could spin for
+minutes or grow the memory of the whole app until the operating system killed
+it. A WorkerPool runs each task in one of a fixed set of child processes
+instead, and the calling thread supervises it:
+
+- a task that runs longer than timeout seconds has its process killed and
+  raises WorkerTimeout;
+- a process whose resident memory grows past max_rss_bytes is killed and the
+  task raises WorkerMemoryExceeded (the limit is checked by sampling
+  /proc/<pid>/statm, so it is only enforced on Linux);
+- a process that dies on its own raises WorkerCrashed;
+- a process exits after max_tasks tasks, so memory fragmentation can't pile
+  up, and is replaced in the background.
+
+Each process calls the pool's initializer once, like a ProcessPoolExecutor,
+so the analyzer and its caches are built once per process rather than per
+task. Tasks are called as fn(timer, *args, **kwargs) with a StageTimer whose
+stages are reported to the caller's timer as they start and merged into it
+when the task ends. Tasks and their arguments must be picklable, and tasks
+must live in an importable module: workers don't import the caller's
+__main__, which for the Streamlit app is the unguarded app script.
+
+metrics() reports pool utilization, the time callers waited for a free
+process and how many tasks ended in each way; to_prometheus renders them.
+"""
+import multiprocessing
+import multiprocessing.spawn
+import os
+import queue
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from profiling import NULL_TIMER, Histogram, StageTimer, histogram_to_prometheus
+
+# Seconds a task may run before its process is killed, 0 for no limit
+DEFAULT_TASK_TIMEOUT = float(os.environ.get("MUSICVISION_TASK_TIMEOUT", "300"))
+# Resident memory a worker process may reach before it is killed, 0 for no limit
+DEFAULT_MAX_RSS_BYTES = int(os.environ.get("MUSICVISION_WORKER_MAX_RSS_MB", "4096")) * 2**20
+# Tasks a worker process runs before it is replaced
+DEFAULT_MAX_TASKS = int(os.environ.get("MUSICVISION_WORKER_MAX_TASKS", "100"))
+
+# Seconds between memory samples and liveness checks of a busy worker
+_POLL_SECONDS = 0.1
+# Seconds a new worker process may take to import its modules and run the initializer
+_STARTUP_TIMEOUT = 300
+
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class WorkerError(RuntimeError):
+    """
+    A task stopped by the supervisor rather than by an error of its own.
+
+    reason is "timeout", "memory" or "crashed"; details holds the numbers
+    behind it (limits, elapsed seconds, resident bytes, exit code).
+    """
+
+    reason = None
+
+    def __init__(self, message, **details):
+        super().__init__(message)
+        self.details = details
+
+
+class WorkerTimeout(WorkerError):
+    """The task ran past the pool's timeout and its process was killed."""
+
+    reason = "timeout"
+
+
+class WorkerMemoryExceeded(WorkerError):
+    """The task's process grew past the pool's memory limit, or ran out of memory."""
+
+    reason = "memory"
+
+
+class WorkerCrashed(WorkerError):
+    """The task's process died without returning a result."""
+
+    reason = "crashed"
+
+
+def _rss_bytes(pid):
+    # Resident set size of a process, or None where /proc is unavailable
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _worker_main(conn, initializer, initargs, max_tasks):
+    # Ctrl-C in the server's terminal reaches the whole process group; the parent decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer(*initargs)
+    conn.send(("ready",))
+
+    tasks = 0
+    while not max_tasks or tasks < max_tasks:
+        tasks += 1
+        task = conn.recv()
+        if task is None:
+            return
+        fn, args, kwargs, trace_memory = task
+        timer = StageTimer(trace_memory=trace_memory, on_stage=lambda name: conn.send(("stage", name)))
+        try:
+            result = fn(timer, *args, **kwargs)
+            conn.send(("done", result, timer.as_dict()))
+        except BaseException as e:
+            try:
+                conn.send(("error", e, timer.as_dict()))
+            except Exception:
+                # The exception doesn't pickle; keep its type and message
+                conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}"), timer.as_dict()))
+
+
+_get_preparation_data = multiprocessing.spawn.get_preparation_data
+# Threads starting a pool worker right now, and the number of them
+_spawning = threading.local()
+_spawning_lock = threading.Lock()
+_spawning_count = 0
+
+
+def _preparation_data(name):
+    # What a new process is told about its parent. Spawned and forkserver processes re-run the parent's
+    # __main__ from it; Streamlit executes app.py as __main__ without a `__name__ == "__main__"` guard, so
+    # workers would run the app. Processes other threads start meanwhile get the usual data.
+    data = _get_preparation_data(name)
+    if getattr(_spawning, "worker", False):
+        data.pop("init_main_from_name", None)
+        data.pop("init_main_from_path", None)
+    return data
+
+
+@contextmanager
+def _without_main():
+    # multiprocessing reads the preparation data from multiprocessing.spawn, so _preparation_data stands in
+    # for it only while pool workers are being started, and the original is back once the last one is.
+    # sys.modules["__main__"] is left alone, so threads reading it are unaffected.
+    global _spawning_count
+    with _spawning_lock:
+        if _spawning_count == 0:
+            multiprocessing.spawn.get_preparation_data = _preparation_data
+        _spawning_count += 1
+    _spawning.worker = True
+    try:
+        yield
+    finally:
+        _spawning.worker = False
+        with _spawning_lock:
+            _spawning_count -= 1
+            if _spawning_count == 0:
+                multiprocessing.spawn.get_preparation_data = _get_preparation_data
+
+
+class _Worker:
+    def __init__(self, context, initializer, initargs, max_tasks):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, initializer, initargs, max_tasks),
+                                       daemon=True, name="analysis-worker")
+        with _without_main():
+            self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.tasks = 0
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of supervised worker processes.
+    """
+
+    def __init__(self, workers, initializer=None, initargs=(), timeout=DEFAULT_TASK_TIMEOUT,
+                 max_rss_bytes=DEFAULT_MAX_RSS_BYTES, max_tasks=DEFAULT_MAX_TASKS, preload=()):
+        """
+        Parameters:
+        workers (int): Worker processes, and so tasks run at once
+        initializer (callable): Called with initargs once in every worker process
+        initargs (tuple): Arguments of the initializer
+        timeout (float): Seconds a task may run, 0 or None for no limit
+        max_rss_bytes (int): Resident memory a worker may reach, 0 or None for no limit
+        max_tasks (int): Tasks a worker runs before it is replaced, 0 or None for no limit
+        preload (iterable): Modules the fork server imports once, so new workers start without importing them
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.max_rss_bytes = max_rss_bytes
+        self.max_tasks = max_tasks
+        self._initializer = initializer
+        self._initargs = initargs
+        self._context = multiprocessing.get_context(_START_METHOD)
+        if _START_METHOD == "forkserver" and preload:
+            self._context.set_forkserver_preload(list(preload))
+
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._closed = False
+        self._started = time.perf_counter()
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._counts = {"completed": 0, "failed": 0, "timeout": 0, "memory": 0, "crashed": 0}
+        self._recycled = 0
+        self._wait = Histogram()
+        self._peak_rss = 0
+        self._workers = set()
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        worker = _Worker(self._context, self._initializer, self._initargs, self.max_tasks)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def run(self, fn, *args, timer=NULL_TIMER, **kwargs):
+        """
+        Run fn(timer, *args, **kwargs) in a worker process and wait for its result.
+
+        Parameters:
+        fn (callable): Picklable module-level function
+        *args: Picklable positional arguments
+        timer (StageTimer): Receives the task's stages
+        **kwargs: Picklable keyword arguments
+
+        Returns:
+        The return value of fn
+
+        Raises:
+        WorkerTimeout, WorkerMemoryExceeded, WorkerCrashed: The supervisor stopped the task
+        Exception: Whatever fn raised
+        """
+        requested = time.perf_counter()
+        with timer.stage("worker_wait"):
+            worker = self._idle.get()
+            if not worker.ready:
+                self._await_ready(worker)
+        started = time.perf_counter()
+        self._wait.observe(started - requested)
+        with self._lock:
+            self._busy += 1
+
+        outcome = "failed"
+        peak_rss = 0
+        try:
+            worker.conn.send((fn, args, kwargs, getattr(timer, "trace_memory", False)))
+            worker.tasks += 1
+            while True:
+                if worker.conn.poll(_POLL_SECONDS):
+                    message = self._receive(worker)
+                    if message[0] == "stage" and getattr(timer, "on_stage", None) is not None:
+                        timer.on_stage(message[1])
+                    elif message[0] != "stage":
+                        kind, value, timings = message
+                        timer.merge(timings)
+                        if kind == "done":
+                            outcome = "completed"
+                            return value
+                        if isinstance(value, MemoryError):
+                            raise WorkerMemoryExceeded("The analysis ran out of memory") from value
+                        raise value
+
+                # Limits are checked after every message too, so a task that keeps reporting stages can't evade them
+                elapsed = time.perf_counter() - started
+                if not worker.process.is_alive() and not worker.conn.poll():
+                    # Dead with nothing left to read: raises WorkerCrashed or WorkerMemoryExceeded
+                    self._receive(worker)
+                rss = _rss_bytes(worker.process.pid)
+                if rss is not None:
+                    peak_rss = max(peak_rss, rss)
+                if self.max_rss_bytes and rss is not None and rss > self.max_rss_bytes:
+                    worker.kill()
+                    raise WorkerMemoryExceeded(
+                        f"The analysis used {rss / 2**30:.1f} GiB of memory, more than the "
+                        f"{self.max_rss_bytes / 2**30:.1f} GiB allowed",
+                        rss_bytes=rss, max_rss_bytes=self.max_rss_bytes, seconds=round(elapsed, 3))
+                if self.timeout and elapsed > self.timeout:
+                    worker.kill()
+                    raise WorkerTimeout(f"The analysis took longer than {self.timeout:g} seconds",
+                                        timeout_seconds=self.timeout)
+        except WorkerError as e:
+            outcome = e.reason
+            raise
+        finally:
+            self._release(worker, outcome, time.perf_counter() - started, peak_rss)
+
+    def wait_ready(self):
+        """
+        Block until every worker process has run its initializer, e.g. before a server takes requests.
+
+        Raises:
+        WorkerCrashed: A worker failed to start
+        """
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            if not worker.ready:
+                self._await_ready(worker)
+
+    def _receive(self, worker):
+        # Next message from a busy worker; a worker that died instead becomes an error
+        try:
+            return worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join()
+            exitcode = worker.process.exitcode
+            worker.conn.close()
+            if exitcode == -signal.SIGKILL:
+                # Killed from outside, typically by the kernel's out-of-memory killer
+                raise WorkerMemoryExceeded("The analysis process was killed, most likely for running out of memory",
+                                           exitcode=exitcode)
+            raise WorkerCrashed(f"The analysis process crashed (exit code {exitcode})", exitcode=exitcode)
+
+    def _await_ready(self, worker):
+        # A new worker imports its modules and runs the initializer before it takes tasks
+        if not worker.conn.poll(_STARTUP_TIMEOUT):
+            worker.kill()
+            self._replace(worker)
+            raise WorkerCrashed(f"A worker process did not start within {_STARTUP_TIMEOUT} seconds")
+        try:
+            self._receive(worker)
+        except WorkerError:
+            self._replace(worker)
+            raise
+        worker.ready = True
+
+    def _release(self, worker, outcome, seconds, peak_rss):
+        with self._lock:
+            self._busy -= 1
+            self._busy_seconds += seconds
+            self._counts[outcome] += 1
+            self._peak_rss = max(self._peak_rss, peak_rss)
+        if outcome in ("completed", "failed") and not (self.max_tasks and worker.tasks >= self.max_tasks):
+            self._idle.put(worker)
+            return
+        if outcome in ("completed", "failed"):
+            # The worker exits by itself after its last task
+            with self._lock:
+                self._recycled += 1
+            worker.process.join()
+            worker.conn.close()
+        self._replace(worker)
+
+    def _replace(self, worker):
+        if worker.process.is_alive():
+            worker.kill()
+        with self._lock:
+            self._workers.discard(worker)
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def metrics(self):
+        """
+        Report the pool's utilization and task outcomes since it started.
+
+        Returns:
+        dict: workers, busy, utilization (busy share of worker time), tasks (count per outcome),
+        recycled (workers replaced after max_tasks), wait_seconds (Histogram.as_dict of the time
+        tasks waited for a ready worker) and peak_rss_bytes
+        """
+        with self._lock:
+            uptime = time.perf_counter() - self._started
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "utilization": round(self._busy_seconds / (uptime * self.workers), 4) if uptime > 0 else 0.0,
+                "tasks": dict(self._counts),
+                "recycled": self._recycled,
+                "wait_seconds": self._wait.as_dict(),
+                "peak_rss_bytes": self._peak_rss,
+            }
+
+    def shutdown(self):
+        """Stop the idle workers and kill busy ones; running tasks raise WorkerCrashed."""
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                worker.conn.send(None)
+                worker.process.join(5)
+            except OSError:
+                pass
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            if worker.process.is_alive():
+                worker.kill()
+
+
+def to_prometheus(metrics, prefix="musicvision_worker_pool"):
+    """
+    Render WorkerPool.metrics() in the Prometheus text exposition format.
+
+    Parameters:
+    metrics (dict): Output of WorkerPool.metrics
+    prefix (str): Metric name prefix
+
+    Returns:
+    str: Prometheus text format
+    """
+    lines = [
+        f"# HELP {prefix}_workers Worker processes in the pool",
+        f"# TYPE {prefix}_workers gauge",
+        f"{prefix}_workers {metrics['workers']}",
+        f"# HELP {prefix}_busy Worker processes running a task",
+        f"# TYPE {prefix}_busy gauge",
+        f"{prefix}_busy {metrics['busy']}",
+        f"# HELP {prefix}_utilization Share of worker time spent running tasks since the pool started",
+        f"# TYPE {prefix}_utilization gauge",
+        f"{prefix}_utilization {metrics['utilization']}",
+        f"# HELP {prefix}_tasks_total Tasks finished, by outcome",
+        f"# TYPE {prefix}_tasks_total counter",
+    ]
+    lines += [f'{prefix}_tasks_total{{outcome="{outcome}"}} {count}' for outcome, count in metrics["tasks"].items()]
+    lines += [
+        f"# HELP {prefix}_recycled_total Worker processes replaced after running max_tasks tasks",
+        f"# TYPE {prefix}_recycled_total counter",
+        f"{prefix}_recycled_total {metrics['recycled']}",
+        f"# HELP {prefix}_peak_rss_bytes Largest resident memory sampled from a worker during a task",
+        f"# TYPE {prefix}_peak_rss_bytes gauge",
+        f"{prefix}_peak_rss_bytes {metrics['peak_rss_bytes']}",
+    ]
+    lines += histogram_to_prometheus(f"{prefix}_wait_seconds", "Time tasks waited for a ready worker process",
+                                     metrics["wait_seconds"])
+    return "\n".join(lines) + "\n"
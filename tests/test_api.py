@@ -0,0 +1,111 @@
+"""
+Request validation and admission of the HTTP analysis API.
+"""
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from api import AnalysisServer, RequestError, request_settings
+from audio_analyzer import AudioAnalyzer
+from jobs import RUNNING, JobQueue
+from test_jobs import Blocking, _wait_for
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    return AudioAnalyzer(sample_rates=[22050])
+
+
+@pytest.fixture
+def server(analyzer):
+    server = AnalysisServer(("127.0.0.1", 0), analyzer, JobQueue(max_workers=1, max_pending=1))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.jobs.shutdown(wait=False)
+    server.server_close()
+
+
+def _wav(seconds=3.0, sr=22050):
+    t = np.arange(int(seconds * sr)) / sr
+    buffer = io.BytesIO()
+    sf.write(buffer, (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sr, format="WAV")
+    return buffer.getvalue()
+
+
+def _post(server, path, data):
+    request = urllib.request.Request(f"http://127.0.0.1:{server.server_address[1]}{path}", data=data)
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.status, dict(response.headers), json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), json.loads(e.read())
+
+
+@pytest.mark.parametrize("query", [
+    "resample=bogus&sr=44100",
+    "resample=bogus",
+    "duration=preview&sr=-5",
+    "sr=0",
+    "duration=nan",
+    "duration=inf",
+    "duration=-1",
+    "sr=abc",
+])
+def test_invalid_settings_are_rejected_with_400(query):
+    with pytest.raises(RequestError) as error:
+        request_settings(query)
+    assert error.value.status == 400
+
+
+@pytest.mark.parametrize("query, settings", [
+    ("", (22050, 30, "soxr_hq")),
+    ("duration=0&resample=native", (None, None, "soxr_hq")),
+    ("duration=12.5&sr=44100&resample=fast", (44100, 12.5, "soxr_lq")),
+    ("duration=preview&resample=polyphase", (22050, "preview", "polyphase")),
+])
+def test_settings(query, settings):
+    assert request_settings(query) == settings
+
+
+def test_analyze_returns_the_result(server):
+    status, _, body = _post(server, "/analyze?filename=tone.wav&duration=0", _wav())
+    assert status == 200
+    assert "genre" in body and "technical" in body
+    assert "_vector" not in body
+
+
+def test_full_queue_is_answered_with_429(server):
+    # One analysis running and one waiting fill a queue with max_workers=1 and max_pending=1
+    compute = Blocking()
+    running = server.jobs.get(server.jobs.submit("running", compute))
+    _wait_for(running, RUNNING)
+    server.jobs.submit("waiting", compute)
+    try:
+        status, headers, body = _post(server, "/analyze?filename=tone.wav", _wav())
+    finally:
+        compute.release.set()
+    assert status == 429
+    assert headers["Retry-After"] == "5"
+    assert "waiting" in body["error"]
+
+
+def test_requests_past_the_admission_limit_are_refused_before_reading_the_body(server):
+    slots = 0
+    while server.admission.acquire(blocking=False):
+        slots += 1
+    try:
+        status, headers, body = _post(server, "/analyze?filename=tone.wav", _wav())
+    finally:
+        for _ in range(slots):
+            server.admission.release()
+    assert slots == server.jobs.max_workers + server.jobs.max_pending
+    assert status == 429
+    assert headers["Retry-After"] == "5"
+    assert body == {"error": "Too many concurrent requests"}
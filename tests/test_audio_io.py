@@ -0,0 +1,23 @@
+"""
+Slices of cached decodes must be the samples librosa.load would decode.
+"""
+import io
+
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_io import _slice
+
+SR = 22050
+
+
+@pytest.mark.parametrize("offset, duration", [(0.0, None), (0.00003, 1.00003), (1.23456, 0.77777), (2.5, None)])
+def test_slice_matches_librosa_load(offset, duration):
+    y = np.random.default_rng(0).standard_normal(5 * SR).astype(np.float32)
+    buffer = io.BytesIO()
+    sf.write(buffer, y, SR, format="WAV", subtype="FLOAT")
+    buffer.seek(0)
+    expected, _ = librosa.load(buffer, sr=None, offset=offset, duration=duration)
+    np.testing.assert_array_equal(_slice(y, SR, offset, duration), expected)
@@ -0,0 +1,105 @@
+"""
+JobQueue: deduplication of identical submissions, the result cache and the concurrency caps.
+"""
+import threading
+import time
+
+import pytest
+
+from analysis_cache import AnalysisCache
+from jobs import DONE, QUEUED, RUNNING, JobQueue, QueueFull
+
+
+class Blocking:
+    """Compute function that counts its calls and runs until released."""
+
+    def __init__(self, result=None):
+        self.calls = 0
+        self.running = 0
+        self.most_running = 0
+        self.release = threading.Event()
+        self.result = result or {"value": 1}
+        self._lock = threading.Lock()
+
+    def __call__(self, timer):
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        self.release.wait(10)
+        with self._lock:
+            self.running -= 1
+        return dict(self.result)
+
+
+def _wait_for(job, status):
+    deadline = time.monotonic() + 10
+    while job.status != status:
+        assert time.monotonic() < deadline, f"job stayed {job.status}"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(max_workers=1, max_pending=1)
+    yield queue
+    queue.shutdown(wait=False)
+
+
+def test_identical_submissions_share_one_job(queue):
+    compute = Blocking()
+    first = queue.submit("key", compute)
+    second = queue.submit("key", compute)
+    assert first == second
+
+    compute.release.set()
+    job = queue.get(first)
+    assert job.wait(10)
+    assert job.status == DONE and job.result == {"value": 1}
+    assert compute.calls == 1
+
+
+def test_finished_results_are_served_from_the_cache(tmp_path):
+    queue = JobQueue(max_workers=1, cache=AnalysisCache(str(tmp_path)))
+    compute = Blocking()
+    compute.release.set()
+    assert queue.get(queue.submit("key", compute)).wait(10)
+
+    job = queue.get(queue.submit("key", compute))
+    assert job.status == DONE and job.served_from_cache
+    assert job.result == {"value": 1}
+    assert compute.calls == 1
+    queue.shutdown()
+
+
+def test_submissions_past_max_pending_raise_queue_full(queue):
+    compute = Blocking()
+    running = queue.get(queue.submit("running", compute))
+    _wait_for(running, RUNNING)
+    waiting = queue.get(queue.submit("waiting", compute))
+    assert waiting.status == QUEUED
+
+    with pytest.raises(QueueFull):
+        queue.submit("refused", compute)
+    # Joining a job that is already queued doesn't need a free slot
+    assert queue.submit("waiting", compute) == waiting.id
+
+    compute.release.set()
+    assert waiting.wait(10)
+    assert compute.calls == 2
+
+
+def test_max_workers_caps_concurrent_analyses():
+    queue = JobQueue(max_workers=2)
+    compute = Blocking()
+    jobs = [queue.get(queue.submit(f"key{i}", compute)) for i in range(5)]
+    _wait_for(jobs[0], RUNNING)
+    _wait_for(jobs[1], RUNNING)
+    time.sleep(0.1)
+    assert compute.running == 2
+
+    compute.release.set()
+    assert all(job.wait(10) for job in jobs)
+    assert compute.most_running == 2
+    assert queue.counts()[DONE] == 5
+    queue.shutdown()
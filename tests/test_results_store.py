@@ -0,0 +1,115 @@
+"""
+Parquet results store: queries, and what a killed or restarted writer leaves behind.
+"""
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import results_store
+from results_store import ResultsStore
+
+
+def _record(i, genre="Rock", bpm=120, energy="High"):
+    return {
+        "path": f"track-{i}.mp3",
+        "seconds": 1.0,
+        "result": {
+            "genre": {"main_genre": genre, "confidence": 80, "elements": "guitar"},
+            "mood": {"Bold": 90},
+            "instruments": ["Guitar"],
+            "energy": {"text": energy, "level": 0.9 if energy == "High" else 0.3, "variance": "Stable"},
+            "emotion": {"text": "Positive", "value": 0.7},
+            "use_cases": ["Workout"],
+            "vocal": {"instrumentation": "Vocal", "register": "Mid", "presence": "High", "autotune": "None"},
+            "technical": {"key": "A minor", "bpm": bpm, "beat_consistency": "0.80", "quality": "Good"},
+        },
+    }
+
+
+def _parts(path):
+    return sorted(name for name in os.listdir(path) if name.startswith("part-"))
+
+
+def test_query_count_and_aggregate(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    with store:
+        for i in range(30):
+            store.write(_record(i, genre="Jazz" if i % 3 == 0 else "Rock", bpm=80 + 3 * i,
+                                energy="High" if i % 2 else "Low"))
+        store.write({"path": "broken.mp3", "error": "NoBackendError", "seconds": 0.0})
+
+    assert store.count() == 31
+    assert store.count(["genre == Jazz"]) == 10
+    assert store.count(["bpm > 140", "energy == High"]) == len([i for i in range(30) if 80 + 3 * i > 140 and i % 2])
+    assert store.query(["error ~ Backend"], columns=["path"]).column("path").to_pylist() == ["broken.mp3"]
+    assert store.query(limit=5).num_rows == 5
+
+    # Failed tracks are left out of the summaries
+    summary = store.aggregate(["genre"]).to_pylist()
+    assert [(row["genre"], row["tracks"]) for row in summary] == [("Rock", 20), ("Jazz", 10)]
+
+
+def test_killed_writer_keeps_finished_parts(tmp_path):
+    store = ResultsStore(str(tmp_path), part_rows=100)
+    store.__enter__()
+    for i in range(250):
+        store.write(_record(i))
+    # Killed before __exit__: the 50 buffered rows are lost, the finished parts are not
+
+    restarted = ResultsStore(str(tmp_path), part_rows=100)
+    done = restarted.existing_paths()
+    assert done == {f"track-{i}.mp3" for i in range(200)}
+    with restarted:
+        for i in range(250):
+            if f"track-{i}.mp3" not in done:
+                restarted.write(_record(i))
+    assert restarted.count() == 250
+    assert len(_parts(str(tmp_path))) == 3
+
+
+def test_parts_are_merged_at_close(tmp_path):
+    store = ResultsStore(str(tmp_path), part_rows=100)
+    with store:
+        for i in range(450):
+            store.write(_record(i))
+    assert len(_parts(str(tmp_path))) == 1
+    assert store.count() == 450
+
+
+def test_crash_while_merging_counts_rows_once(tmp_path, monkeypatch):
+    store = ResultsStore(str(tmp_path), part_rows=100)
+    remove = os.remove
+
+    def crash_on_parts(path):
+        # Killed after linking the merged part, before removing the parts it replaces
+        if os.path.basename(path).startswith("part-"):
+            raise KeyboardInterrupt
+        remove(path)
+
+    monkeypatch.setattr(results_store.os, "remove", crash_on_parts)
+    with pytest.raises(KeyboardInterrupt):
+        with store:
+            for i in range(350):
+                store.write(_record(i))
+    monkeypatch.setattr(results_store.os, "remove", remove)
+
+    assert len(_parts(str(tmp_path))) == 5
+    assert store.count() == 350
+    # The next writer removes the replaced parts
+    with store:
+        pass
+    assert len(_parts(str(tmp_path))) == 1
+    assert store.count() == 350
+
+
+def test_new_part_never_overwrites_an_existing_one(tmp_path):
+    for i in range(3):
+        with ResultsStore(str(tmp_path)) as store:
+            store.write(_record(i))
+    os.remove(os.path.join(str(tmp_path), "part-00001.parquet"))
+    with ResultsStore(str(tmp_path)) as first, ResultsStore(str(tmp_path)) as second:
+        first.write(_record(10))
+        second.write(_record(11))
+    assert ResultsStore(str(tmp_path)).existing_paths() == {f"track-{i}.mp3" for i in (0, 2, 10, 11)}
@@ -0,0 +1,79 @@
+"""
+Feature-vector store and nearest-neighbour search.
+"""
+import numpy as np
+import pytest
+
+from features import VECTOR_DIM
+from similarity import SimilarityIndex, VectorStore, split_vector
+
+
+def _metadata(name):
+    return {"name": name, "genre": "Rock", "key": "A minor", "bpm": 120, "mood": "Bold"}
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).standard_normal((50, VECTOR_DIM)).astype(np.float32)
+
+
+@pytest.fixture
+def store(tmp_path, vectors):
+    store = VectorStore(str(tmp_path))
+    store.add_many((f"track{i}", vector, _metadata(f"track{i}")) for i, vector in enumerate(vectors))
+    return store
+
+
+def test_tracks_are_stored_once_per_key(store, vectors):
+    assert len(store) == 50
+    assert store.add("track3", vectors[0], _metadata("again")) == 3
+    assert len(store) == 50
+    np.testing.assert_array_equal(store.vector("track3"), vectors[3])
+    assert store.vector("unknown") is None
+    assert store.metadata([3])[3]["name"] == "track3"
+
+
+def test_wrong_vector_length_is_rejected(store):
+    with pytest.raises(ValueError):
+        store.add("short", np.zeros(VECTOR_DIM - 1), _metadata("short"))
+
+
+def test_other_instances_see_added_tracks(tmp_path, store, vectors):
+    # The app, the API and batch runs share one store directory
+    other = VectorStore(str(tmp_path))
+    other.add("new", vectors[0] + 1, _metadata("new"))
+    assert len(store) == 51
+    assert store.find("new") == 50
+
+
+def test_query_finds_the_nearest_tracks(store, vectors):
+    index = SimilarityIndex(store)
+    # Standardized distances, computed directly
+    scaled = (vectors - vectors.mean(axis=0)) / vectors.std(axis=0)
+    expected = np.argsort(np.linalg.norm(scaled - scaled[7], axis=1))[1:6]
+
+    neighbours = index.query(vectors[7], k=5, exclude="track7")
+    assert [neighbour["id"] for neighbour in neighbours] == list(expected)
+    assert [neighbour["distance"] for neighbour in neighbours] == sorted(n["distance"] for n in neighbours)
+    assert neighbours[0]["name"] == f"track{expected[0]}"
+    assert index.query(vectors[7], k=1)[0]["id"] == 7
+
+
+def test_query_picks_up_tracks_added_later(store, vectors):
+    index = SimilarityIndex(store)
+    index.query(vectors[0])
+    store.add("late", vectors[10] + 1e-3, _metadata("late"))
+    assert {neighbour["name"] for neighbour in index.query(vectors[10], k=2)} == {"track10", "late"}
+
+
+def test_empty_store_has_no_neighbours(tmp_path):
+    assert SimilarityIndex(VectorStore(str(tmp_path))).query(np.zeros(VECTOR_DIM)) == []
+
+
+def test_split_vector_leaves_the_result_untouched():
+    result = {"genre": {"main_genre": "Rock"}, "_vector": [0.5] * VECTOR_DIM}
+    stripped, vector = split_vector(result)
+    assert stripped == {"genre": {"main_genre": "Rock"}}
+    assert vector == [0.5] * VECTOR_DIM
+    assert "_vector" in result
+    assert split_vector(stripped) == (stripped, None)
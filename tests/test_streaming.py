@@ -0,0 +1,68 @@
+"""
+Streamed features must not depend on the block size and must track extract_features.
+"""
+import numpy as np
+import pytest
+
+from features import HOP_LENGTH, extract_features, signal_stats
+from streaming import stream_features
+
+SR = 22050
+
+
+@pytest.fixture(scope="module")
+def clicks():
+    # A tone with noise bursts every half second: 120 BPM
+    rng = np.random.default_rng(0)
+    t = np.arange(20 * SR) / SR
+    y = (0.2 * np.sin(2 * np.pi * 330 * t) + 0.02 * rng.standard_normal(len(t))).astype(np.float32)
+    burst = (np.hanning(400)[200:] * rng.standard_normal(200)).astype(np.float32)
+    for start in range(0, len(y), SR // 2):
+        y[start:start + 200] += 0.8 * burst
+    return y
+
+
+@pytest.fixture(scope="module")
+def reference(clicks):
+    return extract_features(clicks, SR)
+
+
+@pytest.mark.parametrize("block_seconds", [3.7, 10.0, 30.0])
+def test_streamed_features_match_extract_features(clicks, reference, block_seconds):
+    features, sr, stats = stream_features((clicks, SR), SR, block_seconds=block_seconds)
+    assert sr == SR
+    for name in ("spectral_centroid", "spectral_bandwidth", "spectral_rolloff", "zero_crossing_rate",
+                 "signal_power", "signal_var", "mfcc1_max"):
+        assert features[name] == pytest.approx(reference[name], rel=1e-3), name
+    np.testing.assert_allclose(features["mfcc_means"], reference["mfcc_means"], atol=1e-3)
+    np.testing.assert_allclose(features["chroma_means"], reference["chroma_means"], atol=1e-3)
+    # The running dB floor shifts the onset envelope a little, see the streaming module notes
+    assert features["tempo"] == pytest.approx(reference["tempo"], rel=0.01)
+    assert features["tempo"] == pytest.approx(120, abs=3)
+    assert stats == pytest.approx(signal_stats(clicks, SR))
+
+
+def test_resampled_stream_reports_the_target_rate(clicks):
+    features, sr, stats = stream_features((clicks, SR), 16000)
+    assert sr == 16000
+    assert stats["duration"] == pytest.approx(20.0, abs=0.01)
+    assert features["tempo"] == pytest.approx(120, abs=3)
+
+
+def test_mel_hook_sees_every_frame(clicks):
+    frames = []
+    features, _, _ = stream_features((clicks, SR), SR, visualizer=_MelCounter(frames))
+    # One frame per hop of the centered STFT
+    assert sum(frames) == 1 + len(clicks) // HOP_LENGTH
+
+
+class _MelCounter:
+    # The PyramidBuilder interface stream_features feeds
+    def __init__(self, frames):
+        self.frames = frames
+
+    def add_samples(self, block):
+        pass
+
+    def add_mel(self, mel_power):
+        self.frames.append(mel_power.shape[1])
@@ -0,0 +1,75 @@
+"""
+Supervised worker processes: limits, and starting workers under an unguarded __main__.
+"""
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from supervisor import WorkerCrashed, WorkerPool, WorkerTimeout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add(timer, a, b):
+    return a + b
+
+
+def sleep(timer, seconds):
+    time.sleep(seconds)
+
+
+def die(timer):
+    os._exit(3)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = WorkerPool(1, timeout=1.0)
+    yield pool
+    pool.shutdown()
+
+
+def test_run_returns_the_result(pool):
+    assert pool.run(add, 2, 3) == 5
+
+
+def test_timeout_kills_the_task_and_the_pool_recovers(pool):
+    with pytest.raises(WorkerTimeout):
+        pool.run(sleep, 10)
+    assert pool.run(add, 1, 1) == 2
+
+
+def test_crash_is_reported_and_the_pool_recovers(pool):
+    with pytest.raises(WorkerCrashed):
+        pool.run(die)
+    assert pool.run(add, 1, 1) == 2
+
+
+def test_workers_skip_an_unguarded_main(tmp_path):
+    # Streamlit runs app.py as __main__ without a guard; workers, including replacements,
+    # must not run it again, and multiprocessing must be left as it was
+    marker = tmp_path / "runs"
+    marker.mkdir()
+    script = f"import os\nopen(os.path.join({str(marker)!r}, str(os.getpid())), 'w').close()\n"
+    driver = textwrap.dedent(f"""
+        import multiprocessing.spawn, sys, types
+        sys.path[:0] = [{ROOT!r}, {os.path.dirname(__file__)!r}]
+        main = types.ModuleType("__main__")
+        main.__file__ = {str(tmp_path / "app.py")!r}
+        sys.modules["__main__"] = main
+        exec({script!r}, main.__dict__)
+        original = multiprocessing.spawn.get_preparation_data
+        from supervisor import WorkerPool
+        from test_supervisor import add
+        pool = WorkerPool(2, max_tasks=1)
+        assert [pool.run(add, i, 1) for i in range(4)] == [1, 2, 3, 4]
+        pool.shutdown()
+        assert multiprocessing.spawn.get_preparation_data is original
+    """)
+    (tmp_path / "app.py").write_text(script)
+    subprocess.run([sys.executable, "-c", driver], check=True, timeout=300)
+    assert len(os.listdir(marker)) == 1
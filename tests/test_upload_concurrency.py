@@ -0,0 +1,78 @@
+"""
+Concurrent uploads decode from private buffers, so simultaneous analyses of
+different files must give exactly what each file gives on its own.
+"""
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_analyzer import AudioAnalyzer
+from audio_io import load_audio
+from jobs import analyze_upload
+from profiling import StageTimer
+
+SR = 22050
+FORMATS = ("WAV", "FLAC", "MP3")
+THREADS = 8
+
+
+def _encode(y, fmt):
+    buffer = io.BytesIO()
+    sf.write(buffer, y, SR, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def uploads():
+    # A different tone per file, so any cross-talk between decodes changes the result
+    rng = np.random.default_rng(0)
+    t = np.arange(3 * SR) / SR
+    files = []
+    for i in range(6):
+        y = (0.3 * np.sin(2 * np.pi * (150 + 90 * i) * t) + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+        fmt = FORMATS[i % len(FORMATS)]
+        files.append((f"track{i}.{fmt.lower()}", _encode(y, fmt)))
+    return files
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    return AudioAnalyzer(sample_rates=[SR])
+
+
+def _run_concurrently(fn, items):
+    # Every item several times over, interleaved, on more threads than files
+    work = [item for _ in range(3) for item in items]
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        return list(pool.map(fn, work)), work
+
+
+def test_load_audio_concurrently_matches_sequential(uploads):
+    def load(upload):
+        filename, data = upload
+        return load_audio(data, SR, filename=filename)
+
+    expected = {filename: load((filename, data)) for filename, data in uploads}
+    results, work = _run_concurrently(load, uploads)
+    for (filename, _), (y, sr) in zip(work, results):
+        assert sr == expected[filename][1]
+        np.testing.assert_array_equal(y, expected[filename][0])
+
+
+@pytest.mark.parametrize("duration", [2, None], ids=["excerpt", "full"])
+def test_analyze_upload_concurrently_matches_sequential(uploads, analyzer, duration):
+    def analyze(upload):
+        filename, data = upload
+        result = analyze_upload(StageTimer(), analyzer, data, filename, SR, duration, "soxr_hq")
+        # Timings differ from run to run
+        result.pop("_timings")
+        return result
+
+    expected = {filename: analyze((filename, data)) for filename, data in uploads}
+    assert len({repr(result) for result in expected.values()}) > 1
+    results, work = _run_concurrently(analyze, uploads)
+    for (filename, _), result in zip(work, results):
+        assert result == expected[filename]
@@ -1,3 +1,5 @@
+import html
+
 import streamlit as st
 import numpy as np
 
@@ -77,3 +79,62 @@ def create_emotion_bar(value, labels=None):
         cols = container.columns(len(labels))
         for i, label in enumerate(labels):
             cols[i].write(label)
+
+def pills_html(labels, css_class="pill"):
+    """
+    Render labels as pills.
+
+    Parameters:
+    labels (list): Texts of the pills
+    css_class (str): Classes of each pill, styled by the app's stylesheet
+
+    Returns:
+    str: HTML
+    """
+    return "".join(f'<span class="{css_class}">{html.escape(str(label))}</span>' for label in labels)
+
+def progress_bar_html(value, labels=None):
+    """
+    Render a progress bar with an optional row of labels below it.
+
+    Parameters:
+    value (float): Value between 0 and 1
+    labels (list): Labels spread evenly under the bar
+
+    Returns:
+    str: HTML
+    """
+    bar = f'<div class="bar-track"><div class="bar-fill" style="width: {value * 100:.0f}%;"></div></div>'
+    if labels:
+        bar += '<div class="bar-labels">' + "".join(f"<span>{html.escape(label)}</span>" for label in labels) + "</div>"
+    return bar
+
+def emotion_bar_html(value):
+    """
+    Render the emotion bar (negative to positive).
+
+    Parameters:
+    value (float): Value between 0 and 1 (0 = negative, 1 = positive)
+
+    Returns:
+    str: HTML, styled by the app's stylesheet
+    """
+    return (
+        '<div class="emotion-container">'
+        f'<div class="emotion-level" style="width: {value * 100}%;"></div>'
+        f'<div class="emotion-marker" style="left: {value * 100}%;"></div>'
+        "</div>"
+    )
+
+def metric_html(title, value):
+    """
+    Render a titled metric.
+
+    Parameters:
+    title (str): Metric name
+    value: Metric value
+
+    Returns:
+    str: HTML
+    """
+    return f'<div class="metric-title">{html.escape(title)}</div><div class="metric-value">{html.escape(str(value))}</div>'
@@ -0,0 +1,428 @@
+"""
+Multi-resolution waveform and spectrogram views.
+
+Drawing a whole song sample by sample, or its full spectrogram, costs time
+and memory in proportion to its length, on every rerun. A TrackPyramid is
+built once per track instead, block by block:
+
+- a min/max envelope of the samples, ENVELOPE_SAMPLES samples per column at
+  the finest level;
+- a mel spectrogram in dB, quantized to 8 bits over the DB_RANGE below the
+  loudest column, SPECTROGRAM_FRAMES STFT frames per column at the finest
+  level (about 46 ms at 22050 Hz).
+
+Every further level halves the number of columns (min of mins, max of maxes,
+mean of dB values) until a level has at most MIN_COLUMNS. A view of any time
+range is read from the coarsest level that still has at least `width`
+columns in it and reduced to exactly `width`, so it never reads more than
+about twice that: drawing a whole hour costs the same as drawing 30 seconds.
+
+The full-song streaming analysis hands its mel spectrogram to a
+PyramidBuilder (see streaming.stream_features), so a track analyzed in full
+gets its pyramid without a second STFT. Otherwise build_pyramid decodes the
+track once more, block by block.
+
+PyramidStore keeps pyramids on disk as .npy files, read back memory-mapped
+and keyed by the upload's content hash. The least recently used are deleted
+once the store grows past MUSICVISION_PYRAMID_CACHE_MB (default 512).
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import librosa
+
+from analysis_cache import DEFAULT_CACHE_DIR
+from features import HOP_LENGTH, N_FFT, mel_basis
+from profiling import NULL_TIMER
+from streaming import iter_blocks
+
+# Rate of pyramids built for display only; the full-song analysis uses its own rate
+VIEW_SR = 22050
+ENVELOPE_SAMPLES = 256
+SPECTROGRAM_FRAMES = 2
+MIN_COLUMNS = 256
+DB_RANGE = 80.0
+
+DEFAULT_PYRAMID_CACHE_BYTES = int(os.environ.get("MUSICVISION_PYRAMID_CACHE_MB", "512")) * 2**20
+
+# Temporary directories untouched for this many seconds belong to a build that was killed
+_STALE_TEMP_SECONDS = 600
+
+# Spectrogram colours from silent to loud, interpolated into a 256 entry lookup table
+_PALETTE_STOPS = np.array([[14, 17, 23], [30, 58, 138], [74, 134, 232], [167, 139, 250], [250, 204, 21]])
+_PALETTE = np.stack([np.interp(np.linspace(0, len(_PALETTE_STOPS) - 1, 256), np.arange(len(_PALETTE_STOPS)),
+                               _PALETTE_STOPS[:, channel]) for channel in range(3)], axis=1).astype(np.uint8)
+
+
+def _halve(level, reduce):
+    # Pair up neighbouring columns, repeating the last one of an odd count
+    if level.shape[1] % 2:
+        level = np.concatenate([level, level[:, -1:]], axis=1)
+    return reduce(level.reshape(level.shape[0], -1, 2))
+
+
+def _envelope_pairs(pairs):
+    return np.stack([pairs[0].min(axis=1), pairs[1].max(axis=1)])
+
+
+def _spectrogram_pairs(pairs):
+    return ((pairs[..., 0].astype(np.uint16) + pairs[..., 1] + 1) // 2).astype(np.uint8)
+
+
+def _levels(finest, reduce):
+    levels = [finest]
+    while levels[-1].shape[1] > MIN_COLUMNS:
+        levels.append(_halve(levels[-1], reduce))
+    return levels
+
+
+class PyramidBuilder:
+    """
+    Builds a TrackPyramid from a signal fed in consecutive blocks.
+
+    Feed blocks with update(), or, when the caller computes a mel spectrogram
+    of the same frames anyway, with add_samples() and add_mel(). Then call
+    finish() once.
+    """
+
+    def __init__(self, sr):
+        """
+        Parameters:
+        sr (int): Sample rate of the blocks
+        """
+        self.sr = sr
+        self._n_samples = 0
+        self._held = np.zeros(0, dtype=np.float32)
+        self._mins = []
+        self._maxs = []
+        # Leading zeros give the frames of a centered STFT, like streaming.StreamingFeatureAccumulator
+        self._carry = np.zeros(N_FFT // 2, dtype=np.float32)
+        self._own_stft = False
+        self._mel_held = None
+        self._columns = []
+
+    def add_samples(self, block):
+        """
+        Add the next block of samples to the envelope.
+
+        Parameters:
+        block (numpy.ndarray): Mono samples following the previous block
+        """
+        block = np.asarray(block, dtype=np.float32)
+        self._n_samples += len(block)
+        samples = np.concatenate([self._held, block])
+        end = len(samples) // ENVELOPE_SAMPLES * ENVELOPE_SAMPLES
+        columns = samples[:end].reshape(-1, ENVELOPE_SAMPLES)
+        self._mins.append(columns.min(axis=1))
+        self._maxs.append(columns.max(axis=1))
+        self._held = samples[end:]
+
+    def add_mel(self, mel_power):
+        """
+        Add the next mel power spectrogram frames.
+
+        Parameters:
+        mel_power (numpy.ndarray): (mels, frames) power of the frames following the previous ones,
+            hop HOP_LENGTH, as features.mel_basis(sr) applied to a centered STFT
+        """
+        frames = mel_power if self._mel_held is None else np.concatenate([self._mel_held, mel_power], axis=1)
+        end = frames.shape[1] // SPECTROGRAM_FRAMES * SPECTROGRAM_FRAMES
+        if end:
+            pooled = frames[:, :end].reshape(frames.shape[0], -1, SPECTROGRAM_FRAMES).mean(axis=2)
+            self._columns.append((10 * np.log10(np.maximum(pooled, 1e-10))).astype(np.float16))
+        self._mel_held = frames[:, end:]
+
+    def update(self, block):
+        """
+        Add the next block of samples, computing its spectrogram frames.
+
+        Parameters:
+        block (numpy.ndarray): Mono samples following the previous block
+        """
+        self.add_samples(block)
+        self._own_stft = True
+        buffer = np.concatenate([self._carry, np.asarray(block, dtype=np.float32)])
+        if len(buffer) < N_FFT:
+            self._carry = buffer
+            return
+        n_frames = 1 + (len(buffer) - N_FFT) // HOP_LENGTH
+        self._add_frames(buffer[: (n_frames - 1) * HOP_LENGTH + N_FFT])
+        self._carry = buffer[n_frames * HOP_LENGTH:]
+
+    def _add_frames(self, buffer):
+        S = np.abs(librosa.stft(buffer, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False))
+        self.add_mel(mel_basis(self.sr) @ S ** 2)
+
+    def finish(self):
+        """
+        Close the last partial columns and build every level.
+
+        Returns:
+        TrackPyramid: The pyramid of everything added
+        """
+        if self._own_stft:
+            # The trailing frames of the centered STFT, padded with zeros like StreamingFeatureAccumulator.finalize
+            self._add_frames(np.concatenate([self._carry, np.zeros(N_FFT // 2, dtype=np.float32)]))
+            self._carry = np.zeros(0, dtype=np.float32)
+            self._own_stft = False
+        mins, maxs = self._mins, self._maxs
+        if len(self._held):
+            mins, maxs = mins + [self._held.min(keepdims=True)], maxs + [self._held.max(keepdims=True)]
+        envelope = np.stack([np.concatenate(mins), np.concatenate(maxs)]) if mins else np.zeros((2, 0), np.float32)
+
+        columns = list(self._columns)
+        if self._mel_held is not None and self._mel_held.shape[1]:
+            pooled = self._mel_held.mean(axis=1, keepdims=True)
+            columns.append((10 * np.log10(np.maximum(pooled, 1e-10))).astype(np.float16))
+        db = np.concatenate(columns, axis=1).astype(np.float32) if columns else np.zeros((128, 0), np.float32)
+        floor = (db.max() if db.size else 0.0) - DB_RANGE
+        spectrogram = np.round(np.clip((db - floor) / DB_RANGE, 0, 1) * 255).astype(np.uint8)
+
+        return TrackPyramid(self.sr, self._n_samples, _levels(envelope, _envelope_pairs),
+                            _levels(spectrogram, _spectrogram_pairs))
+
+
+class TrackPyramid:
+    """Envelope and spectrogram levels of one track, finest first."""
+
+    def __init__(self, sr, n_samples, envelope, spectrogram):
+        """
+        Parameters:
+        sr (int): Sample rate the pyramid was built at
+        n_samples (int): Length of the track in samples
+        envelope (list): (2, columns) min and max arrays, ENVELOPE_SAMPLES samples per column at level 0
+        spectrogram (list): (mels, columns) uint8 arrays, SPECTROGRAM_FRAMES frames per column at level 0
+        """
+        self.sr = sr
+        self.n_samples = n_samples
+        self.envelope = envelope
+        self.spectrogram = spectrogram
+
+    @property
+    def duration(self):
+        return self.n_samples / self.sr
+
+    def waveform(self, start, end, width):
+        """
+        Min/max envelope of a time range.
+
+        Parameters:
+        start (float): Seconds
+        end (float): Seconds
+        width (int): Columns wanted
+
+        Returns:
+        numpy.ndarray: (2, columns) minimum and maximum sample per column, at most width columns
+        """
+        def reduce(view, edges):
+            return np.stack([np.minimum.reduceat(view[0], edges), np.maximum.reduceat(view[1], edges)])
+        return self._view(self.envelope, ENVELOPE_SAMPLES, start, end, width, reduce)
+
+    def mel_spectrogram(self, start, end, width):
+        """
+        Mel spectrogram of a time range.
+
+        Parameters:
+        start (float): Seconds
+        end (float): Seconds
+        width (int): Columns wanted
+
+        Returns:
+        numpy.ndarray: (mels, columns) uint8 levels from DB_RANGE below the loudest column (0) to it (255),
+            lowest mel band first, at most width columns
+        """
+        def reduce(view, edges):
+            counts = np.diff(np.append(edges, view.shape[1]))
+            return (np.add.reduceat(view, edges, axis=1, dtype=np.uint32) // counts).astype(np.uint8)
+        return self._view(self.spectrogram, SPECTROGRAM_FRAMES * HOP_LENGTH, start, end, width, reduce)
+
+    def _view(self, levels, samples_per_column, start, end, width, reduce):
+        # The coarsest level that still has `width` columns in the range, so at most 2 * width are read
+        span = max(end - start, 0.0) * self.sr
+        level = 0
+        while level + 1 < len(levels) and span / (samples_per_column * 2 ** (level + 1)) >= width:
+            level += 1
+        step = samples_per_column * 2 ** level
+        first = int(max(start, 0.0) * self.sr // step)
+        last = max(first + 1, int(np.ceil(end * self.sr / step)))
+        # A copy, so the view doesn't keep the memory-mapped level alive
+        view = np.array(levels[level][:, first:last])
+        if view.shape[1] > width:
+            view = reduce(view, np.linspace(0, view.shape[1], width + 1)[:-1].astype(int))
+        return view
+
+
+def build_pyramid(source, sr=VIEW_SR, timer=NULL_TIMER):
+    """
+    Decode a track block by block into a TrackPyramid.
+
+    Parameters:
+    source (str, file-like or tuple): Audio file or decoded samples, see streaming.iter_blocks
+    sr (int): Sample rate of the pyramid
+    timer (StageTimer): Optional instrumentation; records "decode" and "visualization"
+
+    Returns:
+    TrackPyramid: The track's pyramid
+    """
+    builder = PyramidBuilder(sr)
+    blocks = iter_blocks(source, sr)
+    while True:
+        with timer.stage("decode"):
+            block = next(blocks, None)
+        if block is None:
+            break
+        with timer.stage("visualization"):
+            builder.update(block)
+    with timer.stage("visualization"):
+        return builder.finish()
+
+
+def _stretch(view, width):
+    # Repeat columns of a view narrower than the image, so zoomed-in views keep the image's shape
+    if width is None or not 0 < view.shape[1] < width:
+        return view
+    return view[:, np.arange(width) * view.shape[1] // width]
+
+
+def waveform_image(envelope, width=None, height=96, color=(74, 134, 232)):
+    """
+    Draw a min/max envelope as an RGB image.
+
+    Parameters:
+    envelope (numpy.ndarray): (2, columns) from TrackPyramid.waveform
+    width (int): Image width; narrower views are stretched to it, None to keep one pixel per column
+    height (int): Image height in pixels
+    color (tuple): RGB colour of the waveform
+
+    Returns:
+    numpy.ndarray: (height, width, 3) uint8 image on the spectrogram's background colour
+    """
+    envelope = _stretch(envelope, width)
+    mins, maxs = np.clip(envelope, -1.0, 1.0)
+    rows = (np.arange(height)[:, None] + 0.5) / height
+    # Half a pixel either way, so quiet passages still draw a line
+    inside = (rows >= (1 - maxs) / 2 - 0.5 / height) & (rows <= (1 - mins) / 2 + 0.5 / height)
+    image = np.empty((height, envelope.shape[1], 3), dtype=np.uint8)
+    image[:] = _PALETTE[0]
+    image[inside] = color
+    return image
+
+
+def spectrogram_image(spectrogram, width=None):
+    """
+    Colour a mel spectrogram view, low frequencies at the bottom.
+
+    Parameters:
+    spectrogram (numpy.ndarray): (mels, columns) uint8 from TrackPyramid.mel_spectrogram
+    width (int): Image width; narrower views are stretched to it, None to keep one pixel per column
+
+    Returns:
+    numpy.ndarray: (mels, width, 3) uint8 image
+    """
+    return _PALETTE[_stretch(spectrogram, width)[::-1]]
+
+
+class PyramidStore:
+    """
+    Disk store of TrackPyramids, read back memory-mapped.
+
+    Pyramids are written to a temporary directory and renamed into place, so
+    several threads and processes can share one store.
+    """
+
+    def __init__(self, cache_dir=os.path.join(DEFAULT_CACHE_DIR, "pyramids"), max_disk_bytes=DEFAULT_PYRAMID_CACHE_BYTES):
+        """
+        Parameters:
+        cache_dir (str): Directory holding one subdirectory per pyramid
+        max_disk_bytes (int): Size above which the least recently used pyramids are deleted
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._remove_stale_temp_dirs()
+
+    def get(self, key):
+        """
+        Load a pyramid.
+
+        Parameters:
+        key (str): Content hash of the upload
+
+        Returns:
+        TrackPyramid or None: The pyramid with memory-mapped levels, None if it isn't stored
+        """
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(path, "pyramid.json")) as f:
+                meta = json.load(f)
+            pyramid = TrackPyramid(
+                meta["sr"], meta["n_samples"],
+                [np.load(os.path.join(path, f"envelope{i}.npy"), mmap_mode="r") for i in range(meta["envelope_levels"])],
+                [np.load(os.path.join(path, f"spectrogram{i}.npy"), mmap_mode="r")
+                 for i in range(meta["spectrogram_levels"])],
+            )
+            # The directory's modification time records its last use for eviction
+            os.utime(path)
+        except (FileNotFoundError, NotADirectoryError):
+            # Missing, or evicted while it was being read
+            return None
+        return pyramid
+
+    def put(self, key, pyramid):
+        """
+        Store a pyramid, then evict the least recently used ones past max_disk_bytes.
+
+        Parameters:
+        key (str): Content hash of the upload
+        pyramid (TrackPyramid): Pyramid to store
+        """
+        path = os.path.join(self.cache_dir, key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(temp_path)
+        try:
+            for name, levels in (("envelope", pyramid.envelope), ("spectrogram", pyramid.spectrogram)):
+                for i, level in enumerate(levels):
+                    np.save(os.path.join(temp_path, f"{name}{i}.npy"), np.asarray(level))
+            with open(os.path.join(temp_path, "pyramid.json"), "w") as f:
+                json.dump({"sr": pyramid.sr, "n_samples": pyramid.n_samples, "envelope_levels": len(pyramid.envelope),
+                           "spectrogram_levels": len(pyramid.spectrogram)}, f)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Another process stored the same pyramid first
+                pass
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        self._evict(keep=key)
+
+    def _remove_stale_temp_dirs(self):
+        # A worker process killed for its time or memory limit leaves its partial pyramid behind
+        cutoff = time.time() - _STALE_TEMP_SECONDS
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.name.endswith(".tmp") and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def _evict(self, keep):
+        pyramids = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".tmp") or not entry.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                pyramids.append((entry.stat().st_mtime, size, entry.path, entry.name))
+            except FileNotFoundError:
+                pass
+        total = sum(size for _, size, _, _ in pyramids)
+        for _, size, path, name in sorted(pyramids):
+            if total <= self.max_disk_bytes:
+                break
+            if name != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
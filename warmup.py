@@ -0,0 +1,128 @@
+"""
+Ahead-of-time warm-up for the first analysis of a process.
+
+librosa's onset, tuning, spectral and pitch helpers are Numba-jitted, and a
+fresh process compiles them on first use: without compiled kernels on disk
+the first analysis takes about 30 seconds instead of a few tens of
+milliseconds. Numba can cache compiled kernels on disk, but only where it
+can write next to librosa's sources or in the user's home directory, which
+autoscaled containers usually throw away.
+
+enable_jit_cache points Numba at <MUSICVISION_CACHE_DIR>/numba, or
+NUMBA_CACHE_DIR when that is set, so kernels compiled once are loaded by
+every later process. warm_up then analyzes a short noise clip per sample
+rate, so lazy imports, loading the kernels and building filter banks happen
+before the first request rather than during it. The app, the API and batch
+workers do both at startup.
+
+Running this module fills the cache, e.g. while building an image, and
+reports the analyzer construction time and the first and steady-state
+latency per sample rate. Run it a second time to see what a fresh process
+pays once the cache is in place: the first-analysis latency should then be
+close to the steady state.
+
+Usage:
+    python -m warmup [--sr 22050 44100 48000] [--cache-dir DIR]
+
+Compiled kernels are specific to the CPU they were built on, and other CPUs
+recompile them. Set NUMBA_CPU_NAME=generic for both the build and the
+servers when images are built on different hardware than they run on.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from analysis_cache import DEFAULT_CACHE_DIR
+from audio_analyzer import AudioAnalyzer
+from classifiers import DEFAULT_CLASSIFIER, load_classifier
+
+SAMPLE_RATES = (22050, 44100, 48000)
+
+DEFAULT_JIT_CACHE_DIR = os.environ.get("NUMBA_CACHE_DIR") or os.path.join(DEFAULT_CACHE_DIR, "numba")
+
+
+def enable_jit_cache(path=DEFAULT_JIT_CACHE_DIR):
+    """
+    Keep Numba's compiled kernels in a directory that outlives the process.
+
+    Call it before the first AudioAnalyzer is built: librosa's jitted functions
+    pick their cache directory when their modules are first imported. Processes
+    started afterwards inherit the setting through the environment.
+
+    Parameters:
+    path (str): Cache directory
+
+    Returns:
+    str: Absolute path of the cache directory
+    """
+    path = os.path.abspath(path)
+    os.makedirs(path, exist_ok=True)
+    os.environ["NUMBA_CACHE_DIR"] = path
+    numba_config = sys.modules.get("numba.core.config")
+    if numba_config is not None:
+        # Numba reads the variable once, when imported; functions jitted from now on follow the new value
+        numba_config.CACHE_DIR = path
+    return path
+
+
+def warm_up(analyzer, sample_rates, seconds=2.0):
+    """
+    Analyze a short noise clip per sample rate so the first request doesn't pay
+    for lazy imports, JIT compilation and filter construction.
+
+    Each clip is analyzed twice: the first run carries the one-off costs, the
+    second shows the steady state.
+
+    Parameters:
+    analyzer (AudioAnalyzer): Analyzer to warm up
+    sample_rates (iterable): Rates to warm up
+    seconds (float): Length of the clips
+
+    Returns:
+    dict: Sample rate -> {"first_seconds", "steady_seconds"}
+    """
+    rng = np.random.default_rng(0)
+    report = {}
+    for sr in sample_rates:
+        y = (0.1 * rng.standard_normal(int(seconds * sr))).astype(np.float32)
+        latencies = []
+        for _ in range(2):
+            start = time.perf_counter()
+            analyzer.analyze_audio(y, sr)
+            latencies.append(time.perf_counter() - start)
+        report[sr] = {"first_seconds": round(latencies[0], 4), "steady_seconds": round(latencies[1], 4)}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sr", type=int, nargs="+", default=list(SAMPLE_RATES), help="Sample rates to warm up")
+    parser.add_argument("--cache-dir", default=DEFAULT_JIT_CACHE_DIR, help="Directory for compiled kernels")
+    parser.add_argument("--classifier", default=DEFAULT_CLASSIFIER,
+                        help="Genre/mood classifier: heuristic or the path of an .npz model")
+    args = parser.parse_args(argv)
+
+    cache_dir = enable_jit_cache(args.cache_dir)
+    cached_before = len(glob.glob(os.path.join(cache_dir, "**", "*.nbi"), recursive=True))
+
+    start = time.perf_counter()
+    analyzer = AudioAnalyzer(sample_rates=args.sr, classifier=load_classifier(args.classifier))
+    construct_seconds = time.perf_counter() - start
+    report = warm_up(analyzer, args.sr)
+
+    print(json.dumps({
+        "jit_cache_dir": cache_dir,
+        "cached_functions_before": cached_before,
+        "cached_functions": len(glob.glob(os.path.join(cache_dir, "**", "*.nbi"), recursive=True)),
+        "analyzer_seconds": round(construct_seconds, 4),
+        "sample_rates": report,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()